@@ -1,3 +1,37 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from blogapp.models import Article, Author, Category, Tag
+from mysite.testing import QueryBudgetMixin
+
+
+class ArticlesListViewTestCase(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(5):
+            article = Article.objects.create(
+                title=f"Article {index}",
+                author=Author.objects.create(name=f"Author {index}"),
+                category=Category.objects.create(name=f"Category {index}"),
+            )
+            article.tags.add(Tag.objects.create(name=f"Tag {index}"))
+
+    def test_articles_list_num_queries(self):
+        # Articles with authors and categories, then their tags
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("articles_list"))
+        self.assertContains(response, "Category 4")
+
+    def create_articles(self, count: int) -> None:
+        tag = Tag.objects.create(name=f"Tag {Tag.objects.count()}")
+        for index in range(count):
+            article = Article.objects.create(
+                title=f"Article {index}",
+                author=Author.objects.create(name=f"Author {index}"),
+                category=Category.objects.create(name=f"Category {index}"),
+            )
+            article.tags.add(tag)
+
+    def test_articles_list_query_budget(self):
+        self.assertQueryBudget(reverse("articles_list"), self.create_articles, queries=2, seconds=1)
@@ -5,9 +5,10 @@ from blogapp.models import Article
 
 
 class ArticlesListView(ListView):
+    read_replica = True
     queryset = (
         Article.objects
-        .select_related("author")
+        .select_related("author", "category")
         .prefetch_related("tags")
         .defer("content")
     )
@@ -1,5 +1,10 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 from django.urls import reverse
+from django.utils import translation
+
+from myauth.models import Profile
+from mysite.testing import QueryBudgetMixin
 
 
 class GetCookieViewTestCase(TestCase):
@@ -17,3 +22,33 @@ class FooBarViewTestCase(TestCase):
         )
         expected_data = {"foo": "bar", "spam": "eggs"}
         self.assertJSONEqual(response.content, expected_data)
+
+
+class UsersViewsTestCase(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+        Profile.objects.create(user=cls.user, bio="Bio")
+
+    def setUp(self) -> None:
+        self.client.force_login(self.user)
+
+    def url(self, name, **kwargs):
+        with translation.override("en"):
+            return reverse(name, kwargs=kwargs)
+
+    def create_users(self, count: int) -> None:
+        start = User.objects.count()
+        users = User.objects.bulk_create(User(username=f"user_{start + index}") for index in range(count))
+        Profile.objects.bulk_create(Profile(user=user, bio="Bio") for user in users)
+
+    def test_users_list_query_budget(self):
+        # The session, the user and the users with their profiles
+        self.assertQueryBudget(self.url("myauth:users"), self.create_users, queries=3, seconds=1)
+
+    def test_about_me_query_budget(self):
+        # The user with the profile, then the profile of the form
+        self.assertQueryBudget(
+            self.url("myauth:about-me", pk=self.user.pk), self.create_users, queries=4, seconds=1,
+        )
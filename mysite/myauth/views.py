@@ -41,7 +41,7 @@ class HelloView(View):
 class AboutMeView(DetailView):
 
     template_name = "myauth/about-me.html"
-    model = User
+    queryset = User.objects.select_related("profile")
     context_object_name = "user"
 
     def get_context_data(self, **kwargs):
@@ -63,7 +63,7 @@ class AboutMeView(DetailView):
 
 class UsersListView(LoginRequiredMixin, ListView):
     template_name = 'myauth/users.html'
-    model = User
+    queryset = User.objects.select_related("profile")
     context_object_name = "users"
 
 
@@ -90,14 +90,14 @@ class RegisterView(CreateView):
             password=password)
         login(request=self.request, user=user)
 
-        logger.info(f"Пользователь {user.username} прошёл аутентификацию!")
+        logger.info("Пользователь %s прошёл аутентификацию!", user.username)
         return response
 
 
 class MyLoginView(LoginView):
 
     def get_success_url(self):
-        logger.info(f'Пользователь {self.request.user.username} прошёл аутентификацию!')
+        logger.info("Пользователь %s прошёл аутентификацию!", self.request.user.username)
         return reverse(
             "myauth:about-me",
             kwargs={"pk": self.request.user.pk}
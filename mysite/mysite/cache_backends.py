@@ -0,0 +1,202 @@
+"""
+Двухуровневый кэш: LRU в памяти процесса перед общим кэшем.
+
+Пример настройки::
+
+    CACHES = {
+        "default": {
+            "BACKEND": "mysite.cache_backends.TwoTierCache",
+            "OPTIONS": {
+                "SHARED": "shared",           # алиас из CACHES или словарь с настройками кэша
+                "LOCAL_TIMEOUT": 2,           # сколько секунд локальная копия считается свежей
+                "LOCAL_MAX_BYTES": 32 << 20,  # общий размер локальных копий
+                "LOCAL_MAX_ENTRY_BYTES": 1 << 20,
+            },
+        },
+        "shared": {...},
+    }
+
+Рядом с каждым значением в общем кэше лежит штамп версии, он меняется
+при каждой записи. Когда локальная копия устаревает по LOCAL_TIMEOUT,
+из общего кэша читается только штамп; если он не изменился, копия
+продлевается без чтения и распаковки самого значения. Так другие
+воркеры видят запись не позже чем через LOCAL_TIMEOUT секунд,
+а свой воркер - сразу.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+from mysite import metrics
+
+_local_stores = {}
+_local_stores_lock = threading.Lock()
+
+
+class _LocalEntry(NamedTuple):
+    pickled: bytes
+    stamp: str | None
+    fresh_until: float
+
+
+class _LocalStore:
+    """Потокобезопасный LRU, ограниченный суммарным размером значений в байтах."""
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, _LocalEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> _LocalEntry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, pickled: bytes, stamp: str | None, fresh_until: float) -> None:
+        with self._lock:
+            self._pop(key)
+            if len(pickled) > self.max_entry_bytes:
+                return
+            self._entries[key] = _LocalEntry(pickled, stamp, fresh_until)
+            self.size += len(pickled)
+            while self.size > self.max_bytes:
+                self.size -= len(self._entries.popitem(last=False)[1].pickled)
+                metrics.incr("two_tier_cache.evictions")
+
+    def renew(self, key: str, fresh_until: float) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = entry._replace(fresh_until=fresh_until)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _pop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.pickled)
+
+
+class TwoTierCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared = options["SHARED"]
+        self.local_timeout = options.get("LOCAL_TIMEOUT", 2)
+        max_bytes = options.get("LOCAL_MAX_BYTES", 32 << 20)
+        max_entry_bytes = options.get("LOCAL_MAX_ENTRY_BYTES", 1 << 20)
+        name = location or (self._shared if isinstance(self._shared, str) else id(self._shared))
+        with _local_stores_lock:
+            self.local = _local_stores.setdefault(name, _LocalStore(max_bytes, max_entry_bytes))
+
+    @property
+    def shared(self) -> BaseCache:
+        if isinstance(self._shared, str):
+            return caches[self._shared]
+        if not hasattr(self, "_shared_cache"):
+            config = self._shared
+            self._shared_cache = import_string(config["BACKEND"])(config.get("LOCATION", ""), config)
+        return self._shared_cache
+
+    @staticmethod
+    def stamp_key(key: str) -> str:
+        return f"{key}:stamp"
+
+    def _remember(self, local_key: str, value, stamp: str | None, timeout) -> None:
+        fresh_for = self.local_timeout
+        if timeout is not None:
+            fresh_for = min(fresh_for, timeout)
+        if fresh_for <= 0:
+            self.local.delete(local_key)
+            return
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        self.local.put(local_key, pickled, stamp, time.monotonic() + fresh_for)
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get(self, key, default=None, version=None):
+        # Keys are validated on writes only: validating on every read
+        # costs more than the local lookup itself.
+        local_key = self.make_key(key, version)
+        entry = self.local.get(local_key)
+        if entry is not None:
+            if entry.fresh_until > time.monotonic():
+                metrics.incr("two_tier_cache.local_hits")
+                return pickle.loads(entry.pickled)
+            if entry.stamp is not None and self.shared.get(self.stamp_key(key), version=version) == entry.stamp:
+                metrics.incr("two_tier_cache.revalidations")
+                self.local.renew(local_key, time.monotonic() + self.local_timeout)
+                return pickle.loads(entry.pickled)
+
+        stamp_key = self.stamp_key(key)
+        found = self.shared.get_many([key, stamp_key], version=version)
+        if key not in found:
+            metrics.incr("two_tier_cache.misses")
+            self.local.delete(local_key)
+            return default
+        metrics.incr("two_tier_cache.shared_hits")
+        self._remember(local_key, found[key], found.get(stamp_key), self.local_timeout)
+        return found[key]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        local_key = self.make_and_validate_key(key, version)
+        stamp = uuid4().hex
+        self.shared.set_many({key: value, self.stamp_key(key): stamp}, timeout, version=version)
+        self._remember(local_key, value, stamp, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        local_key = self.make_and_validate_key(key, version)
+        if not self.shared.add(key, value, timeout, version=version):
+            return False
+        stamp = uuid4().hex
+        self.shared.set(self.stamp_key(key), stamp, timeout, version=version)
+        self._remember(local_key, value, stamp, timeout)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        self.make_and_validate_key(key, version)
+        self.shared.touch(self.stamp_key(key), timeout, version=version)
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.make_and_validate_key(key, version))
+        self.shared.delete(self.stamp_key(key), version=version)
+        return self.shared.delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(self.make_and_validate_key(key, version))
+        value = self.shared.incr(key, delta, version=version)
+        self.shared.set(self.stamp_key(key), uuid4().hex, None, version=version)
+        return value
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
@@ -0,0 +1,99 @@
+"""
+Защита от одновременного пересчёта (cache stampede) для дорогих значений в кэше.
+
+Значение хранится вместе со временем логического истечения и временем,
+которое ушло на его расчёт. После истечения запись ещё stale_timeout
+секунд лежит в кэше, и пока один вызывающий пересчитывает её под
+короткой блокировкой (cache.add), остальные получают старое значение.
+Если значения нет совсем, остальные ждут до ``wait`` секунд.
+Незадолго до истечения значение с растущей вероятностью пересчитывается
+заранее (алгоритм XFetch), так что до массового промаха обычно не доходит.
+"""
+
+import math
+import random
+import time
+from typing import Callable
+from uuid import uuid4
+
+from django.core.cache import BaseCache, cache as default_cache
+
+from mysite import metrics
+from mysite.db.routers import use_primary
+
+
+def _lock_key(key: str) -> str:
+    return f"{key}:lock"
+
+
+def _should_refresh(compute_time: float, expires_at: float, beta: float) -> bool:
+    # XFetch: 1 - random() is in (0, 1], so the log is defined and <= 0
+    return time.time() - compute_time * beta * math.log(1.0 - random.random()) >= expires_at
+
+
+def _compute_and_store(cache: BaseCache, key: str, compute: Callable, timeout: int, stale_timeout: int):
+    # Значение переживёт отставание реплики, поэтому считается по основной базе
+    use_primary()
+    started = time.monotonic()
+    value = compute()
+    compute_time = time.monotonic() - started
+    cache.set(key, (value, compute_time, time.time() + timeout), timeout + stale_timeout)
+    return value
+
+
+def get_or_compute(
+    key: str,
+    compute: Callable,
+    timeout: int,
+    *,
+    cache: BaseCache | None = None,
+    stale_timeout: int | None = None,
+    lock_timeout: int = 10,
+    wait: float = 2.0,
+    poll_interval: float = 0.05,
+    beta: float = 1.0,
+    metrics_name: str = "single_flight",
+):
+    """
+    Вернуть значение ``key`` из кэша, при необходимости посчитав его через ``compute()``.
+
+    ``timeout`` - сколько секунд значение считается свежим, ``stale_timeout``
+    (по умолчанию равен ``timeout``) - сколько после этого его можно отдавать,
+    пока другой запрос его пересчитывает. ``beta`` > 1 делает ранний пересчёт
+    вероятнее, 0 - отключает его.
+    """
+    cache = cache or default_cache
+    if stale_timeout is None:
+        stale_timeout = timeout
+
+    envelope = cache.get(key)
+    if envelope is not None:
+        value, compute_time, expires_at = envelope
+        if not _should_refresh(compute_time, expires_at, beta):
+            metrics.incr(f"{metrics_name}.hits")
+            return value
+
+    token = uuid4().hex
+    if cache.add(_lock_key(key), token, lock_timeout):
+        metrics.incr(f"{metrics_name}.misses" if envelope is None else f"{metrics_name}.refreshes")
+        try:
+            return _compute_and_store(cache, key, compute, timeout, stale_timeout)
+        finally:
+            if cache.get(_lock_key(key)) == token:
+                cache.delete(_lock_key(key))
+
+    if envelope is not None:
+        metrics.incr(f"{metrics_name}.stale_hits")
+        return envelope[0]
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        envelope = cache.get(key)
+        if envelope is not None:
+            metrics.incr(f"{metrics_name}.waited_hits")
+            return envelope[0]
+
+    # The lock holder is too slow or has died: do not keep the request waiting
+    metrics.incr(f"{metrics_name}.wait_timeouts")
+    return _compute_and_store(cache, key, compute, timeout, stale_timeout)
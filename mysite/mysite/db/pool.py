@@ -0,0 +1,222 @@
+"""
+Пул соединений с базой в памяти процесса.
+
+Пул ничего не знает о конкретной базе: соединение создаёт ``connect()``,
+перед выдачей проверяет ``check(conn)``, при возврате приводит в
+исходное состояние ``reset(conn)`` (например, откатывает незавершённую
+транзакцию). Если ``check`` или ``reset`` падают, соединение
+закрывается, а вместо него берётся или создаётся другое.
+
+Соединение старше ``max_lifetime`` (с разбросом до 10%, чтобы все они не
+пересоздавались одновременно) закрывается при возврате или выдаче,
+простаивающие дольше ``max_idle`` - если их больше ``min_size``.
+Когда заняты все ``max_size`` соединений, getconn() ждёт до ``timeout``
+секунд и бросает PoolTimeout.
+
+Метрики mysite.metrics: ``db_pool.<name>.wait_seconds`` (ожидание
+getconn() вместе с подключением), ``.checkouts``, ``.connects``,
+``.discarded``, ``.check_failures``, ``.timeouts``.
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, NamedTuple
+
+from mysite import metrics
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Idle(NamedTuple):
+    conn: Any
+    expires_at: float
+    idle_since: float
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        *,
+        check: Callable[[Any], None] | None = None,
+        reset: Callable[[Any], None] | None = None,
+        close: Callable[[Any], None] = lambda conn: conn.close(),
+        min_size: int = 0,
+        max_size: int = 10,
+        max_lifetime: float = 3600,
+        max_idle: float = 600,
+        check_interval: float = 0,
+        timeout: float = 10,
+        name: str = "default",
+    ):
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+        self.connect = connect
+        self.check = check
+        self.reset = reset
+        self.close_conn = close
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.name = name
+        self.pid = os.getpid()
+
+        # Открытые соединения: свободные и выданные
+        self.size = 0
+        self._idle: list[_Idle] = []
+        self._expires_at: dict[int, float] = {}
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def metric(self, name: str) -> str:
+        return f"db_pool.{self.name}.{name}"
+
+    def fill(self) -> None:
+        """Открыть соединения до min_size."""
+        while True:
+            with self._condition:
+                if self._closed or self.size >= self.min_size:
+                    return
+                self.size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._forget()
+                raise
+            self.putconn(conn)
+
+    def getconn(self) -> Any:
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            conn, idle_since = self._take(deadline)
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+            elif self.check and time.monotonic() - idle_since >= self.check_interval:
+                try:
+                    self.check(conn)
+                except Exception:
+                    metrics.incr(self.metric("check_failures"))
+                    self._discard(conn)
+                    continue
+            metrics.observe(self.metric("wait_seconds"), time.monotonic() - started)
+            metrics.incr(self.metric("checkouts"))
+            return conn
+
+    def putconn(self, conn: Any, discard: bool = False) -> None:
+        now = time.monotonic()
+        expires_at = self._expires_at.get(id(conn))
+        if expires_at is None:
+            # Не из этого пула (например, пул пересоздан после fork)
+            self.close_conn(conn)
+            return
+        if discard or self._closed or now >= expires_at:
+            self._discard(conn)
+            return
+        if self.reset:
+            try:
+                self.reset(conn)
+            except Exception:
+                self._discard(conn)
+                return
+        with self._condition:
+            self._idle.append(_Idle(conn, expires_at, now))
+            self._condition.notify()
+
+    def close(self) -> None:
+        """Закрыть свободные соединения; выданные закроются при возврате."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for item in idle:
+            self._discard(item.conn)
+
+    def _take(self, deadline: float) -> tuple[Any, float]:
+        """Свободное соединение или (None, 0), если можно открыть новое."""
+        expired = []
+        try:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        # Последнее возвращённое: его реже всего закрывает сервер
+                        item = self._idle.pop()
+                        if now >= item.expires_at:
+                            expired.append(item.conn)
+                            continue
+                        self._close_idle(now, expired)
+                        return item.conn, item.idle_since
+                    if self.size - len(expired) < self.max_size:
+                        self.size += 1
+                        return None, 0
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        metrics.incr(self.metric("timeouts"))
+                        raise PoolTimeout(
+                            f"No free connection in pool {self.name!r} (max_size={self.max_size}) "
+                            f"after {self.timeout}s"
+                        )
+                    self._condition.wait(remaining)
+        finally:
+            for conn in expired:
+                self._discard(conn)
+
+    def _close_idle(self, now: float, expired: list) -> None:
+        # Свободные лежат от давно простаивающих к недавним
+        while self._idle and now - self._idle[0].idle_since > self.max_idle \
+                and self.size - len(expired) > self.min_size:
+            expired.append(self._idle.pop(0).conn)
+
+    def _connect(self) -> Any:
+        conn = self.connect()
+        lifetime = self.max_lifetime * random.uniform(0.9, 1.0)
+        self._expires_at[id(conn)] = time.monotonic() + lifetime
+        metrics.incr(self.metric("connects"))
+        return conn
+
+    def _discard(self, conn: Any) -> None:
+        self._expires_at.pop(id(conn), None)
+        metrics.incr(self.metric("discarded"))
+        try:
+            self.close_conn(conn)
+        except Exception:
+            pass
+        self._forget()
+
+    def _forget(self) -> None:
+        with self._condition:
+            self.size -= 1
+            self._condition.notify()
+
+
+_pools: dict[Any, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, factory: Callable[[], ConnectionPool]) -> ConnectionPool:
+    """Пул процесса для ``key``; после fork создаётся новый."""
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            # Соединения родителя после fork не закрываем: они общие с ним
+            pool = _pools[key] = factory()
+        return pool
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        pools = [pool for pool in _pools.values() if pool.pid == os.getpid()]
+        _pools.clear()
+    for pool in pools:
+        pool.close()
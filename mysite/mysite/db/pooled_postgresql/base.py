@@ -0,0 +1,137 @@
+"""
+Бэкенд PostgreSQL с пулом соединений в процессе (mysite.db.pool).
+
+Вместо открытия соединения на каждый запрос Django берёт соединение из
+пула, а при закрытии (в конце запроса, CONN_MAX_AGE = 0) возвращает его
+обратно. Каждый поток и каждый асинхронный контекст, как и раньше,
+работает со своим DatabaseWrapper, а пул общий на процесс, так что
+max_size - это предел соединений одного воркера gunicorn при любом
+числе потоков.
+
+Настройка::
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "mysite.db.pooled_postgresql",
+            ...,
+            "POOL": {
+                "MIN_SIZE": 1,         # открываются в фоне при создании пула
+                "MAX_SIZE": 10,
+                "MAX_LIFETIME": 1800,  # секунд, потом соединение пересоздаётся
+                "MAX_IDLE": 300,       # лишние сверх MIN_SIZE закрываются после простоя
+                "CHECK_INTERVAL": 0,   # SELECT 1 при выдаче, если простаивало дольше
+                "TIMEOUT": 10,         # сколько ждать свободное соединение
+            },
+        },
+    }
+"""
+
+import logging
+import threading
+
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+
+from mysite.db.pool import ConnectionPool, PoolTimeout, close_pools, get_pool
+
+logger = logging.getLogger(__name__)
+
+Database = base.Database
+
+
+def _check(conn) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    _rollback(conn)
+
+
+def _rollback(conn) -> None:
+    if conn.closed:
+        raise Database.InterfaceError("connection already closed")
+    if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+
+
+def _reset(conn) -> None:
+    # Следующему владельцу не должны достаться SET, временные таблицы,
+    # advisory-блокировки, открытые курсоры и LISTEN прежнего.
+    # Часовой пояс Django снова выставляет при подключении (init_connection_state).
+    _rollback(conn)
+    autocommit = conn.autocommit
+    # DISCARD ALL нельзя выполнить внутри транзакции
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DISCARD ALL")
+    finally:
+        conn.autocommit = autocommit
+
+
+def _fill(pool: ConnectionPool) -> None:
+    try:
+        pool.fill()
+    except Exception:
+        logger.warning("Could not open %s connections for pool %r", pool.min_size, pool.name, exc_info=True)
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Свободные соединения пула к тестовой базе не дают её удалить
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params: dict) -> ConnectionPool:
+        options = self.settings_dict.get("POOL", {})
+        # Не только алиас: _nodb_cursor() и тестовая база подключаются к другим базам
+        key = (self.alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+
+        def create_pool() -> ConnectionPool:
+            pool = ConnectionPool(
+                lambda: self.connect_database(conn_params),
+                check=_check,
+                reset=_reset,
+                min_size=options.get("MIN_SIZE", 0),
+                max_size=options.get("MAX_SIZE", 10),
+                max_lifetime=options.get("MAX_LIFETIME", 1800),
+                max_idle=options.get("MAX_IDLE", 300),
+                check_interval=options.get("CHECK_INTERVAL", 0),
+                timeout=options.get("TIMEOUT", 10),
+                name=self.alias,
+            )
+            if pool.min_size:
+                threading.Thread(target=_fill, args=(pool,), name=f"db-pool-{self.alias}", daemon=True).start()
+            return pool
+
+        return get_pool(key, create_pool)
+
+    def connect_database(self, conn_params: dict):
+        # То же, что base.DatabaseWrapper.get_new_connection(), но без
+        # self.isolation_level: соединение может достаться другому потоку
+        connection = Database.connect(**conn_params)
+        isolation_level = self.settings_dict["OPTIONS"].get("isolation_level")
+        if isolation_level is not None and isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        try:
+            connection = self.pool.getconn()
+        except PoolTimeout as exc:
+            raise Database.OperationalError(str(exc)) from exc
+        self.isolation_level = self.settings_dict["OPTIONS"].get("isolation_level", connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # Закрытое посреди atomic() соединение Django ещё держит, в пул его не возвращаем
+        discard = self.in_atomic_block or self.connection.closed
+        with self.wrap_database_errors:
+            self.pool.putconn(self.connection, discard=discard)
@@ -0,0 +1,180 @@
+"""
+Чтение с реплик PostgreSQL.
+
+ReplicaRouter отправляет чтение на одну из реплик DATABASE_REPLICAS только
+внутри запроса, который разрешил ReplicaMiddleware:
+
+- метод GET, HEAD или OPTIONS;
+- представление согласилось читать с реплики: атрибут ``read_replica = True``
+  у класса (в том числе у ViewSet и Feed) или декоратор replica_reads
+  для функции; ``read_replica = False`` запрещает, остальные представления
+  читают по REPLICA_READS_BY_DEFAULT;
+- у клиента нет cookie REPLICA_STICKY_COOKIE: её ставит любой запрос с
+  записью или небезопасным методом на REPLICA_STICKY_SECONDS, чтобы после
+  создания заказа список заказов не показывал данные реплики без него.
+
+Внутри запроса после первой записи, внутри transaction.atomic() и после
+use_primary() всё читается с основной базы. use_primary() вызывают кэши
+(mysite.page_cache, mysite.cache_utils) перед расчётом значения: иначе
+отстающая реплика попала бы в кэш под новой версией ключа и жила бы там
+до истечения записи. Реплика с отставанием больше REPLICA_MAX_LAG
+секунд (проверяется не чаще раза в REPLICA_LAG_CHECK_INTERVAL) или
+недоступная не используется. Вне запросов (команды, тесты, сигналы после
+ответа) всё идёт в основную базу.
+"""
+
+import functools
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.http import HttpRequest
+
+from mysite import metrics
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Для PostgreSQL; если реплика догнала основную базу, отставание 0,
+# даже если записей давно не было
+_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class RoutingState:
+    def __init__(self, use_replica: bool = False):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+_state: ContextVar[RoutingState | None] = ContextVar("replica_routing", default=None)
+_lag_checked: dict[str, tuple[float, float]] = {}
+
+
+def replica_reads(view=None, *, allowed: bool = True):
+    """``@replica_reads`` или ``@replica_reads(allowed=False)`` для функций-представлений."""
+    if view is None:
+        return functools.partial(replica_reads, allowed=allowed)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return view(*args, **kwargs)
+
+    wrapper.read_replica = allowed
+    return wrapper
+
+
+def use_primary() -> None:
+    """До конца текущего запроса читать только с основной базы."""
+    state = _state.get()
+    if state is not None:
+        state.use_replica = False
+
+
+def view_reads_replica(view_func) -> bool:
+    for view in (view_func, getattr(view_func, "view_class", None), getattr(view_func, "cls", None)):
+        allowed = getattr(view, "read_replica", None)
+        if allowed is not None:
+            return allowed
+    return settings.REPLICA_READS_BY_DEFAULT
+
+
+def replica_lag(alias: str) -> float:
+    """Отставание реплики в секундах, inf - если она недоступна."""
+    now = time.monotonic()
+    checked_at, lag = _lag_checked.get(alias, (None, 0.0))
+    if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+    connection = connections[alias]
+    try:
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(_LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+        else:
+            lag = 0.0
+    except DatabaseError:
+        lag = float("inf")
+    _lag_checked[alias] = (now, lag)
+    return lag
+
+
+def _in_transaction() -> bool:
+    # Как transaction.Atomic для durable: atomic() из TestCase не считается
+    return any(not block._from_testcase for block in connections[DEFAULT_DB_ALIAS].atomic_blocks)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.wrote or _in_transaction():
+            return None
+        replicas = [
+            alias for alias in settings.DATABASE_REPLICAS
+            if replica_lag(alias) <= settings.REPLICA_MAX_LAG
+        ]
+        if not replicas:
+            metrics.incr("db_router.no_replica")
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        # None, а не "default": явный using() и миграции реплики остаются как есть
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest):
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+
+        if settings.DATABASE_REPLICAS and (state.wrote or request.method not in SAFE_METHODS):
+            sticky_seconds = settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(
+                settings.REPLICA_STICKY_COOKIE,
+                str(int(time.time() + sticky_seconds)),
+                max_age=sticky_seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    def process_view(self, request: HttpRequest, view_func, view_args, view_kwargs):
+        state = _state.get()
+        if state is None or not settings.DATABASE_REPLICAS:
+            return None
+        if request.method not in SAFE_METHODS or not view_reads_replica(view_func):
+            return None
+        if self.is_sticky(request):
+            metrics.incr("db_router.sticky_requests")
+            return None
+        state.use_replica = True
+        metrics.incr("db_router.replica_requests")
+        return None
+
+    def is_sticky(self, request: HttpRequest) -> bool:
+        try:
+            return int(request.COOKIES.get(settings.REPLICA_STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
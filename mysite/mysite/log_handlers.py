@@ -0,0 +1,115 @@
+"""
+Асинхронное логирование JSON-строками.
+
+AsyncStreamHandler кладёт записи в ограниченную очередь, а форматирует и
+пишет их в поток (stderr по умолчанию, откуда их забирает Docker и Loki)
+отдельный поток QueueListener. В потоке запроса остаётся только фильтрация
+и put_nowait: если очередь заполнена, запись отбрасывается и учитывается
+в счётчике метрик ``logging.dropped``.
+
+Сообщения форматируются лениво, в потоке слушателя, поэтому аргументы
+логирования не должны меняться после вызова logger.info(...).
+
+SamplingFilter пропускает только долю записей ниже WARNING от шумных
+логгеров вроде django.db.backends (отброшенные - ``logging.sampled_out``).
+"""
+
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+from mysite import metrics
+
+# Стандартные атрибуты LogRecord; всё остальное пришло через extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        data.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float = 0.01, name: str = ""):
+        super().__init__(name)
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or random.random() < self.rate:
+            return True
+        metrics.incr("logging.sampled_out")
+        return False
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Очередь может быть заполнена: ждём, пока слушатель её разберёт
+        self.queue.put(self._sentinel)
+
+
+class AsyncStreamHandler(QueueHandler):
+    def __init__(self, stream=None, maxsize: int = 10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream)
+        self.dropped = 0
+        self.closed = False
+        self.start_listener()
+        # После fork (gunicorn --preload) потока слушателя в дочернем процессе нет
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def start_listener(self) -> None:
+        if self.closed:
+            return
+        self.listener = _Listener(self.queue, self.target)
+        self.listener.start()
+
+    def after_fork(self) -> None:
+        # Очередь родителя в дочернем процессе может хранить его записи и
+        # захваченные мьютексы (fork посреди put/get) - берём новую
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.start_listener()
+
+    def setFormatter(self, fmt: logging.Formatter) -> None:
+        # Форматирует слушатель
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # emit() вызывается под self.lock
+            self.dropped += 1
+            metrics.incr("logging.dropped")
+
+    def close(self) -> None:
+        # Дописывает всё, что осталось в очереди
+        self.closed = True
+        if self.listener._thread is not None:
+            self.listener.stop()
+        self.target.close()
+        super().close()
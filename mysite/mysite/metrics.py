@@ -0,0 +1,48 @@
+"""
+Счётчики и таймеры для мониторинга.
+
+Значения хранятся в памяти процесса (как у клиента Prometheus): у каждого
+воркера gunicorn свои, поэтому в snapshot() есть pid.
+Отдаются представлением mysite.views.metrics_view.
+"""
+
+import os
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timers = defaultdict(lambda: {"count": 0, "total": 0.0, "max": 0.0})
+
+
+def incr(name: str, value: int = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, seconds: float) -> None:
+    with _lock:
+        timer = _timers[name]
+        timer["count"] += 1
+        timer["total"] += seconds
+        timer["max"] = max(timer["max"], seconds)
+
+
+def get(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "counters": dict(_counters),
+            "timers": {name: dict(timer) for name, timer in _timers.items()},
+        }
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _timers.clear()
@@ -0,0 +1,142 @@
+"""
+Учёт SQL-запросов запроса: количество, время в БД, повторяющиеся запросы.
+
+Для доли запросов SQL_INSPECTION_SAMPLE_RATE все запросы ко всем базам
+проходят через connection.execute_wrapper. Запросы сводятся к «отпечатку»
+(без литералов и с одинаковым видом IN-списков); если один отпечаток
+повторился SQL_INSPECTION_N_PLUS_ONE_THRESHOLD раз, это похоже на N+1,
+и запоминается место в коде проекта, откуда он выполняется.
+
+Итог пишется в логгер ``mysite.sql`` (WARNING при подозрении на N+1)
+короткой строкой, а подробности - полями записи через extra= (JsonFormatter
+выводит их отдельными ключами), и в метрики mysite.metrics с именем
+представления.
+Запросы, которые выполняются уже при отдаче StreamingHttpResponse,
+не учитываются.
+"""
+
+import hashlib
+import logging
+import random
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest
+
+from mysite import metrics
+
+logger = logging.getLogger("mysite.sql")
+
+_PROJECT_DIR = str(Path(settings.BASE_DIR).resolve())
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)")
+
+
+def fingerprint(sql: str) -> str:
+    """SQL без литералов, со свёрнутыми IN (%s, %s, ...)."""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    return _PLACEHOLDER_LIST.sub("(...)", sql)
+
+
+def _project_stack(limit: int = 5) -> list[str]:
+    frames = [
+        frame
+        for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(_PROJECT_DIR) and "site-packages" not in frame.filename
+    ]
+    return [f"{Path(frame.filename).name}:{frame.lineno} {frame.name}" for frame in frames[-limit:]]
+
+
+class QueryRecorder:
+    """Обёртка для connection.execute_wrapper, собирающая статистику запросов."""
+
+    def __init__(self, n_plus_one_threshold: int):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.count = 0
+        self.seconds = 0.0
+        self.fingerprints = Counter()
+        self.samples = {}
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            key = fingerprint(sql)
+            self.fingerprints[key] += 1
+            self.samples.setdefault(key, sql)
+            if self.fingerprints[key] == self.n_plus_one_threshold:
+                self.stacks[key] = _project_stack()
+
+    def duplicates(self) -> list[dict]:
+        return [
+            {
+                "fingerprint": hashlib.md5(key.encode()).hexdigest()[:12],
+                "count": count,
+                "sql": self.samples[key][:300],
+                **({"stack": self.stacks[key]} if key in self.stacks else {}),
+            }
+            for key, count in self.fingerprints.most_common()
+            if count > 1
+        ]
+
+    def n_plus_one(self) -> list[dict]:
+        return [duplicate for duplicate in self.duplicates() if duplicate["count"] >= self.n_plus_one_threshold]
+
+
+class QueryInspectionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.SQL_INSPECTION_SAMPLE_RATE
+        self.n_plus_one_threshold = settings.SQL_INSPECTION_N_PLUS_ONE_THRESHOLD
+
+    def __call__(self, request: HttpRequest):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        recorder = QueryRecorder(self.n_plus_one_threshold)
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        self.report(request, response, recorder)
+        return response
+
+    def report(self, request: HttpRequest, response, recorder: QueryRecorder) -> None:
+        match = request.resolver_match
+        view = (match.view_name or match._func_path) if match else "unresolved"
+        n_plus_one = recorder.n_plus_one()
+
+        metrics.incr("sql.sampled_requests")
+        metrics.incr(f"sql.queries.{view}", recorder.count)
+        metrics.observe(f"sql.db_seconds.{view}", recorder.seconds)
+        if n_plus_one:
+            metrics.incr(f"sql.n_plus_one.{view}")
+
+        record = {
+            "view": view,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": recorder.count,
+            "db_time_ms": round(recorder.seconds * 1000, 2),
+            "duplicates": recorder.duplicates()[:5],
+            "n_plus_one": n_plus_one,
+        }
+        logger.log(
+            logging.WARNING if n_plus_one else logging.INFO,
+            "%s %s: %s queries in %.2f ms", request.method, view, recorder.count, record["db_time_ms"],
+            extra=record,
+        )
@@ -0,0 +1,134 @@
+"""
+Выборочный кэш страниц.
+
+Представление подключается декоратором, в котором перечислены модели,
+от которых зависит страница::
+
+    @method_decorator(cache_page_for(Product), name="dispatch")
+    class ProductsListView(ListView):
+        ...
+
+В ключ входят язык, пользователь (все анонимные - один общий вариант,
+каждый вошедший - свой, т.к. страницы зависят от прав) и версии моделей.
+Версия модели меняется после коммита при сохранении или удалении её
+объектов; код, который пишет в обход сигналов (queryset.update(),
+bulk_create), вызывает invalidate_models() сам.
+
+Не кэшируются ответы не на GET/HEAD, с кодом не 200, с cookies
+и страницы, на которых использовался CSRF-токен.
+"""
+
+import hashlib
+import time
+from functools import wraps
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Model
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpRequest, HttpResponse
+from django.utils import translation
+
+from mysite import metrics
+from mysite.db.routers import use_primary
+
+CACHE_ALIAS = "default"
+
+
+def _version_key(model: type[Model]) -> str:
+    return f"page_cache_version:{model._meta.label_lower}"
+
+
+def get_models_version(models) -> str:
+    cache = caches[CACHE_ALIAS]
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Random, not a counter: an evicted version must not bring old pages back
+            cache.add(key, uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return "-".join(versions[key] for key in keys)
+
+
+def invalidate_models(*models: type[Model]) -> None:
+    caches[CACHE_ALIAS].set_many({_version_key(model): uuid4().hex for model in models}, None)
+    metrics.incr("page_cache.invalidations", len(models))
+
+
+def _invalidate_after_commit(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_models(sender))
+
+
+def _watch(model: type[Model]) -> None:
+    dispatch_uid = f"page_cache:{model._meta.label_lower}"
+    post_save.connect(_invalidate_after_commit, sender=model, dispatch_uid=dispatch_uid)
+    post_delete.connect(_invalidate_after_commit, sender=model, dispatch_uid=dispatch_uid)
+
+
+def get_page_cache_key(request: HttpRequest, models) -> str:
+    user = request.user
+    user_part = f"user{user.pk}" if user.is_authenticated else "anon"
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f"page_cache:{translation.get_language()}:{user_part}:{url}:{get_models_version(models)}"
+
+
+def _is_cacheable(request: HttpRequest, response: HttpResponse) -> bool:
+    return (
+        request.method == "GET"
+        and response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+        and not request.META.get("CSRF_COOKIE_USED")
+    )
+
+
+def cache_page_for(*models: type[Model], timeout: int | None = None):
+    """
+    Кэшировать страницу представления до изменения любой из ``models``,
+    но не дольше ``timeout`` секунд (по умолчанию PAGE_CACHE_TIMEOUT).
+    """
+    for model in models:
+        _watch(model)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request: HttpRequest, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            started = time.monotonic()
+            cache = caches[CACHE_ALIAS]
+            key = get_page_cache_key(request, models)
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type, render_seconds = cached
+                response = HttpResponse(content, content_type=content_type)
+                metrics.incr("page_cache.hits")
+                metrics.observe("page_cache.saved_seconds", max(render_seconds - (time.monotonic() - started), 0))
+                return response
+
+            metrics.incr("page_cache.misses")
+            # Страница сохранится под текущими версиями моделей: реплика могла их ещё не догнать
+            use_primary()
+            response = view(request, *args, **kwargs)
+
+            def store(response):
+                if _is_cacheable(request, response):
+                    render_seconds = time.monotonic() - started
+                    page_timeout = settings.PAGE_CACHE_TIMEOUT if timeout is None else timeout
+                    cache.set(key, (response.content, response["Content-Type"], render_seconds), page_timeout)
+                    metrics.observe("page_cache.render_seconds", render_seconds)
+                return response
+
+            if hasattr(response, "render") and callable(response.render) and not response.is_rendered:
+                response.add_post_render_callback(store)
+                return response
+            return store(response)
+
+        return wrapper
+
+    return decorator
@@ -12,7 +12,6 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 import os
 from os import getenv
 from pathlib import Path
-import logging.config
 
 from django.urls import reverse_lazy
 
@@ -83,6 +82,8 @@ SITE_ID = 1
 
 MIDDLEWARE = [
     # 'django.middleware.cache.UpdateCacheMiddleware',
+    'mysite.middleware.QueryInspectionMiddleware',
+    'mysite.db.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -122,25 +123,82 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # Пул соединений в процессе, см. mysite/db/pooled_postgresql/base.py
+        'ENGINE': 'mysite.db.pooled_postgresql',
         'NAME': os.environ.get('POSTGRES_NAME'),
         'USER': os.environ.get('POSTGRES_USER'),
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
         'HOST': 'db',
         'PORT': 5432,
+        'POOL': {
+            # На воркер gunicorn; MAX_SIZE не меньше числа его потоков
+            'MIN_SIZE': int(getenv('DJANGO_DB_POOL_MIN_SIZE', '1')),
+            'MAX_SIZE': int(getenv('DJANGO_DB_POOL_MAX_SIZE', '10')),
+            'MAX_LIFETIME': int(getenv('DJANGO_DB_POOL_MAX_LIFETIME', '1800')),
+            'TIMEOUT': float(getenv('DJANGO_DB_POOL_TIMEOUT', '10')),
+        },
     }
 }
 
+# Реплики только для чтения, см. mysite/db/routers.py:
+# DJANGO_DB_REPLICA_HOSTS=replica1,replica2
+DATABASE_REPLICA_HOSTS = [host for host in getenv('DJANGO_DB_REPLICA_HOSTS', '').split(',') if host]
+# Алиас replica есть всегда: в тестах это отдельная вторая база
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'HOST': DATABASE_REPLICA_HOSTS[0] if DATABASE_REPLICA_HOSTS else DATABASES['default']['HOST'],
+    'TEST': {'NAME': 'test_replica'},
+}
+for index, host in enumerate(DATABASE_REPLICA_HOSTS[1:], start=2):
+    DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'replica'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')] if DATABASE_REPLICA_HOSTS else []
+
+DATABASE_ROUTERS = ['mysite.db.routers.ReplicaRouter']
+REPLICA_READS_BY_DEFAULT = False
+REPLICA_MAX_LAG = float(getenv('DJANGO_DB_REPLICA_MAX_LAG', '5'))
+REPLICA_LAG_CHECK_INTERVAL = 1
+REPLICA_STICKY_SECONDS = int(getenv('DJANGO_DB_REPLICA_STICKY_SECONDS', '10'))
+REPLICA_STICKY_COOKIE = 'primary_db'
+
 
 CACHES = {
+    # Небольшой LRU в памяти воркера перед общим кэшем, см. mysite/cache_backends.py
     "default": {
-        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
-        "LOCATION": "/var/tmp/django_cache",
-    }
+        "BACKEND": "mysite.cache_backends.TwoTierCache",
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOCAL_TIMEOUT": 2,
+            "LOCAL_MAX_BYTES": 32 * 1024 * 1024,
+        },
+    },
+    # Общий для всех воркеров и реплик кэш; в проде - Redis или Memcached, например
+    # DJANGO_SHARED_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+    # DJANGO_SHARED_CACHE_LOCATION=redis://redis:6379
+    "shared": {
+        "BACKEND": getenv("DJANGO_SHARED_CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": getenv("DJANGO_SHARED_CACHE_LOCATION", "/var/tmp/django_cache"),
+    },
 }
 
 CACHE_MIDDLEWARE_SECONDS = 120
 
+# Кэш выгрузки заказов пользователя сбрасывается сигналами при изменении
+# заказов (shopapp.signals), поэтому может жить долго
+ORDERS_EXPORT_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Страницы с mysite.page_cache.cache_page_for сбрасываются при изменении
+# их моделей; таймаут ограничивает то, что сигналами не отследить (права и т.п.)
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Доля запросов, для которых считаются SQL-запросы и ищутся N+1
+# (mysite.middleware.QueryInspectionMiddleware), и сколько одинаковых
+# запросов за один HTTP-запрос считается N+1
+SQL_INSPECTION_SAMPLE_RATE = float(getenv("DJANGO_SQL_INSPECTION_SAMPLE_RATE", "1" if DEBUG else "0.01"))
+SQL_INSPECTION_N_PLUS_ONE_THRESHOLD = int(getenv("DJANGO_SQL_INSPECTION_N_PLUS_ONE_THRESHOLD", "10"))
+
+# Токен для /metrics/ (кроме staff-пользователей)
+METRICS_TOKEN = getenv("DJANGO_METRICS_TOKEN", "")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -201,6 +259,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_REDIRECT_URL = reverse_lazy("myauth:about-me")
 # LOGIN_URL = reverse_lazy("myauth:login")
 
+# Фоновые массовые действия админки, см. shopapp/bulk_actions.py
+BULK_ACTIONS_WORKERS = int(getenv("DJANGO_BULK_ACTIONS_WORKERS", "1"))
+BULK_ACTIONS_CHUNK_SIZE = int(getenv("DJANGO_BULK_ACTIONS_CHUNK_SIZE", "1000"))
+# True - выполнять сразу в запросе (тесты)
+BULK_ACTIONS_EAGER = False
+
+# Выше этого числа строк пагинаторы админки магазина и ?page= в API
+# показывают оценку PostgreSQL вместо COUNT(*), см. shopapp/pagination.py
+PAGINATOR_ESTIMATE_THRESHOLD = int(getenv("DJANGO_PAGINATOR_ESTIMATE_THRESHOLD", "10000"))
+
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
@@ -217,25 +285,50 @@ SPECTACULAR_SETTINGS = {
     "SERVE_INCLUDE_SCHEMA": False,
 }
 
+LOGLEVEL = getenv("DJANGO_LOGLEVEL", "info").upper()
+# json - для Loki, text - для чтения глазами
+LOG_FORMAT = getenv("DJANGO_LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(getenv("DJANGO_LOG_QUEUE_SIZE", "10000"))
+# Доля DEBUG/INFO записей django.db.backends, которые попадают в лог
+DB_LOG_SAMPLE_RATE = float(getenv("DJANGO_DB_LOG_SAMPLE_RATE", "0.01"))
+
 LOGGING = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'formatters': {
-        'verbose': {
-            'format': '%(levelname)s %(asctime)s %(name)s: %(message)s',
-        }
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {
+            "()": "mysite.log_handlers.JsonFormatter",
+        },
+        "text": {
+            "format": "%(asctime)s %(levelname)s [%(name)s:%(lineno)s] %(module)s %(message)s",
+        },
     },
-    'handlers': {
-        'file': {
-            'class': 'logging.FileHandler',
-            'filename': 'debug.log',
-            'formatter': 'verbose',
+    "filters": {
+        "sample": {
+            "()": "mysite.log_handlers.SamplingFilter",
+            "rate": DB_LOG_SAMPLE_RATE,
         },
     },
-    'root': {
-        'handlers': ['file'],
-        'level': 'DEBUG',
-        'propagate': True,
+    "handlers": {
+        "queue": {
+            "class": "mysite.log_handlers.AsyncStreamHandler",
+            "maxsize": LOG_QUEUE_SIZE,
+            "formatter": LOG_FORMAT,
+        },
+    },
+    "loggers": {
+        # Вместо обработчиков из DEFAULT_LOGGING всё идёт в корневой логгер
+        "django": {
+            "level": LOGLEVEL,
+            "handlers": [],
+        },
+        "django.db.backends": {
+            "filters": ["sample"],
+        },
+    },
+    "root": {
+        "level": LOGLEVEL,
+        "handlers": ["queue"],
     },
 }
 
@@ -250,29 +343,3 @@ if DEBUG:
     INTERNAL_IPS.extend(
         [ip[: ip.rfind(".")] + ".1" for ip in ips]
     )
-
-LOGLEVEL = getenv("DJANGO_LOGLEVEL", "info").upper()
-
-logging.config.dictConfig({
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {
-        "console": {
-            "format": "%(asctime)s %(levelname)s [%(name)s:%(lineno)s] %(module)s %(message)s",
-        },
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "console",
-        },
-    },
-    "loggers": {
-        "": {
-            "level": LOGLEVEL,
-            "handlers": [
-                "console",
-            ],
-        },
-    },
-})
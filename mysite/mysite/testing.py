@@ -0,0 +1,80 @@
+"""
+Бюджеты SQL-запросов и времени ответа для тестов представлений.
+
+QueryBudgetMixin.assertQueryBudget запрашивает страницу дважды: после
+создания небольшого и большого набора данных. Число запросов должно
+укладываться в бюджет и быть одинаковым на обоих наборах, так что
+запрос на каждую строку (N+1) роняет тест, даже если на маленьких
+данных он в бюджет помещается.
+
+Данные создаются внутри captureOnCommitCallbacks(execute=True), как
+после настоящего коммита (пересчитываются агрегаты продаж и т.п.),
+а перед каждым запросом очищаются кеши: бюджет считается для ответа,
+который строится заново, иначе кеш страниц или фрагментов шаблона
+прячет лишние запросы.
+"""
+
+import time
+from typing import Callable
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """Для TestCase: assertQueryBudget(url, create_data, queries, seconds=None)."""
+
+    # Сколько строк должно быть создано к первому и ко второму запросу
+    budget_sizes = (2, 12)
+
+    def assertQueryBudget(
+        self,
+        url: str,
+        create_data: Callable[[int], object],
+        queries: int,
+        seconds: float | None = None,
+        *,
+        status_code: int = 200,
+        sizes: tuple[int, int] | None = None,
+        using: str = DEFAULT_DB_ALIAS,
+    ) -> None:
+        """
+        ``create_data(count)`` добавляет ``count`` строк, которые показывает
+        страница. ``queries`` - максимум запросов на один GET ``url``,
+        ``seconds`` - максимум времени ответа на большом наборе.
+        """
+        created = 0
+        runs = []
+        for size in sizes or self.budget_sizes:
+            with self.captureOnCommitCallbacks(execute=True):
+                create_data(size - created)
+            created = size
+            for cache in caches.all():
+                cache.clear()
+
+            with CaptureQueriesContext(connections[using]) as context:
+                started = time.perf_counter()
+                response = self.client.get(url)
+                if response.streaming:
+                    b"".join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+            self.assertEqual(response.status_code, status_code, f"GET {url}")
+            runs.append((size, context, elapsed))
+
+        (small, small_queries, _), (large, large_queries, large_elapsed) = runs
+        sql = "\n".join(f"{index}. {query['sql']}" for index, query in enumerate(large_queries.captured_queries, 1))
+        self.assertLessEqual(
+            len(large_queries), queries,
+            f"GET {url} made {len(large_queries)} queries, the budget is {queries}:\n{sql}",
+        )
+        self.assertEqual(
+            len(small_queries), len(large_queries),
+            f"GET {url} made {len(small_queries)} queries with {small} rows "
+            f"and {len(large_queries)} with {large} rows:\n{sql}",
+        )
+        if seconds is not None:
+            self.assertLessEqual(
+                large_elapsed, seconds,
+                f"GET {url} took {large_elapsed:.3f}s with {large} rows, the budget is {seconds}s",
+            )
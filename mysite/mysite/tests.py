@@ -0,0 +1,594 @@
+import io
+import json
+import logging
+import threading
+import time
+from unittest import mock
+
+import psycopg2.extensions
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import translation
+
+from mysite import metrics
+from mysite.cache_backends import TwoTierCache
+from mysite.cache_utils import get_or_compute
+from mysite.db import routers
+from mysite.db.pool import ConnectionPool, PoolTimeout
+from mysite.db.pooled_postgresql import base as pooled_postgresql
+from mysite.log_handlers import AsyncStreamHandler, JsonFormatter, SamplingFilter
+from mysite.middleware import QueryRecorder, fingerprint
+from mysite.page_cache import cache_page_for
+from newsapp.models import News
+from newsapp.views import NewsListView
+
+
+class MetricsViewTestCase(TestCase):
+
+    def setUp(self) -> None:
+        metrics.reset()
+        metrics.incr("probe.count", 2)
+        metrics.observe("probe.seconds", 0.5)
+
+    def test_forbidden_for_anonymous(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff(self):
+        user = User.objects.create_user(username="probe_name", password="qwerty", is_staff=True)
+        self.client.force_login(user)
+        data = self.client.get(reverse("metrics")).json()
+        self.assertEqual(data["counters"]["probe.count"], 2)
+        self.assertEqual(data["timers"]["probe.seconds"], {"count": 1, "total": 0.5, "max": 0.5})
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token(self):
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 403)
+
+
+class TwoTierCacheTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.shared_config = {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": f"shared-{self.id()}",
+        }
+        self.worker = self.make_cache("worker")
+        self.other_worker = self.make_cache("other-worker")
+        self.shared = self.worker.shared
+        self.addCleanup(self.worker.clear)
+        self.now = 1000.0
+        patcher = mock.patch("mysite.cache_backends.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_cache(self, name: str, **options) -> TwoTierCache:
+        return TwoTierCache(f"{self.id()}-{name}", {
+            "OPTIONS": {"SHARED": self.shared_config, "LOCAL_TIMEOUT": 2, **options},
+        })
+
+    def test_get_set_delete(self):
+        self.assertIsNone(self.worker.get("key"))
+        self.worker.set("key", {"orders": [1, 2]})
+        self.assertEqual(self.worker.get("key"), {"orders": [1, 2]})
+        self.assertEqual(self.other_worker.get("key"), {"orders": [1, 2]})
+        self.assertFalse(self.worker.add("key", "other"))
+        self.worker.delete("key")
+        self.assertIsNone(self.worker.get("key"))
+
+    def test_local_hit_skips_shared(self):
+        self.worker.set("key", "value")
+        with mock.patch.object(self.shared, "get_many") as get_many, mock.patch.object(self.shared, "get") as get:
+            self.assertEqual(self.worker.get("key"), "value")
+        get_many.assert_not_called()
+        get.assert_not_called()
+
+    def test_other_workers_see_writes_after_local_timeout(self):
+        self.worker.set("key", "old")
+        self.assertEqual(self.other_worker.get("key"), "old")
+        self.worker.set("key", "new")
+        self.assertEqual(self.worker.get("key"), "new")
+        self.assertEqual(self.other_worker.get("key"), "old")
+
+        self.now += 3
+        self.assertEqual(self.other_worker.get("key"), "new")
+
+    def test_revalidation_by_stamp(self):
+        self.worker.set("key", "value")
+        self.now += 3
+        with mock.patch.object(self.shared, "get_many") as get_many:
+            self.assertEqual(self.worker.get("key"), "value")
+        get_many.assert_not_called()
+
+        self.other_worker.delete("key")
+        self.now += 3
+        self.assertIsNone(self.worker.get("key"))
+
+    def test_local_size_limit(self):
+        cache = self.make_cache("small", LOCAL_MAX_BYTES=300, LOCAL_MAX_ENTRY_BYTES=200)
+        cache.set("first", "x" * 120)
+        cache.set("second", "x" * 120)
+        cache.set("third", "x" * 120)
+        cache.set("huge", "x" * 250)
+        self.assertLessEqual(cache.local.size, 300)
+        self.assertIsNone(cache.local.get(cache.make_key("first")))
+        self.assertIsNotNone(cache.local.get(cache.make_key("second")))
+        self.assertIsNone(cache.local.get(cache.make_key("huge")))
+        self.assertEqual(cache.get("first"), "x" * 120)
+        self.assertEqual(cache.get("huge"), "x" * 250)
+
+
+class GetOrComputeTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.cache = LocMemCache("single-flight-tests", {})
+        self.cache.clear()
+        self.compute = mock.Mock(return_value="fresh")
+        metrics.reset()
+
+    def get(self, **kwargs):
+        kwargs.setdefault("beta", 0)
+        return get_or_compute("probe", self.compute, 60, cache=self.cache, **kwargs)
+
+    def test_computes_once(self):
+        self.assertEqual(self.get(), "fresh")
+        self.assertEqual(self.get(), "fresh")
+        self.compute.assert_called_once()
+        self.assertEqual(metrics.get("single_flight.misses"), 1)
+        self.assertEqual(metrics.get("single_flight.hits"), 1)
+
+    def test_stale_value_while_another_caller_recomputes(self):
+        self.cache.set("probe", ("stale", 1.0, time.time() - 1))
+        self.cache.add("probe:lock", "other")
+        self.assertEqual(self.get(), "stale")
+        self.compute.assert_not_called()
+        self.assertEqual(metrics.get("single_flight.stale_hits"), 1)
+
+    def test_expired_value_is_recomputed(self):
+        self.cache.set("probe", ("stale", 1.0, time.time() - 1))
+        self.assertEqual(self.get(), "fresh")
+        self.assertEqual(self.get(), "fresh")
+        self.compute.assert_called_once()
+        self.assertIsNone(self.cache.get("probe:lock"))
+
+    def test_early_refresh(self):
+        self.cache.set("probe", ("old", 1.0, time.time() + 5))
+        self.assertEqual(self.get(beta=0), "old")
+        self.assertEqual(self.get(beta=1000), "fresh")
+        self.assertEqual(metrics.get("single_flight.refreshes"), 1)
+
+    def test_waits_for_lock_holder(self):
+        self.cache.add("probe:lock", "other")
+        timer = threading.Timer(0.05, self.cache.set, ["probe", ("computed elsewhere", 0.05, time.time() + 60)])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(self.get(wait=2, poll_interval=0.01), "computed elsewhere")
+        self.compute.assert_not_called()
+
+    def test_wait_timeout(self):
+        self.cache.add("probe:lock", "other")
+        self.assertEqual(self.get(wait=0.02, poll_interval=0.01), "fresh")
+        self.assertEqual(metrics.get("single_flight.wait_timeouts"), 1)
+
+    def test_lock_released_on_error(self):
+        self.compute.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            self.get()
+        self.assertIsNone(self.cache.get("probe:lock"))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class PageCacheTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        metrics.reset()
+        self.calls = 0
+
+    def get(self, view, path="/probe/", method="get"):
+        request = getattr(RequestFactory(), method)(path)
+        request.user = AnonymousUser()
+        return view(request)
+
+    def counting_view(self, response_factory):
+        @cache_page_for(timeout=60)
+        def view(request):
+            self.calls += 1
+            return response_factory(request)
+        return view
+
+    def test_hit(self):
+        view = self.counting_view(lambda request: HttpResponse("page"))
+        self.assertEqual(self.get(view).content, b"page")
+        self.assertEqual(self.get(view).content, b"page")
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(metrics.get("page_cache.hits"), 1)
+        self.assertEqual(metrics.get("page_cache.misses"), 1)
+        self.assertEqual(metrics.snapshot()["timers"]["page_cache.saved_seconds"]["count"], 1)
+
+    def test_varies_by_path_and_language(self):
+        view = self.counting_view(lambda request: HttpResponse("page"))
+        self.get(view, "/probe/")
+        self.get(view, "/probe/?page=2")
+        with translation.override("ru"):
+            self.get(view, "/probe/")
+        self.assertEqual(self.calls, 3)
+
+    def test_not_cached(self):
+        responses = {
+            "error": lambda request: HttpResponse("error", status=500),
+            "csrf": lambda request: HttpResponse(get_token(request)),
+        }
+
+        def with_cookie(request):
+            response = HttpResponse("page")
+            response.set_cookie("probe", "1")
+            return response
+
+        responses["cookie"] = with_cookie
+        for name, response_factory in responses.items():
+            with self.subTest(name):
+                self.calls = 0
+                view = self.counting_view(response_factory)
+                self.get(view, f"/{name}/")
+                self.get(view, f"/{name}/")
+                self.assertEqual(self.calls, 2)
+
+        self.calls = 0
+        view = self.counting_view(lambda request: HttpResponse("page"))
+        self.get(view, method="post")
+        self.get(view)
+        self.assertEqual(self.calls, 2)
+
+
+class QueryInspectionTestCase(TestCase):
+
+    def setUp(self) -> None:
+        metrics.reset()
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE a = 'x' AND b = 10 AND c IN (%s, %s, %s)"),
+            fingerprint("SELECT * FROM t WHERE a = 'y' AND b = 2 AND c IN (%s)"),
+        )
+
+    def test_n_plus_one_with_stack(self):
+        recorder = QueryRecorder(n_plus_one_threshold=3)
+        users = [User.objects.create_user(username=f"probe_{index}") for index in range(4)]
+        with connection.execute_wrapper(recorder):
+            for user in users:
+                User.objects.filter(pk=user.pk).exists()
+            User.objects.count()
+        self.assertEqual(recorder.count, 5)
+        [n_plus_one] = recorder.n_plus_one()
+        self.assertEqual(n_plus_one["count"], 4)
+        self.assertIn("tests.py", n_plus_one["stack"][-1])
+        self.assertIn("test_n_plus_one_with_stack", n_plus_one["stack"][-1])
+
+    @override_settings(SQL_INSPECTION_SAMPLE_RATE=1, SQL_INSPECTION_N_PLUS_ONE_THRESHOLD=3)
+    def test_middleware(self):
+        user = User.objects.create_user(username="probe_name", password="qwerty", is_staff=True)
+        self.client.force_login(user)
+        with self.assertLogs("mysite.sql", "INFO") as logs:
+            self.client.get(reverse("metrics"))
+        [record] = logs.records
+        self.assertTrue(record.getMessage().startswith("GET metrics: 2 queries"))
+        self.assertEqual(record.view, "metrics")
+        self.assertEqual(record.queries, 2)
+        self.assertEqual(record.n_plus_one, [])
+        self.assertEqual(metrics.get("sql.queries.metrics"), 2)
+
+    @override_settings(SQL_INSPECTION_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        with self.assertNoLogs("mysite.sql"):
+            self.client.get(reverse("metrics"))
+
+
+class AsyncLoggingTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        metrics.reset()
+        self.stream = io.StringIO()
+        self.logger = logging.getLogger("mysite.tests.async")
+        self.logger.propagate = False
+        self.addCleanup(setattr, self.logger, "propagate", True)
+
+    def add_handler(self, handler: logging.Handler) -> None:
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        self.addCleanup(handler.close)
+
+    def test_json_lines(self):
+        handler = AsyncStreamHandler(self.stream)
+        handler.setFormatter(JsonFormatter())
+        self.add_handler(handler)
+
+        self.logger.warning("Order #%s", 7, extra={"user": "probe_name"})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            self.logger.exception("Failed")
+        handler.close()
+
+        first, second = [json.loads(line) for line in self.stream.getvalue().splitlines()]
+        self.assertEqual(first["message"], "Order #7")
+        self.assertEqual(first["level"], "WARNING")
+        self.assertEqual(first["logger"], "mysite.tests.async")
+        self.assertEqual(first["user"], "probe_name")
+        self.assertIn("ZeroDivisionError", second["exc_info"])
+
+    def test_formatted_in_listener_thread(self):
+        threads = []
+
+        class Probe:
+            def __str__(self):
+                threads.append(threading.current_thread())
+                return "probe"
+
+        handler = AsyncStreamHandler(self.stream)
+        self.add_handler(handler)
+        self.logger.warning("%s", Probe())
+        handler.close()
+        self.assertEqual(self.stream.getvalue(), "probe\n")
+        [thread] = threads
+        self.assertIsNot(thread, threading.current_thread())
+
+    def test_full_queue_drops(self):
+        handler = AsyncStreamHandler(self.stream, maxsize=2)
+        self.add_handler(handler)
+        handler.listener.stop()
+        for index in range(5):
+            self.logger.warning("Message %s", index)
+        self.assertEqual(handler.dropped, 3)
+        self.assertEqual(metrics.get("logging.dropped"), 3)
+
+    def test_after_fork(self):
+        handler = AsyncStreamHandler(self.stream, maxsize=2)
+        self.add_handler(handler)
+        parent_queue = handler.queue
+        handler.listener.stop()
+        self.logger.warning("Parent")
+        handler.after_fork()
+        self.assertIsNot(handler.queue, parent_queue)
+        self.assertEqual(handler.queue.maxsize, 2)
+        self.assertIs(handler.listener.queue, handler.queue)
+        self.logger.warning("Child")
+        handler.close()
+        self.assertEqual(self.stream.getvalue(), "Child\n")
+
+    def test_sampling(self):
+        sampling = SamplingFilter(rate=0.5)
+        debug = logging.LogRecord("django.db.backends", logging.DEBUG, "", 0, "SELECT 1", (), None)
+        warning = logging.LogRecord("django.db.backends", logging.WARNING, "", 0, "Slow", (), None)
+        with mock.patch("mysite.log_handlers.random.random", return_value=0.7):
+            self.assertFalse(sampling.filter(debug))
+            self.assertTrue(sampling.filter(warning))
+        with mock.patch("mysite.log_handlers.random.random", return_value=0.2):
+            self.assertTrue(sampling.filter(debug))
+        self.assertEqual(metrics.get("logging.sampled_out"), 1)
+
+
+class FakeConnection:
+    def __init__(self, number: int):
+        self.number = number
+        self.closed = False
+        self.healthy = True
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        metrics.reset()
+        self.connections = []
+
+    def connect(self) -> FakeConnection:
+        conn = FakeConnection(len(self.connections))
+        self.connections.append(conn)
+        return conn
+
+    @staticmethod
+    def check(conn: FakeConnection) -> None:
+        if not conn.healthy:
+            raise ConnectionError("gone")
+
+    def make_pool(self, **options) -> ConnectionPool:
+        return ConnectionPool(self.connect, check=self.check, name="test", **options)
+
+    def test_reuse(self):
+        pool = self.make_pool(max_size=2)
+        conn = pool.getconn()
+        pool.putconn(conn)
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(metrics.get("db_pool.test.checkouts"), 2)
+        self.assertEqual(metrics.snapshot()["timers"]["db_pool.test.wait_seconds"]["count"], 2)
+
+    def test_health_check(self):
+        pool = self.make_pool()
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.healthy = False
+        self.assertIsNot(pool.getconn(), conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.size, 1)
+        self.assertEqual(metrics.get("db_pool.test.check_failures"), 1)
+
+    def test_max_lifetime(self):
+        pool = self.make_pool(max_lifetime=10)
+        conn = pool.getconn()
+        with mock.patch("mysite.db.pool.time.monotonic", return_value=time.monotonic() + 11):
+            pool.putconn(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_max_idle(self):
+        pool = self.make_pool(min_size=1, max_idle=10)
+        first, second = pool.getconn(), pool.getconn()
+        pool.putconn(first)
+        pool.putconn(second)
+        with mock.patch("mysite.db.pool.time.monotonic", return_value=time.monotonic() + 11):
+            self.assertIs(pool.getconn(), second)
+        # The idle one is closed, but not below min_size
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_timeout(self):
+        pool = self.make_pool(max_size=1, timeout=0.05)
+        pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        self.assertEqual(metrics.get("db_pool.test.timeouts"), 1)
+
+    def test_waits_for_returned_connection(self):
+        pool = self.make_pool(max_size=1, timeout=5)
+        conn = pool.getconn()
+        threading.Timer(0.05, pool.putconn, args=(conn,)).start()
+        self.assertIs(pool.getconn(), conn)
+
+    def test_threads(self):
+        pool = self.make_pool(max_size=3)
+        in_use = set()
+        errors = []
+        lock = threading.Lock()
+
+        def work():
+            for _ in range(50):
+                conn = pool.getconn()
+                with lock:
+                    if conn in in_use:
+                        errors.append(conn)
+                    in_use.add(conn)
+                time.sleep(0.0005)
+                with lock:
+                    in_use.discard(conn)
+                pool.putconn(conn)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(self.connections), 3)
+
+    def test_fill_and_close(self):
+        pool = self.make_pool(min_size=2)
+        pool.fill()
+        self.assertEqual(len(self.connections), 2)
+        conn = pool.getconn()
+        pool.close()
+        pool.putconn(conn)
+        self.assertTrue(all(conn.closed for conn in self.connections))
+        self.assertEqual(pool.size, 0)
+
+
+class PooledPostgresqlResetTestCase(SimpleTestCase):
+
+    def make_connection(self, transaction_status) -> mock.Mock:
+        conn = mock.MagicMock(closed=0, autocommit=False)
+        conn.info.transaction_status = transaction_status
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.execute.side_effect = lambda sql: self.statements.append((sql, conn.autocommit))
+        return conn
+
+    def setUp(self) -> None:
+        self.statements = []
+
+    def test_reset(self):
+        conn = self.make_connection(psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+        pooled_postgresql._reset(conn)
+        conn.rollback.assert_called_once_with()
+        self.assertEqual(self.statements, [("DISCARD ALL", True)])
+        self.assertFalse(conn.autocommit)
+
+    def test_check_does_not_discard(self):
+        conn = self.make_connection(psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        pooled_postgresql._check(conn)
+        conn.rollback.assert_not_called()
+        self.assertEqual(self.statements, [("SELECT 1", False)])
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRouterTestCase(TestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self) -> None:
+        cache.clear()
+        metrics.reset()
+        routers._lag_checked.clear()
+        News.objects.create(pk=1, title="On primary")
+        News.objects.using("replica").create(pk=1, title="On replica")
+        self.detail_url = reverse("housing_detail", args=[1])
+
+    def test_safe_request_reads_replica(self):
+        response = self.client.get(self.detail_url)
+        self.assertContains(response, "On replica")
+        self.assertNotContains(response, "On primary")
+        self.assertEqual(metrics.get("db_router.replica_requests"), 1)
+
+    def test_read_your_writes_after_post(self):
+        with translation.override("en"):
+            url = reverse("shopapp:groups_list")
+        response = self.client.post(url, {"name": "editors"})
+        self.assertIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+        self.assertTrue(Group.objects.filter(name="editors").exists())
+
+        response = self.client.get(self.detail_url)
+        self.assertContains(response, "On primary")
+        self.assertEqual(metrics.get("db_router.sticky_requests"), 1)
+
+    def test_view_without_opt_in_reads_primary(self):
+        Group.objects.using("replica").create(name="replica-only")
+        with translation.override("en"):
+            response = self.client.get(reverse("shopapp:groups_list"))
+        self.assertNotContains(response, "replica-only")
+        self.assertNotIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+
+    def test_lagging_replica_is_skipped(self):
+        with mock.patch("mysite.db.routers.replica_lag", return_value=settings.REPLICA_MAX_LAG + 1):
+            response = self.client.get(self.detail_url)
+        self.assertContains(response, "On primary")
+        self.assertEqual(metrics.get("db_router.no_replica"), 1)
+
+    def test_page_cache_fills_from_primary(self):
+        # The cached page would outlive the replica lag under the new model version
+        with mock.patch.object(NewsListView, "read_replica", True, create=True):
+            response = self.client.get(reverse("housing_list"))
+            self.assertContains(response, "On primary")
+            self.assertNotContains(response, "On replica")
+            self.assertContains(self.client.get(reverse("housing_list")), "On primary")
+        self.assertEqual(metrics.get("page_cache.hits"), 1)
+
+    def test_get_or_compute_fills_from_primary(self):
+        token = routers._state.set(routers.RoutingState(use_replica=True))
+        try:
+            titles = get_or_compute("replica-test", lambda: list(News.objects.values_list("title", flat=True)), 60)
+            self.assertEqual(titles, ["On primary"])
+        finally:
+            routers._state.reset(token)
+
+    def test_outside_request_reads_primary(self):
+        self.assertEqual(list(News.objects.values_list("title", flat=True)), ["On primary"])
+
+    def test_write_switches_reads_to_primary(self):
+        router = routers.ReplicaRouter()
+        token = routers._state.set(routers.RoutingState(use_replica=True))
+        try:
+            self.assertEqual(router.db_for_read(News), "replica")
+            router.db_for_write(News)
+            self.assertIsNone(router.db_for_read(News))
+        finally:
+            routers._state.reset(token)
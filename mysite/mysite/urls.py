@@ -19,6 +19,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.contrib.sitemaps.views import sitemap
 from newsapp.sitemap import NewsSitemap, StaticViewSitemap
+from mysite.db.routers import replica_reads
+from mysite.views import metrics_view
 
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
@@ -38,9 +40,10 @@ urlpatterns = [
     path('api/', include('myapiapp.urls')),
     path('blog/', include('blogapp.urls')),
     path('news/', include('newsapp.urls')),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps},
+    path('sitemap.xml', replica_reads(sitemap), {'sitemaps': sitemaps},
          name='django.contrib.sitemaps.views.site.sitemap'),
     path('__debug__/', include(debug_toolbar.urls)),
+    path('metrics/', metrics_view, name='metrics'),
 ]
 
 urlpatterns += i18n_patterns(
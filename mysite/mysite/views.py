@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.http import HttpRequest, JsonResponse
+from django.utils.crypto import constant_time_compare
+
+from mysite import metrics
+
+
+def metrics_view(request: HttpRequest) -> JsonResponse:
+    """
+    Метрики процесса в JSON.
+
+    Доступны staff-пользователям или по заголовку
+    ``Authorization: Bearer <METRICS_TOKEN>``, если токен задан.
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get("Authorization", "")
+    if not request.user.is_staff and not (
+        token and constant_time_compare(authorization, f"Bearer {token}")
+    ):
+        return JsonResponse({"detail": "Forbidden"}, status=403)
+    return JsonResponse(metrics.snapshot())
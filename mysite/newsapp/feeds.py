@@ -5,6 +5,7 @@ from newsapp.models import News
 
 
 class LatestNewsFeed(Feed):
+    read_replica = True
     title = "News"
     link = "/sitenews/"
     description = "Latest news"
@@ -1,3 +1,20 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from mysite.testing import QueryBudgetMixin
+from newsapp.models import News
+
+
+class NewsViewsTestCase(QueryBudgetMixin, TestCase):
+
+    def create_news(self, count: int) -> None:
+        News.objects.bulk_create(News(title=f"News {index}", text="Text") for index in range(count))
+
+    def test_news_list_query_budget(self):
+        self.assertQueryBudget(reverse("housing_list"), self.create_news, queries=1, seconds=1)
+
+    def test_news_detail_query_budget(self):
+        news = News.objects.create(title="News", description="Description")
+        self.assertQueryBudget(
+            reverse("housing_detail", kwargs={"pk": news.pk}), self.create_news, queries=1, seconds=1,
+        )
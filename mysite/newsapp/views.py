@@ -1,10 +1,13 @@
 from django.http import HttpRequest
 from django.shortcuts import render
+from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView
 
+from mysite.page_cache import cache_page_for
 from newsapp.models import Housing, News
 
 
+@cache_page_for()
 def contacts(request: HttpRequest):
     context = {
         "phone_number": "8(999)999-99-99",
@@ -13,6 +16,7 @@ def contacts(request: HttpRequest):
     return render(request, "newsapp/contacts.html", context=context)
 
 
+@cache_page_for()
 def about_us(request: HttpRequest):
     context = {
         "info": """We are a real estate agency.
@@ -31,11 +35,13 @@ class HousingListView(ListView):
     )
 
 
+@method_decorator(cache_page_for(News), name="dispatch")
 class NewsListView(ListView):
     queryset = News.objects.filter(is_published=False)
 
 
 class NewsDetailView(DetailView):
+    read_replica = True
     model = News
     template_name = "newsapp/news_detail.html"
     context_object_name = "new"
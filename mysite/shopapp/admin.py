@@ -1,32 +1,78 @@
 from django.contrib import admin
+from django.db import transaction
 from django.db.models import QuerySet
 from django.http import HttpRequest
-
-from .models import Product, Order
-from .admin_mixins import ExportAsCSVMixin
+from django.utils import timezone
+
+from mysite.page_cache import invalidate_models
+
+from .models import BulkActionJob, Product, Order
+from .admin_mixins import ExportAsCSVMixin, PrefixAutocompleteMixin, chunked_admin_action
+from .pagination import EstimatedCountPaginator
+from .rollups import apply_product_units, product_units
+from .signals import OrderProduct, orders_changed
+
+
+class OrderRowsAdminMixin:
+    """
+    Пересчитать заказы, строки которых правили инлайны.
+
+    Инлайны сохраняют и удаляют строки Order.products.through напрямую,
+    а для автоматически созданной промежуточной модели Django не отправляет
+    ни post_save/post_delete, ни m2m_changed.
+    """
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not OrderProduct:
+            return super().save_formset(request, form, formset, change)
+        # Изменённые и удаляемые строки в базе ещё прежние; строку могли
+        # перенести в другой заказ - тогда меняется и прежний
+        old_lines = OrderProduct.objects.filter(pk__in=[
+            inline_form.instance.pk
+            for inline_form in formset.initial_forms
+            if inline_form.has_changed() or inline_form in formset.deleted_forms
+        ])
+        apply_product_units(product_units(old_lines), sign=-1)
+        order_pks = set(old_lines.values_list("order_id", flat=True))
+        super().save_formset(request, form, formset, change)
+        new_lines = OrderProduct.objects.filter(
+            pk__in=[obj.pk for obj in formset.new_objects] + [obj.pk for obj, _ in formset.changed_objects]
+        )
+        apply_product_units(product_units(new_lines))
+        order_pks.update(new_lines.values_list("order_id", flat=True))
+        if order_pks:
+            orders_changed(Order.objects.filter(pk__in=order_pks))
 
 
 class OrderInline(admin.TabularInline):
     model = Product.orders.through
+    autocomplete_fields = ["order"]
 
 
-@admin.action(description="Archive products")
-def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+@chunked_admin_action("Archive products")
+def mark_archived(queryset: QuerySet) -> int:
+    updated = queryset.update(archived=True, updated_at=timezone.now())
+    transaction.on_commit(lambda: invalidate_models(Product))
+    return updated
 
 
-@admin.action(description="Unarchive products")
-def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+@chunked_admin_action("Unarchive products")
+def mark_unarchived(queryset: QuerySet) -> int:
+    updated = queryset.update(archived=False, updated_at=timezone.now())
+    transaction.on_commit(lambda: invalidate_models(Product))
+    return updated
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+class ProductAdmin(OrderRowsAdminMixin, PrefixAutocompleteMixin, admin.ModelAdmin, ExportAsCSVMixin):
     actions = [
         mark_archived,
         mark_unarchived,
-        "export_csv",
+        "export_as_csv",
     ]
+    export_fields = "id", "sku", "name", "description", "price", "discount", "created_by", "created_at", "archived"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [
         OrderInline,
     ]
@@ -35,6 +81,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     list_display_links = "pk", "name"
     ordering = "-name", "pk"
     search_fields = "name", "description"
+    autocomplete_search_fields = "^name",
     fieldsets = [
         (None, {
            "fields": ("name", "description"),
@@ -62,17 +109,59 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 # class ProductInline(admin.TabularInline):
 class ProductInline(admin.StackedInline):
     model = Order.products.through
+    autocomplete_fields = ["product"]
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(OrderRowsAdminMixin, PrefixAutocompleteMixin, admin.ModelAdmin):
     inlines = [
         ProductInline,
     ]
+    autocomplete_fields = ["user", "products"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     list_display = "delivery_address", "promocode", "created_at", "user_verbose"
+    search_fields = "delivery_address", "promocode", "user__username"
+    autocomplete_search_fields = "^user__username",
+    # Хранимые суммы пересчитываются при изменении строк заказа
+    readonly_fields = "items_count", "subtotal", "total_after_discount"
 
     def get_queryset(self, request):
         return Order.objects.select_related("user").prefetch_related("products")
 
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
+
+
+@admin.action(description="Cancel selected jobs")
+def cancel_jobs(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
+    # Задача остановится после текущей пачки
+    queryset.filter(
+        status__in=[BulkActionJob.Status.PENDING, BulkActionJob.Status.RUNNING],
+    ).update(cancel_requested=True)
+
+
+@admin.register(BulkActionJob)
+class BulkActionJobAdmin(admin.ModelAdmin):
+    actions = [
+        cancel_jobs,
+    ]
+    list_display = "pk", "action", "model", "status", "progress", "created_by", "created_at", "updated_at"
+    list_display_links = "pk", "action"
+    list_filter = "status", "model"
+    list_select_related = "created_by",
+    readonly_fields = "progress",
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="Progress")
+    def progress(self, obj: BulkActionJob) -> str:
+        if not obj.total:
+            return f"{obj.processed}"
+        percent = min(100, obj.processed * 100 // obj.total)
+        cancelling = " (cancelling)" if obj.cancel_requested and not obj.is_finished else ""
+        return f"{percent}% ({obj.processed} of {obj.total}){cancelling}"
@@ -1,23 +1,114 @@
 import csv
+from functools import wraps
+from itertools import chain
+from typing import Callable
 
+from django.contrib import admin, messages
 from django.db.models import QuerySet
 from django.db.models.options import Options
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.html import format_html
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: write() просто возвращает строку."""
+
+    def write(self, value: str) -> str:
+        return value
 
 
 class ExportAsCSVMixin:
+    """
+    Выгрузка выбранных объектов в CSV потоком.
+
+    Строки читаются пачками по ``export_chunk_size`` через values_list,
+    внешние ключи выгружаются как id, без загрузки связанных объектов.
+    Набор полей задаётся ``export_fields`` (по умолчанию все поля модели).
+    """
+    export_fields = None
+    export_chunk_size = 2000
+
+    def get_export_fields(self) -> list:
+        meta: Options = self.model._meta
+        if self.export_fields is None:
+            return list(meta.concrete_fields)
+        return [meta.get_field(name) for name in self.export_fields]
+
     def export_as_csv(self, request: HttpRequest, queryset: QuerySet):
         meta: Options = self.model._meta
-        field_names = [field.name for field in meta.fields]
+        fields = self.get_export_fields()
+        rows = (
+            queryset
+            .values_list(*(field.attname for field in fields))
+            .iterator(chunk_size=self.export_chunk_size)
+        )
 
-        response = HttpResponse(content_type="text/csv")
+        writer = csv.writer(Echo())
+        header = [field.name for field in fields]
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in chain([header], rows)),
+            content_type="text/csv",
+        )
         response["Content-Disposition"] = f"attachment; filename={meta}-export.csv"
-        writer = csv.writer(response)
-
-        writer.writerow(field_names)
-        for obj in queryset:
-            writer.writerow([getattr(obj, field) for field in field_names])
-
         return response
 
     export_as_csv.short_description = "Export as CSV"
+
+
+class PrefixAutocompleteMixin:
+    """
+    Поиск для autocomplete_fields других ModelAdmin по началу строки.
+
+    Для запросов к admin:autocomplete вместо search_fields берутся
+    ``autocomplete_search_fields`` (вида "^name"): istartswith использует
+    индексы из миграции shopapp 0014, а icontains читает всю таблицу.
+    """
+    autocomplete_search_fields = ()
+
+    def get_search_fields(self, request: HttpRequest):
+        match = request.resolver_match
+        if self.autocomplete_search_fields and match is not None and match.url_name == "autocomplete":
+            return self.autocomplete_search_fields
+        return super().get_search_fields(request)
+
+
+def chunked_admin_action(description: str, chunk_size: int | None = None, **action_kwargs):
+    """
+    Действие админки, которое выполняется в фоне пачками (shopapp.bulk_actions).
+
+    Декорируемая функция получает queryset одной пачки (не больше
+    ``chunk_size`` объектов, по умолчанию BULK_ACTIONS_CHUNK_SIZE),
+    вызывается внутри транзакции и возвращает число обработанных объектов::
+
+        @chunked_admin_action("Archive products")
+        def mark_archived(queryset):
+            return queryset.update(archived=True)
+
+    Сама функция остаётся доступна как ``mark_archived.process_chunk``.
+    Ход выполнения и отмена - в админке BulkActionJob.
+    """
+    def decorator(process_chunk: Callable[[QuerySet], int]):
+        @admin.action(description=description, **action_kwargs)
+        @wraps(process_chunk)
+        def action(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
+            from .bulk_actions import start_job
+            from .models import BulkActionJob
+
+            job = BulkActionJob.objects.create(
+                action=str(description),
+                model=queryset.model._meta.label,
+                created_by=request.user,
+            )
+            start_job(job, queryset, process_chunk, chunk_size)
+            url = reverse("admin:shopapp_bulkactionjob_change", args=[job.pk])
+            modeladmin.message_user(
+                request,
+                format_html('"{}" started in the background: <a href="{}">job #{}</a>', description, url, job.pk),
+                messages.INFO,
+            )
+
+        action.process_chunk = process_chunk
+        return action
+
+    return decorator
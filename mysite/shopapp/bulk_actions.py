@@ -0,0 +1,121 @@
+"""
+Фоновое выполнение массовых действий админки пачками.
+
+Выбранный queryset обрабатывается диапазонами первичного ключа по
+``chunk_size`` объектов, каждый диапазон - в своей короткой транзакции,
+так что строки не блокируются на всё время действия. После каждой пачки
+в BulkActionJob записывается прогресс и проверяется cancel_requested:
+отмена останавливает работу между пачками, уже обработанные остаются
+закоммиченными.
+
+Задачи выполняются в пуле потоков процесса (BULK_ACTIONS_WORKERS), а с
+BULK_ACTIONS_EAGER = True - сразу в вызывающем потоке (для тестов).
+Задача, прерванная перезапуском процесса, остаётся в статусе running.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
+
+from mysite import metrics
+
+from .models import BulkActionJob
+
+logger = logging.getLogger(__name__)
+
+Status = BulkActionJob.Status
+
+_executor: ThreadPoolExecutor | None = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    with _executor_lock:
+        # После fork потоков родителя в дочернем процессе нет
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(settings.BULK_ACTIONS_WORKERS, thread_name_prefix="bulk-action")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def start_job(
+    job: BulkActionJob,
+    queryset: QuerySet,
+    process_chunk: Callable[[QuerySet], int],
+    chunk_size: int | None = None,
+) -> None:
+    """Запустить job после коммита текущей транзакции (сразу - в eager-режиме)."""
+    chunk_size = chunk_size or settings.BULK_ACTIONS_CHUNK_SIZE
+    # Без закэшированных результатов и сортировки админки
+    queryset = queryset.all().order_by()
+    if settings.BULK_ACTIONS_EAGER:
+        run_job(job.pk, queryset, process_chunk, chunk_size)
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(_run_in_thread, job.pk, queryset, process_chunk, chunk_size)
+    )
+
+
+def _run_in_thread(*args) -> None:
+    try:
+        run_job(*args)
+    finally:
+        # Соединения этого потока больше никто не закроет
+        connections.close_all()
+
+
+def next_boundary(queryset: QuerySet, after, chunk_size: int) -> tuple:
+    """
+    pk последнего объекта следующей пачки (None - до конца) и признак,
+    что пачка последняя.
+    """
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    pks = list(queryset.order_by("pk").values_list("pk", flat=True)[chunk_size - 1:chunk_size + 1])
+    if not pks:
+        return None, True
+    return pks[0], len(pks) == 1
+
+
+def run_job(job_pk: int, queryset: QuerySet, process_chunk: Callable[[QuerySet], int], chunk_size: int) -> None:
+    jobs = BulkActionJob.objects.filter(pk=job_pk)
+    if not jobs.filter(status=Status.PENDING, cancel_requested=False).update(status=Status.RUNNING):
+        jobs.filter(status=Status.PENDING).update(status=Status.CANCELLED)
+        return
+
+    try:
+        jobs.update(total=queryset.count(), updated_at=timezone.now())
+        last_pk = None
+        while True:
+            boundary, is_last = next_boundary(queryset, last_pk, chunk_size)
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            if boundary is not None:
+                chunk = chunk.filter(pk__lte=boundary)
+            with transaction.atomic():
+                processed = process_chunk(chunk)
+            metrics.incr("bulk_actions.chunks")
+            if boundary is not None:
+                last_pk = boundary
+            if is_last:
+                jobs.update(
+                    processed=F("processed") + processed, last_pk=last_pk, status=Status.DONE,
+                    updated_at=timezone.now(),
+                )
+                return
+            jobs.update(processed=F("processed") + processed, last_pk=last_pk, updated_at=timezone.now())
+            if jobs.filter(cancel_requested=True).exists():
+                jobs.update(status=Status.CANCELLED)
+                return
+    except Exception as exc:
+        logger.exception("Bulk action job #%s failed", job_pk)
+        jobs.update(status=Status.FAILED, error=repr(exc), updated_at=timezone.now())
+        metrics.incr("bulk_actions.failed")
@@ -0,0 +1,40 @@
+"""
+Версионированные ключи кэша выгрузки заказов пользователя.
+
+Данные лежат под ключом, в который входит версия пользователя.
+При изменении его заказов (см. shopapp.signals) версия меняется,
+и старая запись просто больше не читается.
+"""
+
+from uuid import uuid4
+
+from django.core.cache import cache
+
+from mysite import metrics
+
+
+def _version_key(user_pk) -> str:
+    return f"user_{user_pk}_orders_version"
+
+
+def get_user_orders_version(user_pk) -> str:
+    key = _version_key(user_pk)
+    version = cache.get(key)
+    if version is None:
+        # A random version, not a counter: if the version key is evicted,
+        # old data must not become readable again.
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def user_orders_export_key(user_pk) -> str:
+    return f"user_{user_pk}_orders_data_export_{get_user_orders_version(user_pk)}"
+
+
+def invalidate_user_orders(user_pks) -> None:
+    user_pks = {pk for pk in user_pks if pk is not None}
+    if not user_pks:
+        return
+    cache.set_many({_version_key(pk): uuid4().hex for pk in user_pks}, None)
+    metrics.incr("orders_export_cache.invalidations", len(user_pks))
@@ -0,0 +1,99 @@
+"""
+Conditional GET (ETag / Last-Modified) по полю updated_at.
+
+Для списка валидатор - max(updated_at) и количество строк отфильтрованного
+queryset, считаются одним агрегатным запросом; количество ловит удаления.
+Если клиент прислал совпадающий If-None-Match / If-Modified-Since,
+возвращается 304 без выборки объектов и сериализации.
+
+Заказ выводит названия товаров и username, поэтому при их изменении
+updated_at заказов сдвигают сигналы (shopapp.signals.touch_orders).
+"""
+
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils import translation
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import Product
+
+
+def make_etag(*parts) -> str:
+    return quote_etag(hashlib.md5(":".join(map(str, parts)).encode()).hexdigest())
+
+
+def set_validators(response, etag: str, last_modified) -> None:
+    if response.status_code in (200, 304):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+
+
+def product_last_modified(request, pk):
+    # condition() asks for the ETag and Last-Modified separately: one query for both
+    if not hasattr(request, "_product_last_modified"):
+        request._product_last_modified = (
+            Product.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+        )
+    return request._product_last_modified
+
+
+def product_page_etag(request, pk):
+    # The page depends on the language and on the user's permissions
+    last_modified = product_last_modified(request, pk)
+    if last_modified is None:
+        return None
+    user_pk = request.user.pk if request.user.is_authenticated else None
+    return make_etag(translation.get_language(), user_pk, last_modified.isoformat())
+
+
+class ConditionalGetMixin:
+    """Для ModelViewSet: 304 для list и retrieve, если данные не менялись."""
+    updated_field = "updated_at"
+
+    def get_list_validators(self, queryset):
+        stats = queryset.order_by().aggregate(last_modified=Max(self.updated_field), count=Count("pk"))
+        last_modified = stats["last_modified"]
+        etag = make_etag(
+            self.request.accepted_renderer.format,
+            stats["count"],
+            last_modified.isoformat() if last_modified is not None else "",
+        )
+        return etag, last_modified
+
+    def get_object_last_modified(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return (
+            self.filter_queryset(self.get_queryset())
+            .prefetch_related(None)
+            .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            .values_list(self.updated_field, flat=True)
+            .first()
+        )
+
+    def conditional(self, request, etag, last_modified, render):
+        timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = render()
+        # На 304 тоже, как condition(): клиент обновляет по ним сохранённые валидаторы
+        set_validators(response, etag, last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self.get_list_validators(self.filter_queryset(self.get_queryset()))
+        return self.conditional(request, etag, last_modified, lambda: super(ConditionalGetMixin, self).list(
+            request, *args, **kwargs
+        ))
+
+    def retrieve(self, request, *args, **kwargs):
+        last_modified = self.get_object_last_modified()
+        if last_modified is None:
+            # Not found: let the regular code return 404
+            return super().retrieve(request, *args, **kwargs)
+        etag = make_etag(request.accepted_renderer.format, last_modified.isoformat())
+        return self.conditional(request, etag, last_modified, lambda: super(ConditionalGetMixin, self).retrieve(
+            request, *args, **kwargs
+        ))
@@ -0,0 +1,39 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F
+from rest_framework.filters import SearchFilter
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Полнотекстовый поиск товаров по Product.search_vector.
+
+    Каждое слово запроса ищется как префикс ("lap" найдёт "Laptop"),
+    результаты сортируются по рангу (совпадение в name весит больше,
+    чем в description). Вектор и GIN-индекс есть только в PostgreSQL,
+    на других базах работает обычный SearchFilter по search_fields.
+    """
+    search_config = "simple"
+
+    def get_search_query(self, request) -> SearchQuery | None:
+        words = re.findall(r"\w+", " ".join(self.get_search_terms(request)))
+        if not words:
+            return None
+        raw_query = " & ".join(f"{word}:*" for word in words)
+        return SearchQuery(raw_query, config=self.search_config, search_type="raw")
+
+    def filter_queryset(self, request, queryset, view):
+        if connections[queryset.db].vendor != "postgresql":
+            return super().filter_queryset(request, queryset, view)
+
+        query = self.get_search_query(request)
+        if query is None:
+            return queryset
+        return (
+            queryset
+            .filter(search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank")
+        )
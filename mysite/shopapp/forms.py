@@ -1,8 +1,21 @@
 from django.contrib.auth.models import Group
 from django.forms import ModelForm
 
+from .models import Order
+from .widgets import AutocompleteSelect, AutocompleteSelectMultiple
+
 
 class GroupForm(ModelForm):
     class Meta:
         model = Group
         fields = ["name"]
+
+
+class OrderForm(ModelForm):
+    class Meta:
+        model = Order
+        fields = "products", "delivery_address", "promocode", "user"
+        widgets = {
+            "products": AutocompleteSelectMultiple("shopapp:products_autocomplete"),
+            "user": AutocompleteSelect("shopapp:users_autocomplete"),
+        }
@@ -0,0 +1,78 @@
+import tempfile
+import time
+from random import Random
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import BaseCommand
+
+from mysite.cache_backends import TwoTierCache
+
+
+class Command(BaseCommand):
+    """
+    Compares TwoTierCache with the plain FileBasedCache it replaces.
+
+    Both caches work on the same kind of temporary file cache. The payload
+    mimics a UserOrdersDataExportView entry; reads pick random keys out of
+    a small hot set, and a share of operations are writes.
+    """
+    help = "Benchmark TwoTierCache against FileBasedCache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--operations", type=int, default=20000)
+        parser.add_argument("--keys", type=int, default=100)
+        parser.add_argument("--orders", type=int, default=50, help="Orders per cached export")
+        parser.add_argument("--write-ratio", type=float, default=0.01)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def make_payload(self, orders: int) -> list:
+        return [
+            {
+                "pk": pk,
+                "delivery_address": f"ul Pupkina, d {pk}",
+                "promocode": "SALE123",
+                "products": list(range(pk, pk + 5)),
+                "user": 1,
+            }
+            for pk in range(orders)
+        ]
+
+    def run(self, cache, options) -> float:
+        rng = Random(options["seed"])
+        payload = self.make_payload(options["orders"])
+        keys = [f"user_{pk}_orders_data_export" for pk in range(options["keys"])]
+        for key in keys:
+            cache.set(key, payload, 600)
+
+        started = time.perf_counter()
+        for _ in range(options["operations"]):
+            key = rng.choice(keys)
+            if rng.random() < options["write_ratio"]:
+                cache.set(key, payload, 600)
+            else:
+                cache.get(key)
+        return time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as file_cache_dir, tempfile.TemporaryDirectory() as shared_dir:
+            file_cache = FileBasedCache(file_cache_dir, {})
+            two_tier_cache = TwoTierCache("benchmark", {
+                "OPTIONS": {
+                    "SHARED": {
+                        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                        "LOCATION": shared_dir,
+                    },
+                },
+            })
+            results = [
+                ("FileBasedCache", self.run(file_cache, options)),
+                ("TwoTierCache", self.run(two_tier_cache, options)),
+            ]
+
+        operations = options["operations"]
+        for name, elapsed in results:
+            self.stdout.write(
+                f"{name:<16} {operations / elapsed:>10.0f} ops/s "
+                f"{elapsed / operations * 1e6:>8.1f} us/op"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {results[0][1] / results[1][1]:.1f}x"))
@@ -0,0 +1,219 @@
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import NamedTuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone, translation
+
+
+class Endpoint(NamedTuple):
+    url_name: str
+    login_required: bool = False
+
+
+ENDPOINTS = {
+    "shop-orders": Endpoint("shopapp:orders_list", login_required=True),
+    "shop-api-products": Endpoint("shopapp:product-list"),
+    "shop-orders-export": Endpoint("shopapp:orders-export", login_required=True),
+    "blog-articles": Endpoint("articles_list"),
+    "news": Endpoint("housing_list"),
+}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the main shop, blog and news pages end to end.
+
+    By default requests go through the real URLconf and middleware
+    in-process (django.test.Client), and the SQL queries of every request
+    are counted. With --base-url the same paths are requested over HTTP
+    from a running server, e.g. a local gunicorn on a seeded database
+    (see generate_data); queries are not counted then.
+
+    Results are written as JSON with --output; --compare takes the JSON
+    of a previous run and fails if p95 latency grew by more than
+    --threshold or an endpoint makes more queries than before.
+    """
+    help = "Benchmark shop, blog and news endpoints and compare with a previous run"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoint", action="append", choices=list(ENDPOINTS), help="Default: all")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--base-url", help="e.g. http://127.0.0.1:8000; in-process by default")
+        parser.add_argument("--username", help="User for login-only pages, the first superuser by default")
+        parser.add_argument("--output", type=Path, help="Write the results as JSON")
+        parser.add_argument("--compare", type=Path, help="JSON of a previous run")
+        parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p95 growth, 0.2 = 20%%")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.user = self.get_user(options["username"])
+        names = options["endpoint"] or list(ENDPOINTS)
+
+        results = {
+            "started_at": timezone.now().isoformat(),
+            "mode": options["base_url"] or "in-process",
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+            "endpoints": {name: self.benchmark(name, ENDPOINTS[name]) for name in names},
+        }
+        self.print_results(results)
+        if options["output"]:
+            options["output"].write_text(json.dumps(results, indent=2))
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["compare"]:
+            self.compare(json.loads(options["compare"].read_text()), results, options["threshold"])
+
+    def get_user(self, username: str | None) -> User | None:
+        if username:
+            return User.objects.get(username=username)
+        return User.objects.filter(is_superuser=True).order_by("pk").first()
+
+    def get_path(self, endpoint: Endpoint) -> str:
+        with translation.override(settings.LANGUAGE_CODE[:2]):
+            return reverse(endpoint.url_name)
+
+    def make_client(self, endpoint: Endpoint) -> Client:
+        client = Client(HTTP_HOST="127.0.0.1")
+        if endpoint.login_required:
+            if self.user is None:
+                raise CommandError("No superuser to log in with, pass --username")
+            client.force_login(self.user)
+        return client
+
+    def request_in_process(self, client: Client, path: str) -> int:
+        response = client.get(path)
+        if response.streaming:
+            b"".join(response.streaming_content)
+        return response.status_code
+
+    def request_http(self, client: Client, path: str) -> int:
+        request = urllib.request.Request(self.options["base_url"].rstrip("/") + path)
+        session_cookie = client.cookies.get(settings.SESSION_COOKIE_NAME)
+        if session_cookie:
+            # Session created by force_login in the shared database
+            request.add_header("Cookie", f"{settings.SESSION_COOKIE_NAME}={session_cookie.value}")
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    @property
+    def request(self):
+        return self.request_http if self.options["base_url"] else self.request_in_process
+
+    def run_worker(self, endpoint: Endpoint, path: str, requests: int) -> tuple[list[float], dict, int]:
+        request = self.request
+        client = self.make_client(endpoint)
+        counter = QueryCounter()
+        latencies = []
+        status_codes = {}
+        try:
+            # Reads may go to the replicas (mysite.db.routers)
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(counter))
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    status = request(client, path)
+                    latencies.append(time.perf_counter() - started)
+                    status_codes[status] = status_codes.get(status, 0) + 1
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+        return latencies, status_codes, counter.count
+
+    def benchmark(self, name: str, endpoint: Endpoint) -> dict:
+        path = self.get_path(endpoint)
+        concurrency = self.options["concurrency"]
+        requests = self.options["requests"]
+        shares = [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+
+        # Warm up caches, connections and lazy imports before measuring
+        client = self.make_client(endpoint)
+        for _ in range(self.options["warmup"]):
+            self.request(client, path)
+
+        started = time.perf_counter()
+        if concurrency == 1:
+            runs = [self.run_worker(endpoint, path, requests)]
+        else:
+            with ThreadPoolExecutor(concurrency) as executor:
+                runs = list(executor.map(lambda share: self.run_worker(endpoint, path, share), shares))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for run in runs for latency in run[0])
+        status_codes = {}
+        for run in runs:
+            for status, count in run[1].items():
+                status_codes[str(status)] = status_codes.get(str(status), 0) + count
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+        queries = sum(run[2] for run in runs)
+        return {
+            "path": path,
+            "requests": len(latencies),
+            "errors": sum(count for status, count in status_codes.items() if not status.startswith("2")),
+            "status_codes": status_codes,
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+            "p50_ms": round(percentiles[49] * 1000, 2),
+            "p95_ms": round(percentiles[94] * 1000, 2),
+            "p99_ms": round(percentiles[98] * 1000, 2),
+            "rps": round(len(latencies) / elapsed, 1),
+            "queries_per_request": None if self.options["base_url"] else round(queries / len(latencies), 2),
+        }
+
+    def print_results(self, results: dict) -> None:
+        self.stdout.write(
+            f"{'endpoint':<20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rps':>8} {'queries':>8} {'errors':>7}"
+        )
+        for name, result in results["endpoints"].items():
+            queries = result["queries_per_request"]
+            self.stdout.write(
+                f"{name:<20} {result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} "
+                f"{result['rps']:>8} {'-' if queries is None else queries:>8} {result['errors']:>7}"
+            )
+
+    def compare(self, baseline: dict, results: dict, threshold: float) -> None:
+        for key in ("mode", "concurrency"):
+            if key in baseline and baseline[key] != results[key]:
+                self.stderr.write(f"The baseline has another {key}: {baseline[key]} instead of {results[key]}")
+        regressions = []
+        for name, result in results["endpoints"].items():
+            before = baseline.get("endpoints", {}).get(name)
+            if before is None:
+                continue
+            if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+                regressions.append(f"{name}: p95 {before['p95_ms']} ms -> {result['p95_ms']} ms")
+            if None not in (before["queries_per_request"], result["queries_per_request"]) \
+                    and result["queries_per_request"] > before["queries_per_request"]:
+                regressions.append(
+                    f"{name}: queries {before['queries_per_request']} -> {result['queries_per_request']}"
+                )
+        if regressions:
+            raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
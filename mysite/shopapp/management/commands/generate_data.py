@@ -0,0 +1,254 @@
+import datetime
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, call_command
+from django.db import transaction
+from django.utils import timezone
+
+from blogapp.models import Article, Author, Category, Tag
+from myauth.models import Profile
+from mysite.page_cache import invalidate_models
+from newsapp.models import Housing, HousingType, News, NumberOfRooms
+from shopapp.models import Order, Product
+
+WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima mike november "
+    "oscar papa quebec romeo sierra tango uniform victor whiskey xray yankee zulu "
+    "laptop desktop phone tablet monitor keyboard mouse camera speaker router cable charger"
+).split()
+
+# Number of products in an order: mostly one to three, sometimes many
+PRODUCTS_PER_ORDER_WEIGHTS = [0, 35, 25, 15, 9, 6, 4, 3, 2, 1]
+
+# Generated dates end here unless --now is given, so a seed always gives the same rows
+DEFAULT_NOW = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def aware_datetime(value: str) -> datetime.datetime:
+    parsed = datetime.datetime.fromisoformat(value)
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, datetime.timezone.utc)
+
+
+class Command(BaseCommand):
+    """
+    Generates synthetic data for scale testing.
+
+    The same --seed and --now always produce the same data. Rows are
+    written with bulk_create in batches of --batch-size, each batch in its
+    own transaction, and only primary keys of users and products are kept
+    in memory, so 1M orders need no more memory than 10k.
+
+    Product popularity is skewed (low product numbers are ordered much
+    more often), as is the number of products per order, and creation
+    dates are spread over --days days before --now. bulk_create fills
+    auto_now_add fields itself, so generated creation dates are written
+    with bulk_update in the same transaction. Order totals are computed
+    in the database per batch and the daily sales rollups are rebuilt at
+    the end.
+
+    Names include --prefix (by default derived from the seed), so run
+    the command with another seed or prefix to add more data.
+    """
+    help = "Generate users, products, orders, blog articles, news and housing for scale testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--prefix", help="Prefix of usernames and skus, gen<seed> by default")
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--products", type=int, default=10000)
+        parser.add_argument("--orders", type=int, default=100000)
+        parser.add_argument("--articles", type=int, default=1000)
+        parser.add_argument("--news", type=int, default=1000)
+        parser.add_argument("--housing", type=int, default=1000)
+        parser.add_argument("--days", type=int, default=365, help="Spread creation dates over this many days")
+        parser.add_argument(
+            "--now", type=aware_datetime, default=DEFAULT_NOW,
+            help=f"End of the generated period, ISO 8601 (UTC if no offset), {DEFAULT_NOW.isoformat()} by default",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.prefix = options["prefix"] or f"gen{options['seed']}"
+        self.batch_size = options["batch_size"]
+        self.now = options["now"]
+        self.days = options["days"]
+        self.rows = 0
+        started = time.monotonic()
+
+        user_pks = self.generate_users(options["users"])
+        product_pks = self.generate_products(options["products"], user_pks)
+        self.generate_orders(options["orders"], user_pks, product_pks)
+        self.generate_articles(options["articles"])
+        self.generate_news(options["news"])
+        self.generate_housing(options["housing"])
+        invalidate_models(Product, News)
+
+        if options["orders"]:
+            call_command("rebuild_sales", stdout=self.stdout)
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {self.rows} rows in {elapsed:.1f}s ({self.rows / elapsed * 60:.0f} rows/min)"
+        ))
+
+    def batches(self, count: int):
+        for start in range(0, count, self.batch_size):
+            yield range(start, min(start + self.batch_size, count))
+
+    def text(self, words: int) -> str:
+        return " ".join(self.random.choices(WORDS, k=words))
+
+    def timestamp(self, position: float) -> datetime.datetime:
+        """Creation time at ``position`` (0..1) of the generated period, plus some jitter."""
+        seconds = self.days * 86400 * (1 - position) + self.random.uniform(0, 3600)
+        return self.now - datetime.timedelta(seconds=seconds)
+
+    def bulk_create(self, model, objects: list, timestamp_field: str | None = None) -> list:
+        """
+        Insert ``objects`` in one transaction. ``timestamp_field`` is an
+        auto_now_add field: bulk_create overwrites it with the current time,
+        so the generated values are written back with bulk_update.
+        """
+        timestamps = [getattr(obj, timestamp_field) for obj in objects] if timestamp_field else None
+        with transaction.atomic():
+            created = model.objects.bulk_create(objects)
+            if timestamp_field:
+                for obj, value in zip(created, timestamps):
+                    setattr(obj, timestamp_field, value)
+                model.objects.bulk_update(created, [timestamp_field], batch_size=1000)
+        self.rows += len(objects)
+        return created
+
+    def generate_users(self, count: int) -> list[int]:
+        # Hashing is deliberately slow: one hash for all generated users
+        password = make_password(self.prefix)
+        user_pks = []
+        for batch in self.batches(count):
+            users = self.bulk_create(User, [
+                User(
+                    username=f"{self.prefix}_user_{index}",
+                    first_name=self.random.choice(WORDS).title(),
+                    email=f"{self.prefix}_user_{index}@example.com",
+                    password=password,
+                )
+                for index in batch
+            ])
+            user_pks.extend(user.pk for user in users)
+            self.bulk_create(Profile, [Profile(user_id=user.pk, bio=self.text(8)) for user in users])
+        self.stdout.write(f"{count} users")
+        return user_pks
+
+    def generate_products(self, count: int, user_pks: list[int]) -> list[int]:
+        product_pks = []
+        for batch in self.batches(count):
+            products = self.bulk_create(Product, [
+                Product(
+                    sku=f"{self.prefix}-{index:07d}",
+                    name=f"{self.text(2).title()} {index}",
+                    description=self.text(20),
+                    price=f"{min(self.random.lognormvariate(4, 1), 99999):.2f}",
+                    discount=self.random.choice((0, 0, 0, 5, 10, 15, 25)),
+                    created_by_id=self.random.choice(user_pks),
+                    created_at=self.timestamp(index / count * 0.1),
+                    archived=self.random.random() < 0.05,
+                )
+                for index in batch
+            ], timestamp_field="created_at")
+            product_pks.extend(product.pk for product in products)
+        self.stdout.write(f"{count} products")
+        return product_pks
+
+    def popular_product(self, product_pks: list[int]) -> int:
+        return product_pks[int(len(product_pks) * self.random.random() ** 3)]
+
+    def generate_orders(self, count: int, user_pks: list[int], product_pks: list[int]) -> None:
+        if not product_pks:
+            return
+        sizes = range(len(PRODUCTS_PER_ORDER_WEIGHTS))
+        for batch in self.batches(count):
+            orders = self.bulk_create(Order, [
+                Order(
+                    user_id=self.random.choice(user_pks),
+                    delivery_address=self.text(4).title(),
+                    promocode=self.random.choice(("", "", "", "SALE10", "WELCOME")),
+                    created_at=self.timestamp(index / count),
+                )
+                for index in batch
+            ], timestamp_field="created_at")
+            lines = []
+            for order in orders:
+                size = self.random.choices(sizes, PRODUCTS_PER_ORDER_WEIGHTS)[0]
+                products = {self.popular_product(product_pks) for _ in range(size)}
+                lines.extend(Order.products.through(order_id=order.pk, product_id=pk) for pk in products)
+            with transaction.atomic():
+                Order.products.through.objects.bulk_create(lines)
+                Order.objects.filter(pk__gte=orders[0].pk, pk__lte=orders[-1].pk).recompute_totals()
+            self.rows += len(lines)
+            self.stdout.write(f"{batch.stop} of {count} orders")
+
+    def generate_articles(self, count: int) -> None:
+        if not count:
+            return
+        authors = self.bulk_create(Author, [
+            Author(name=self.text(2).title(), bio=self.text(12)) for _ in range(max(count // 20, 1))
+        ])
+        categories = self.bulk_create(Category, [Category(name=self.text(1).title()) for _ in range(20)])
+        tags = self.bulk_create(Tag, [Tag(name=f"{self.text(1)}{index}") for index in range(50)])
+        for batch in self.batches(count):
+            articles = self.bulk_create(Article, [
+                Article(
+                    title=self.text(5).capitalize(),
+                    content=self.text(200),
+                    pub_date=self.timestamp(index / count),
+                    author_id=self.random.choice(authors).pk,
+                    category_id=self.random.choice(categories).pk,
+                )
+                for index in batch
+            ], timestamp_field="pub_date")
+            self.bulk_create(Article.tags.through, [
+                Article.tags.through(article_id=article.pk, tag_id=tag.pk)
+                for article in articles
+                for tag in self.random.sample(tags, self.random.randint(1, 4))
+            ])
+        self.stdout.write(f"{count} articles")
+
+    def generate_news(self, count: int) -> None:
+        for batch in self.batches(count):
+            news = []
+            for index in batch:
+                is_published = self.random.random() < 0.8
+                news.append(News(
+                    title=self.text(5).capitalize(),
+                    text=self.text(100),
+                    description=self.text(15),
+                    is_published=is_published,
+                    published_at=self.timestamp(index / count) if is_published else None,
+                ))
+            self.bulk_create(News, news)
+        self.stdout.write(f"{count} news")
+
+    def generate_housing(self, count: int) -> None:
+        if not count:
+            return
+        # Reuse the types from the fixtures if they are loaded
+        housing_types = list(HousingType.objects.all()) or [
+            HousingType.objects.create(title=title) for title in ("Apartment", "A private house")
+        ]
+        rooms = list(NumberOfRooms.objects.all()) or [
+            NumberOfRooms.objects.create(quantity=quantity) for quantity in range(1, 6)
+        ]
+        for batch in self.batches(count):
+            self.bulk_create(Housing, [
+                Housing(
+                    housing_type=self.random.choice(housing_types),
+                    number_of_room=self.random.choice(rooms),
+                    address=self.text(4).title(),
+                    square=round(self.random.uniform(20, 250), 1),
+                )
+                for _ in batch
+            ])
+        self.stdout.write(f"{count} housing")
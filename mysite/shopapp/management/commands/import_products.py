@@ -0,0 +1,147 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from mysite.page_cache import invalidate_models
+from shopapp.models import Order, Product
+from shopapp.rollups import reprice_product_sales
+from shopapp.serializers import ProductImportSerializers
+from shopapp.signals import OrderProduct, orders_changed, touch_orders
+
+
+class Command(BaseCommand):
+    """
+    Imports products from a CSV or NDJSON file.
+
+    The file is read as a stream and written in batches: every batch is
+    validated, then upserted by sku with one bulk_create(update_conflicts=True)
+    in its own transaction. After each committed batch the number of
+    processed rows is saved to a checkpoint file, so a failed import
+    started again with the same arguments continues where it stopped.
+    """
+    help = "Import products from a CSV or NDJSON file, upserting by sku"
+
+    update_fields = ["name", "description", "price", "discount", "archived", "updated_at"]
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=Path)
+        parser.add_argument("--format", choices=["csv", "ndjson"], help="Detected by file extension by default")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--created-by", help="Username set as created_by of new products")
+        parser.add_argument("--checkpoint", type=Path, help="Defaults to <path>.checkpoint")
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+
+    def read_rows(self, path: Path, file_format: str):
+        with path.open(newline="", encoding="utf-8") as file:
+            if file_format == "csv":
+                yield from csv.DictReader(file)
+                return
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def read_checkpoint(self, checkpoint: Path) -> int:
+        try:
+            return int(checkpoint.read_text())
+        except FileNotFoundError:
+            return 0
+
+    def write_checkpoint(self, checkpoint: Path, rows_done: int) -> None:
+        tmp_path = checkpoint.with_name(checkpoint.name + ".tmp")
+        tmp_path.write_text(str(rows_done))
+        os.replace(tmp_path, checkpoint)
+
+    def validate_batch(self, batch: list, first_row: int, created_by_id: int) -> list[Product]:
+        # One serializer for the whole batch, as ListSerializer does: building
+        # the fields of a ModelSerializer for every row costs more than the upsert.
+        # is_valid(many=True) would reject the batch for one bad row, so the
+        # rows are validated by the child one by one.
+        validator = ProductImportSerializers(many=True).child
+        products = {}
+        for row_number, row in enumerate(batch, start=first_row):
+            try:
+                validated_data = validator.run_validation(row)
+            except ValidationError as exc:
+                self.stderr.write(f"Row {row_number}: {dict(exc.detail)}")
+                continue
+            # The same sku twice in one INSERT ... ON CONFLICT is an error: keep the last one
+            products[validated_data["sku"]] = Product(created_by_id=created_by_id, **validated_data)
+        return list(products.values())
+
+    def changed_skus(self, products: list[Product]) -> tuple[list[str], list[str]]:
+        """
+        Skus of already stored products whose price or discount differs from
+        the batch, and of those where only the name differs.
+        """
+        incoming = {product.sku: product for product in products}
+        stored = Product.objects.filter(sku__in=incoming).values_list("sku", "name", "price", "discount")
+        repriced, renamed = [], []
+        for sku, name, price, discount in stored:
+            product = incoming[sku]
+            if (product.price, product.discount) != (price, discount):
+                repriced.append(sku)
+            elif product.name != name:
+                renamed.append(sku)
+        return repriced, renamed
+
+    def handle(self, *args, **options):
+        path: Path = options["path"]
+        file_format = options["format"] or ("csv" if path.suffix.lower() == ".csv" else "ndjson")
+        batch_size = options["batch_size"]
+        checkpoint: Path = options["checkpoint"] or path.with_name(path.name + ".checkpoint")
+        if not path.exists():
+            raise CommandError(f"File {path} does not exist")
+
+        created_by_id = Product._meta.get_field("created_by").get_default()
+        if options["created_by"]:
+            created_by_id = User.objects.values_list("pk", flat=True).get(username=options["created_by"])
+
+        rows_done = 0 if options["restart"] else self.read_checkpoint(checkpoint)
+        if rows_done:
+            self.stdout.write(f"Resuming after row {rows_done} from {checkpoint}")
+
+        rows = islice(self.read_rows(path, file_format), rows_done, None)
+        started = time.monotonic()
+        rows_imported = rows_written = 0
+        while batch := list(islice(rows, batch_size)):
+            products = self.validate_batch(batch, rows_done + 1, created_by_id)
+            with transaction.atomic():
+                repriced_skus, renamed_skus = self.changed_skus(products)
+                Product.objects.bulk_create(
+                    products,
+                    update_conflicts=True,
+                    unique_fields=["sku"],
+                    update_fields=self.update_fields,
+                )
+                # bulk_create sends no signals: recompute orders whose product prices changed
+                if repriced_skus:
+                    order_pks = OrderProduct.objects.filter(product__sku__in=repriced_skus).values("order_id")
+                    orders_changed(Order.objects.filter(pk__in=order_pks))
+                    reprice_product_sales(Product.objects.filter(sku__in=repriced_skus))
+                # Orders show product names: their ETags must change too
+                if renamed_skus:
+                    order_pks = OrderProduct.objects.filter(product__sku__in=renamed_skus).values("order_id")
+                    touch_orders(Order.objects.filter(pk__in=order_pks))
+            rows_done += len(batch)
+            rows_imported += len(batch)
+            rows_written += len(products)
+            self.write_checkpoint(checkpoint, rows_done)
+
+            elapsed = max(time.monotonic() - started, 1e-6)
+            self.stdout.write(
+                f"{rows_done} rows processed, {rows_written} products written, "
+                f"{rows_imported / elapsed:.0f} rows/s"
+            )
+
+        # bulk_create does not send post_save
+        invalidate_models(Product)
+        checkpoint.unlink(missing_ok=True)
+        self.stdout.write(self.style.SUCCESS(f"Imported {rows_written} products from {path}"))
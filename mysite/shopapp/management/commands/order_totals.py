@@ -0,0 +1,57 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Max, Q
+
+from shopapp.models import Order, order_totals_expressions
+
+
+class Command(BaseCommand):
+    """
+    Backfills or verifies the stored order totals.
+
+    Without options every order is recomputed in pk ranges of --batch-size,
+    each range in its own short transaction. With --verify nothing is
+    written: orders whose stored totals differ from the products are
+    reported and the command fails if there are any.
+    """
+    help = "Recompute (or --verify) Order.items_count, subtotal and total_after_discount"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true", help="Only report orders with wrong totals")
+        parser.add_argument("--batch-size", type=int, default=10000)
+        parser.add_argument("--show", type=int, default=20, help="How many wrong orders to list with --verify")
+
+    def handle(self, *args, **options):
+        if options["verify"]:
+            return self.verify(options["show"])
+
+        batch_size = options["batch_size"]
+        last_pk = Order.objects.aggregate(last_pk=Max("pk"))["last_pk"] or 0
+        updated = 0
+        for start in range(0, last_pk, batch_size):
+            with transaction.atomic():
+                updated += Order.objects.filter(pk__gt=start, pk__lte=start + batch_size).recompute_totals()
+            self.stdout.write(f"{updated} orders recomputed")
+        self.stdout.write(self.style.SUCCESS(f"Recomputed totals of {updated} orders"))
+
+    def verify(self, show: int):
+        expected = {f"expected_{name}": value for name, value in order_totals_expressions().items()}
+        wrong = (
+            Order.objects
+            .annotate(**expected)
+            .filter(
+                ~Q(items_count=F("expected_items_count"))
+                | ~Q(subtotal=F("expected_subtotal"))
+                | ~Q(total_after_discount=F("expected_total_after_discount"))
+            )
+            .order_by("pk")
+        )
+        wrong_pks = list(wrong.values_list("pk", flat=True)[:show])
+        if not wrong_pks:
+            self.stdout.write(self.style.SUCCESS("All order totals are correct"))
+            return
+        wrong_count = wrong.count()
+        raise CommandError(
+            f"{wrong_count} orders have wrong totals, e.g. {wrong_pks}. "
+            f"Run the command without --verify to fix them."
+        )
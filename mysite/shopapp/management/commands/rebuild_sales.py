@@ -0,0 +1,49 @@
+import datetime
+
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from shopapp.models import DailySales, Order
+from shopapp.rollups import refresh_days
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds DailySales and ProductDailySales from the orders.
+
+    Days are processed in batches of --days-per-batch, each batch in its
+    own transaction, so the command can be used for backfills on a live
+    database. By default the whole range of existing orders is rebuilt.
+    """
+    help = "Rebuild the daily sales rollups for a date range"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date-from", type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+        parser.add_argument("--date-to", type=datetime.date.fromisoformat, help="YYYY-MM-DD, inclusive")
+        parser.add_argument("--days-per-batch", type=int, default=31)
+
+    def handle(self, *args, **options):
+        date_from, date_to = options["date_from"], options["date_to"]
+        if date_from is None or date_to is None:
+            # Days with orders and days that already have rollups (their orders may be gone)
+            orders = Order.objects.aggregate(first=Min("created_at"), last=Max("created_at"))
+            rollups = DailySales.objects.aggregate(first=Min("day"), last=Max("day"))
+            firsts = [day for day in (orders["first"] and timezone.localdate(orders["first"]), rollups["first"]) if day]
+            lasts = [day for day in (orders["last"] and timezone.localdate(orders["last"]), rollups["last"]) if day]
+            if not firsts:
+                self.stdout.write("No orders, nothing to rebuild")
+                return
+            date_from = date_from or min(firsts)
+            date_to = date_to or max(lasts)
+        if date_from > date_to:
+            raise CommandError("--date-from is after --date-to")
+
+        days_per_batch = options["days_per_batch"]
+        day = date_from
+        while day <= date_to:
+            batch_end = min(day + datetime.timedelta(days=days_per_batch - 1), date_to)
+            refresh_days(day + datetime.timedelta(days=offset) for offset in range((batch_end - day).days + 1))
+            self.stdout.write(f"Rebuilt {day} - {batch_end}")
+            day = batch_end + datetime.timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt daily sales from {date_from} to {date_to}"))
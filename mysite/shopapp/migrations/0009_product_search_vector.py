@@ -0,0 +1,60 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:02
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Full-text search exists only on PostgreSQL; on other databases
+# (the SQLite test database) the column stays NULL and
+# ProductSearchFilter falls back to SearchFilter.
+CREATE_SEARCH_VECTOR_SQL = """
+CREATE INDEX shopapp_product_search_vector_idx
+    ON shopapp_product USING gin (search_vector);
+
+CREATE FUNCTION shopapp_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER shopapp_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, description ON shopapp_product
+    FOR EACH ROW EXECUTE PROCEDURE shopapp_product_search_vector_update();
+
+UPDATE shopapp_product SET name = name;
+"""
+
+DROP_SEARCH_VECTOR_SQL = """
+DROP TRIGGER IF EXISTS shopapp_product_search_vector_trigger ON shopapp_product;
+DROP FUNCTION IF EXISTS shopapp_product_search_vector_update();
+DROP INDEX IF EXISTS shopapp_product_search_vector_idx;
+"""
+
+
+def create_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_SEARCH_VECTOR_SQL)
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_SEARCH_VECTOR_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0008_alter_order_options_alter_product_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:12
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def set_updated_at(apps, schema_editor):
+    for model_name in ("Product", "Order"):
+        apps.get_model("shopapp", model_name).objects.update(updated_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0010_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_updated_at, migrations.RunPython.noop),
+    ]
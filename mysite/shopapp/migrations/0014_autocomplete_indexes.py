@@ -0,0 +1,42 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:40
+
+from django.conf import settings
+from django.db import migrations
+
+
+# Autocomplete searches with istartswith, which PostgreSQL compiles to
+# UPPER(column::text) LIKE UPPER('prefix%'). Only an expression index with
+# text_pattern_ops can serve that LIKE; on other databases nothing to do.
+CREATE_PREFIX_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS shopapp_product_name_prefix_idx
+    ON shopapp_product (UPPER(name::text) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS shopapp_auth_user_username_prefix_idx
+    ON auth_user (UPPER(username::text) text_pattern_ops);
+"""
+
+DROP_PREFIX_INDEXES_SQL = """
+DROP INDEX IF EXISTS shopapp_product_name_prefix_idx;
+DROP INDEX IF EXISTS shopapp_auth_user_username_prefix_idx;
+"""
+
+
+def create_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_PREFIX_INDEXES_SQL)
+
+
+def drop_prefix_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_PREFIX_INDEXES_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shopapp', '0013_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_indexes, drop_prefix_indexes),
+    ]
@@ -1,9 +1,20 @@
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
 
 from django.utils.translation import gettext_lazy as _
 
 
+class ProductManager(models.Manager):
+    def get_queryset(self):
+        # Вектор нужен только фильтру поиска (shopapp.filters), в запросах
+        # за самими товарами он лишний
+        return super().get_queryset().defer("search_vector")
+
+
 class Product(models.Model):
     '''
     Модель Product представляет товар,
@@ -16,18 +27,74 @@ class Product(models.Model):
         verbose_name = _("Product")
         verbose_name_plural = _("Products")
 
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=100)
     description = models.TextField(null=False, blank=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
     discount = models.SmallIntegerField(default=0)
     created_by = models.ForeignKey(User, on_delete=models.PROTECT, default=1)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     archived = models.BooleanField(default=False)
+    # Заполняется триггером в PostgreSQL (миграция 0009), веса: name - A, description - B
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Нужно сигналам, чтобы пересчитать суммы заказов при смене цены или скидки
+        # и сдвинуть их updated_at при смене названия
+        instance._loaded_prices = (instance.__dict__.get("price"), instance.__dict__.get("discount"))
+        instance._loaded_name = instance.__dict__.get("name")
+        return instance
 
     def __str__(self):
         return f"Product(pk={self.pk}, name={self.name!r})"
 
 
+class OrderQuerySet(models.QuerySet):
+    def recompute_totals(self, exclude_product: int | None = None) -> int:
+        """
+        Пересчитать items_count, subtotal и total_after_discount одним UPDATE.
+
+        Скидка товара - в процентах. Вызывается сигналами (shopapp.signals)
+        и кодом, который меняет состав заказов или цены в обход сигналов.
+        ``exclude_product`` - pk товара, строки которого сейчас будут удалены.
+        """
+        return self.update(updated_at=timezone.now(), **order_totals_expressions(exclude_product))
+
+
+def price_after_discount(product: str = "product"):
+    """Цена товара со скидкой (в процентах) для строк заказа или товаров."""
+    prefix = f"{product}__" if product else ""
+    return ExpressionWrapper(
+        F(f"{prefix}price") * (100 - F(f"{prefix}discount")) / 100,
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def order_totals_expressions(exclude_product: int | None = None) -> dict:
+    """Подзапросы с актуальными суммами заказа, для update() и annotate()."""
+    money = DecimalField(max_digits=12, decimal_places=2)
+    lines = Order.products.through.objects.filter(order_id=OuterRef("pk"))
+    if exclude_product is not None:
+        lines = lines.exclude(product_id=exclude_product)
+    lines = lines.order_by().values("order_id")
+    return {
+        "items_count": Coalesce(Subquery(lines.annotate(count=Count("*")).values("count")), 0),
+        "subtotal": Coalesce(
+            Subquery(lines.annotate(sum=Sum("product__price")).values("sum"), output_field=money),
+            Value(0, output_field=money),
+        ),
+        "total_after_discount": Coalesce(
+            Subquery(lines.annotate(sum=Round(Sum(price_after_discount()), 2)).values("sum"), output_field=money),
+            Value(0, output_field=money),
+        ),
+    }
+
+
 class Order(models.Model):
     '''
     Модель Order представляет заказ,
@@ -39,9 +106,107 @@ class Order(models.Model):
         ordering = ["user"]
         verbose_name = _("Order")
         verbose_name_plural = _("Orders")
+        indexes = [
+            # Сортировка и keyset-пагинация по сумме заказа
+            models.Index(fields=["total_after_discount", "id"], name="shopapp_order_total_idx"),
+        ]
 
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Индекс нужен пересчёту продаж по дням (shopapp.rollups)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Меняется и при изменении состава заказа (shopapp.signals)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     products = models.ManyToManyField(Product, related_name="orders")
+    # Хранимые суммы, поддерживаются OrderQuerySet.recompute_totals()
+    items_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(default=0, max_digits=12, decimal_places=2)
+    total_after_discount = models.DecimalField(default=0, max_digits=12, decimal_places=2)
+
+    objects = OrderQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Нужно сигналам, чтобы сбросить кэш и прежнего владельца заказа
+        instance._loaded_user_id = instance.__dict__.get("user_id")
+        return instance
+
+
+class DailySales(models.Model):
+    """
+    Продажи за день, считаются из хранимых сумм заказов.
+
+    Поддерживается shopapp.rollups, пересобирается командой rebuild_sales.
+    """
+    class Meta:
+        ordering = ["day"]
+        verbose_name = _("Daily sales")
+        verbose_name_plural = _("Daily sales")
+
+    day = models.DateField(unique=True)
+    orders_count = models.PositiveIntegerField(default=0)
+    items_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+
+
+class ProductDailySales(models.Model):
+    """Продажи товара за день: сколько раз заказан и на какую сумму со скидкой."""
+    class Meta:
+        ordering = ["day", "product"]
+        verbose_name = _("Product daily sales")
+        verbose_name_plural = _("Product daily sales")
+        constraints = [
+            models.UniqueConstraint(fields=["day", "product"], name="shopapp_product_daily_sales_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["product", "day"], name="shopapp_product_sales_idx"),
+        ]
+
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales")
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+
+
+class BulkActionJob(models.Model):
+    """
+    Массовое действие админки, которое выполняется в фоне пачками.
+
+    Создаётся и исполняется shopapp.bulk_actions, см. chunked_admin_action
+    в shopapp.admin_mixins.
+    """
+    class Status(models.TextChoices):
+        PENDING = "pending", _("Pending")
+        RUNNING = "running", _("Running")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+        CANCELLED = "cancelled", _("Cancelled")
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = _("Bulk action job")
+        verbose_name_plural = _("Bulk action jobs")
+
+    action = models.CharField(max_length=200)
+    model = models.CharField(max_length=100)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    # Число выбранных объектов, считается уже в фоне
+    total = models.PositiveIntegerField(null=True, blank=True)
+    processed = models.PositiveIntegerField(default=0)
+    # pk последнего обработанного объекта: следующая пачка начинается после него
+    last_pk = models.BigIntegerField(null=True, blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.Status.DONE, self.Status.FAILED, self.Status.CANCELLED)
+
+    def __str__(self):
+        return f"{self.action} ({self.model}, #{self.pk})"
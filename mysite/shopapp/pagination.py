@@ -0,0 +1,360 @@
+"""
+Keyset (cursor) pagination.
+
+Страница выбирается условием по значениям полей сортировки последней
+записи предыдущей страницы, а не через OFFSET, поэтому глубокие страницы
+стоят столько же, сколько первая, и COUNT(*) не нужен.
+К полям сортировки всегда добавляется pk, так что порядок стабилен
+и для неуникальных полей вроде name или price.
+
+Там, где нужны номера страниц (админка, ``?page=`` в API), число записей
+больших таблиц берётся из оценки планировщика PostgreSQL:
+EstimatedCountPaginator.
+"""
+
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import operator
+import uuid
+from functools import reduce
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Model, Q, QuerySet
+from django.utils.functional import cached_property
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetField(NamedTuple):
+    name: str
+    descending: bool
+    nullable: bool
+
+    def __str__(self):
+        return f"-{self.name}" if self.descending else self.name
+
+    def reversed(self) -> "KeysetField":
+        return self._replace(descending=not self.descending)
+
+    def order_by(self):
+        # NULLs go last in ascending and first in descending order,
+        # so reversing the direction reverses the whole sequence.
+        if self.descending:
+            return F(self.name).desc(nulls_first=True)
+        return F(self.name).asc(nulls_last=True)
+
+    def after(self, value) -> Q | None:
+        """Condition for rows strictly after ``value`` in this field's direction."""
+        if value is None:
+            if self.descending:
+                return Q(**{f"{self.name}__isnull": False})
+            return None
+        lookup = "lt" if self.descending else "gt"
+        condition = Q(**{f"{self.name}__{lookup}": value})
+        if self.nullable and not self.descending:
+            condition |= Q(**{f"{self.name}__isnull": True})
+        return condition
+
+    def equal(self, value) -> Q:
+        if value is None:
+            return Q(**{f"{self.name}__isnull": True})
+        return Q(**{self.name: value})
+
+    def get_value(self, obj: Model):
+        for attr in self.name.split("__"):
+            obj = getattr(obj, attr)
+            if obj is None:
+                break
+        return obj
+
+
+class KeysetPage(NamedTuple):
+    object_list: list
+    next_cursor: str | None
+    previous_cursor: str | None
+
+
+def _resolve_field(model: type[Model], name: str) -> KeysetField:
+    descending = name.startswith("-")
+    name = name.lstrip("-")
+    if name == "pk":
+        return KeysetField(name, descending, nullable=False)
+
+    path = name.split("__")
+    opts = model._meta
+    try:
+        for attr in path[:-1]:
+            opts = opts.get_field(attr).related_model._meta
+        field = opts.get_field(path[-1])
+    except (FieldDoesNotExist, AttributeError):
+        # Annotation, e.g. a search rank
+        return KeysetField(name, descending, nullable=True)
+
+    if field.concrete and (field.many_to_one or field.one_to_one):
+        # Ordering by a foreign key means ordering by its column
+        name = f"{name}_id"
+    return KeysetField(name, descending, nullable=field.null)
+
+
+def get_keyset_fields(queryset: QuerySet, ordering=None) -> list[KeysetField]:
+    if not ordering:
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+    fields = [
+        _resolve_field(queryset.model, name)
+        for name in ordering
+        if isinstance(name, str) and name != "?"
+    ]
+    pk_name = queryset.model._meta.pk.attname
+    if not any(field.name in ("pk", pk_name) for field in fields):
+        fields.append(KeysetField("pk", descending=False, nullable=False))
+    return fields
+
+
+def _json_value(value):
+    # DjangoJSONEncoder rounds datetimes to milliseconds, which is not
+    # precise enough to compare against stored values.
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+def encode_cursor(fields: list[KeysetField], values: list, reverse: bool) -> str:
+    data = {
+        "o": [str(field) for field in fields],
+        "p": [_json_value(value) for value in values],
+        "r": int(reverse),
+    }
+    encoded = base64.urlsafe_b64encode(json.dumps(data).encode())
+    return encoded.decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, fields: list[KeysetField]) -> tuple[list, bool]:
+    try:
+        encoded = cursor.encode() + b"=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(encoded))
+        ordering, position, reverse = data["o"], data["p"], bool(data["r"])
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+    if ordering != [str(field) for field in fields] or len(position) != len(fields):
+        raise InvalidCursor(cursor)
+    return position, reverse
+
+
+def keyset_filter(fields: list[KeysetField], position: list) -> Q:
+    """Rows strictly after ``position`` in the order given by ``fields``."""
+    conditions = []
+    equal = Q()
+    for field, value in zip(fields, position):
+        after = field.after(value)
+        if after is not None:
+            conditions.append(equal & after)
+        equal &= field.equal(value)
+    if not conditions:
+        return Q(pk__in=[])
+    return reduce(operator.or_, conditions)
+
+
+def paginate_keyset(queryset: QuerySet, page_size: int, cursor: str | None = None, ordering=None) -> KeysetPage:
+    """
+    Return one page of ``queryset`` after the position encoded in ``cursor``.
+
+    Runs exactly one query (plus whatever prefetches the queryset has).
+    Raises InvalidCursor if the cursor is malformed or was issued for
+    a different ordering.
+    """
+    fields = get_keyset_fields(queryset, ordering)
+    position, reverse = decode_cursor(cursor, fields) if cursor else (None, False)
+
+    query_fields = [field.reversed() for field in fields] if reverse else fields
+    queryset = queryset.order_by(*(field.order_by() for field in query_fields))
+    if position is not None:
+        queryset = queryset.filter(keyset_filter(query_fields, position))
+
+    results = list(queryset[:page_size + 1])
+    has_more = len(results) > page_size
+    results = results[:page_size]
+    if reverse:
+        results.reverse()
+
+    has_next = position is not None if reverse else has_more
+    has_previous = has_more if reverse else position is not None
+    next_cursor = previous_cursor = None
+    if results and has_next:
+        values = [field.get_value(results[-1]) for field in fields]
+        next_cursor = encode_cursor(fields, values, reverse=False)
+    if results and has_previous:
+        values = [field.get_value(results[0]) for field in fields]
+        previous_cursor = encode_cursor(fields, values, reverse=True)
+    return KeysetPage(results, next_cursor, previous_cursor)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts PostgreSQL's row estimate for large querysets.
+
+    An unfiltered queryset is estimated from ``pg_class.reltuples``, a
+    filtered one from the ``EXPLAIN`` plan. Only if the estimate is below
+    ``estimate_threshold`` (PAGINATOR_ESTIMATE_THRESHOLD by default) is
+    the exact COUNT(*) run, so small results still have precise page counts.
+    """
+    estimate_threshold = None
+
+    @cached_property
+    def count(self) -> int:
+        threshold = self.estimate_threshold
+        if threshold is None:
+            threshold = settings.PAGINATOR_ESTIMATE_THRESHOLD
+        estimate = self.estimate()
+        if estimate is None or estimate < threshold:
+            return super().count
+        return estimate
+
+    def estimate(self) -> int | None:
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        query = queryset.query
+        with connection.cursor() as cursor:
+            if not query.where and not query.distinct and not query.combinator and not query.is_sliced:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [connection.ops.quote_name(queryset.model._meta.db_table)],
+                )
+                row = cursor.fetchone()
+                # -1, пока таблицу ни разу не анализировали
+                if row and row[0] >= 0:
+                    return int(row[0])
+                return None
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPageNumberPagination(PageNumberPagination):
+    """PageNumberPagination with an estimated ``count`` for large tables."""
+    django_paginator_class = EstimatedCountPaginator
+
+
+class KeysetListMixin:
+    """
+    Keyset pagination for ListView: ``?cursor=`` instead of ``?page=``.
+
+    ``page_obj`` in the context is a KeysetPage with ``next_cursor`` and
+    ``previous_cursor``. There is no paginator and no COUNT(*).
+    """
+    cursor_kwarg = "cursor"
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        try:
+            page = paginate_keyset(queryset, page_size, cursor)
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        is_paginated = page.next_cursor is not None or page.previous_cursor is not None
+        return None, page, page.object_list, is_paginated
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over the OrderingFilter ordering, without COUNT(*).
+
+    Clients that pass ``?page=`` explicitly get page-number pagination
+    with a total count, estimated for large tables.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+    page_number_pagination_class = EstimatedCountPageNumberPagination
+
+    def __init__(self):
+        self.page_number_pagination = None
+        self.page = None
+        self.request = None
+
+    def get_ordering(self, request, queryset, view):
+        for backend in getattr(view, "filter_backends", []):
+            if issubclass(backend, OrderingFilter):
+                return backend().get_ordering(request, queryset, view)
+        return None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_query_param = self.page_number_pagination_class.page_query_param
+        if page_query_param in request.query_params:
+            self.page_number_pagination = self.page_number_pagination_class()
+            return self.page_number_pagination.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        ordering = self.get_ordering(request, queryset, view)
+        cursor = request.query_params.get(self.cursor_query_param)
+        try:
+            self.page = paginate_keyset(queryset, self.page_size, cursor, ordering)
+        except InvalidCursor:
+            raise NotFound(self.invalid_cursor_message)
+        return self.page.object_list
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self.get_cursor_link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self.get_cursor_link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        if self.page_number_pagination is not None:
+            return self.page_number_pagination.get_paginated_response(data)
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "previous": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            *self.page_number_pagination_class().get_schema_operation_parameters(view),
+        ]
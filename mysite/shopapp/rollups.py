@@ -0,0 +1,219 @@
+"""
+Агрегаты продаж по дням: DailySales и ProductDailySales.
+
+Сигналы (shopapp.signals) применяют к ним разницу, которую внесло
+изменение заказов, в той же транзакции: строки создаются при
+необходимости, а счётчики и суммы сдвигаются UPDATE ... SET x = x + delta,
+так что одновременные изменения одного дня не теряются. Разница считается
+только по затронутым заказам и строкам заказов, а не по всему дню.
+Полный пересчёт дней (refresh_days) - только для команды rebuild_sales.
+"""
+
+import datetime
+import operator
+from collections import Counter
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, OuterRef, Q, QuerySet, Subquery, Sum, Value, When
+from django.db.models.functions import Round, TruncDate
+from django.utils import timezone
+
+from .models import DailySales, Order, Product, ProductDailySales, price_after_discount
+
+OrderProduct = Order.products.through
+
+DAILY_FIELDS = "orders_count", "items_count", "subtotal", "revenue"
+
+_money = DecimalField(max_digits=14, decimal_places=2)
+
+
+def day_bounds(day: datetime.date) -> tuple[datetime.datetime, datetime.datetime]:
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min))
+    return start, end
+
+
+def _created_on(days, field: str = "created_at") -> Q:
+    # Ranges instead of __date lookups, so the created_at index is used;
+    # consecutive days are merged into one range
+    runs = []
+    for day in sorted(days):
+        if runs and runs[-1][1] + datetime.timedelta(days=1) == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    conditions = []
+    for first, last in runs:
+        start, end = day_bounds(first)[0], day_bounds(last)[1]
+        conditions.append(Q(**{f"{field}__gte": start, f"{field}__lt": end}))
+    return reduce(operator.or_, conditions)
+
+
+def _refresh_daily(days) -> None:
+    rows = (
+        Order.objects
+        .filter(_created_on(days))
+        .annotate(day=TruncDate("created_at"))
+        .order_by()
+        .values("day")
+        .annotate(
+            orders_count=Count("pk"),
+            items_count=Sum("items_count"),
+            subtotal=Sum("subtotal"),
+            revenue=Sum("total_after_discount"),
+        )
+    )
+    sales = [DailySales(**row) for row in rows]
+    DailySales.objects.bulk_create(
+        sales,
+        update_conflicts=True,
+        unique_fields=["day"],
+        update_fields=["orders_count", "items_count", "subtotal", "revenue"],
+    )
+    DailySales.objects.filter(day__in=days).exclude(day__in=[row.day for row in sales]).delete()
+
+
+def _refresh_products(lines, days) -> None:
+    rows = (
+        lines
+        .annotate(day=TruncDate("order__created_at"))
+        .order_by()
+        .values("day", "product_id")
+        .annotate(units=Count("pk"), revenue=Round(Sum(price_after_discount()), 2))
+    )
+    sales = [ProductDailySales(**row) for row in rows]
+    ProductDailySales.objects.bulk_create(
+        sales,
+        update_conflicts=True,
+        unique_fields=["day", "product"],
+        update_fields=["units", "revenue"],
+    )
+
+    # Products that are no longer in any order of the day
+    kept = {(row.day, row.product_id) for row in sales}
+    existing = ProductDailySales.objects.filter(day__in=days)
+    stale_pks = [
+        pk
+        for pk, day, product_id in existing.values_list("pk", "day", "product_id")
+        if (day, product_id) not in kept
+    ]
+    if stale_pks:
+        ProductDailySales.objects.filter(pk__in=stale_pks).delete()
+
+
+def refresh_days(days) -> None:
+    """Пересчитать все агрегаты за ``days`` заново (команда rebuild_sales)."""
+    days = sorted(set(days))
+    if not days:
+        return
+    with transaction.atomic():
+        _refresh_daily(days)
+        _refresh_products(OrderProduct.objects.filter(_created_on(days, "order__created_at")), days)
+
+
+def daily_totals(orders: QuerySet) -> dict[datetime.date, dict]:
+    """Вклад заказов ``orders`` в DailySales по дням."""
+    rows = (
+        orders
+        .annotate(day=TruncDate("created_at"))
+        .order_by()
+        .values("day")
+        .annotate(
+            orders_count=Count("pk"),
+            items_count=Sum("items_count"),
+            subtotal=Sum("subtotal"),
+            revenue=Sum("total_after_discount"),
+        )
+    )
+    return {row.pop("day"): row for row in rows}
+
+
+def apply_daily(after: dict, before: dict | None = None) -> None:
+    """Сдвинуть DailySales на разницу ``after - before`` (результаты daily_totals)."""
+    before = before or {}
+    deltas = {}
+    for day in sorted(after.keys() | before.keys()):
+        delta = {
+            field: (after.get(day, {}).get(field) or 0) - (before.get(day, {}).get(field) or 0)
+            for field in DAILY_FIELDS
+        }
+        if any(delta.values()):
+            deltas[day] = delta
+    if not deltas:
+        return
+    DailySales.objects.bulk_create([DailySales(day=day) for day in deltas], ignore_conflicts=True)
+    # Одним UPDATE для всех дней
+    DailySales.objects.filter(day__in=deltas).update(**{
+        field: F(field) + _by_key(
+            {(day,): delta[field] for day, delta in deltas.items()}, ["day"], DailySales._meta.get_field(field),
+        )
+        for field in DAILY_FIELDS
+    })
+    DailySales.objects.filter(day__in=deltas, orders_count=0).delete()
+
+
+def _by_key(values: dict[tuple, object], key_fields: list[str], output_field) -> Case:
+    """CASE WHEN <ключ> THEN <значение> ... ELSE 0."""
+    return Case(
+        *(When(Q(**dict(zip(key_fields, key))), then=Value(value)) for key, value in values.items()),
+        default=Value(0),
+        output_field=output_field,
+    )
+
+
+def product_units(lines: QuerySet) -> Counter:
+    """Число строк заказов ``lines`` по (день заказа, товар)."""
+    rows = (
+        lines
+        .annotate(day=TruncDate("order__created_at"))
+        .order_by()
+        .values_list("day", "product_id")
+        .annotate(units=Count("pk"))
+    )
+    return Counter({(day, product_id): units for day, product_id, units in rows})
+
+
+def _product_price():
+    # Цена товара строки со скидкой, для UPDATE ProductDailySales
+    return Subquery(
+        Product.objects.filter(pk=OuterRef("product_id")).annotate(value=price_after_discount("")).values("value"),
+        output_field=_money,
+    )
+
+
+def apply_product_units(units: Counter, sign: int = 1) -> None:
+    """
+    Сдвинуть ProductDailySales.units на ``units`` (со знаком ``sign``);
+    выручка пересчитывается от новых units по текущей цене товара.
+    """
+    deltas = {key: sign * value for key, value in sorted(units.items()) if value}
+    if not deltas:
+        return
+    ProductDailySales.objects.bulk_create(
+        [ProductDailySales(day=day, product_id=product_id) for day, product_id in deltas],
+        ignore_conflicts=True,
+    )
+    keys = reduce(operator.or_, (Q(day=day, product_id=product_id) for day, product_id in deltas))
+    units_after = F("units") + _by_key(deltas, ["day", "product_id"], IntegerField())
+    # Одним UPDATE; правые части SET видят значения строки до UPDATE
+    ProductDailySales.objects.filter(keys).update(
+        units=units_after,
+        revenue=Round(units_after * _product_price(), 2),
+    )
+    ProductDailySales.objects.filter(keys, units=0).delete()
+
+
+def add_orders(orders: QuerySet, sign: int = 1) -> None:
+    """Учесть заказы вместе со строками (sign=-1 - убрать, до их удаления)."""
+    totals = daily_totals(orders)
+    if sign < 0:
+        apply_daily({}, totals)
+    else:
+        apply_daily(totals)
+    apply_product_units(product_units(OrderProduct.objects.filter(order__in=orders)), sign)
+
+
+def reprice_product_sales(products: QuerySet) -> None:
+    """Цена товаров изменилась: пересчитать их выручку по units, без чтения заказов."""
+    ProductDailySales.objects.filter(product__in=products).update(revenue=Round(F("units") * _product_price(), 2))
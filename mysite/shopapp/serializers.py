@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import Product, Order
+from .models import DailySales, Order, Product, ProductDailySales
 
 
 class ProductSerializers(serializers.ModelSerializer):
@@ -17,9 +17,37 @@ class ProductSerializers(serializers.ModelSerializer):
         )
 
 
+class ProductImportSerializers(serializers.ModelSerializer):
+    """
+    Проверка строки при импорте товаров (см. команду import_products).
+
+    Уникальность sku здесь не проверяется: строки с существующим sku
+    обновляют товар, а не считаются ошибкой.
+    """
+    class Meta:
+        model = Product
+        fields = (
+            "sku",
+            "name",
+            "description",
+            "price",
+            "discount",
+            "archived",
+        )
+        extra_kwargs = {
+            "sku": {"required": True, "allow_null": False, "allow_blank": False, "validators": []},
+        }
+
+
 class OrderSerializers(serializers.ModelSerializer):
+    """
+    Сериализатор заказа.
+
+    Ожидает queryset с select_related("user") и prefetch_related("products"),
+    см. OrderViewSet.queryset.
+    """
     username = serializers.CharField(source='user.username')
-    products = serializers.SerializerMethodField()
+    products = serializers.SlugRelatedField(many=True, read_only=True, slug_field="name")
 
     class Meta:
         model = Order
@@ -29,10 +57,58 @@ class OrderSerializers(serializers.ModelSerializer):
             "created_at",
             "username",
             "products",
+            "items_count",
+            "subtotal",
+            "total_after_discount",
+        )
+        read_only_fields = ("items_count", "subtotal", "total_after_discount")
+
+
+class OrderBatchItemSerializers(serializers.Serializer):
+    """
+    Один заказ в пакетном создании (OrderViewSet.batch).
+
+    user и products - это id; их существование проверяется сразу для всего
+    пакета, а не отдельным запросом на каждый заказ.
+    """
+    user = serializers.IntegerField()
+    delivery_address = serializers.CharField(required=False, allow_null=True, allow_blank=True, default=None)
+    promocode = serializers.CharField(required=False, allow_blank=True, max_length=20, default="")
+    products = serializers.ListField(child=serializers.IntegerField(), allow_empty=True, default=list)
+
+
+class DailySalesSerializers(serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = (
+            "day",
+            "orders_count",
+            "items_count",
+            "subtotal",
+            "revenue",
         )
 
-    def get_products(self, model):
-        products = Product.objects.select_related("created_by").all()
-        for product in products:
-            yield product.name
 
+class ProductDailySalesSerializers(serializers.ModelSerializer):
+    class Meta:
+        model = ProductDailySales
+        fields = (
+            "day",
+            "product",
+            "units",
+            "revenue",
+        )
+
+
+class DailySalesSummarySerializers(serializers.Serializer):
+    orders_count = serializers.IntegerField()
+    items_count = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=14, decimal_places=2)
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class ProductSalesSummarySerializers(serializers.Serializer):
+    product = serializers.IntegerField()
+    name = serializers.CharField(source="product__name")
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
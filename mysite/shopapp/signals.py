@@ -0,0 +1,132 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .caching import invalidate_user_orders
+from .models import Order, Product
+from .rollups import add_orders, apply_daily, apply_product_units, daily_totals, product_units, reprice_product_sales
+
+# Отправляется кодом, который пишет заказы в обход save()/add(),
+# например bulk_create в OrderViewSet.batch. Аргументы: orders - список Order.
+orders_bulk_created = Signal()
+
+OrderProduct = Order.products.through
+
+
+def invalidate_after_commit(user_pks) -> None:
+    # After commit: otherwise a concurrent request could cache the old
+    # data under the new version before our transaction is visible.
+    user_pks = set(user_pks)
+    transaction.on_commit(lambda: invalidate_user_orders(user_pks))
+
+
+def orders_changed(orders: QuerySet, exclude_product: int | None = None) -> None:
+    """
+    Состав заказов ``orders`` изменился в обход save(): пересчитать суммы,
+    сдвинуть продажи по дням на разницу и сбросить кэш их владельцев.
+    """
+    # Changing the products of an order does not save the order itself,
+    # so the totals and updated_at are written here
+    before = daily_totals(orders)
+    orders.recompute_totals(exclude_product)
+    apply_daily(daily_totals(orders), before)
+    invalidate_after_commit(orders.values_list("user_id", flat=True).distinct())
+
+
+def touch_orders(orders: QuerySet) -> None:
+    """Изменились данные, которые выводятся в заказах (названия товаров, username)."""
+    # Суммы те же; updated_at нужен ETag / Last-Modified в OrderViewSet
+    invalidate_after_commit(orders.values_list("user_id", flat=True).distinct())
+    orders.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance: Order, created, **kwargs):
+    invalidate_after_commit({instance.user_id, getattr(instance, "_loaded_user_id", None)})
+    instance._loaded_user_id = instance.user_id
+    if created:
+        add_orders(sender.objects.filter(pk=instance.pk))
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleting(sender, instance: Order, **kwargs):
+    # Строки заказа ещё на месте
+    add_orders(sender.objects.filter(pk=instance.pk), sign=-1)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance: Order, **kwargs):
+    invalidate_after_commit({instance.user_id})
+
+
+@receiver(orders_bulk_created, sender=Order)
+def orders_bulk_created_handler(sender, orders, **kwargs):
+    orders = sender.objects.filter(pk__in=[order.pk for order in orders])
+    orders.recompute_totals()
+    add_orders(orders)
+    invalidate_after_commit(orders.values_list("user_id", flat=True).distinct())
+
+
+@receiver(m2m_changed, sender=OrderProduct)
+def order_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # product.orders.add(...) and friends: pk_set holds order pks
+        lines = sender.objects.filter(product_id=instance.pk)
+        orders = Order.objects.filter(pk__in=pk_set or ())
+        if pk_set is not None:
+            lines = lines.filter(order_id__in=pk_set)
+    else:
+        lines = sender.objects.filter(order_id=instance.pk)
+        orders = Order.objects.filter(pk=instance.pk)
+        if pk_set is not None:
+            lines = lines.filter(product_id__in=pk_set)
+
+    # Removed lines are counted while they still exist, added ones after the insert
+    if action in ("pre_remove", "pre_clear"):
+        apply_product_units(product_units(lines), sign=-1)
+        if action == "pre_clear" and reverse:
+            # The orders can't be found by the product once the rows are gone
+            orders_changed(instance.orders.all(), exclude_product=instance.pk)
+    elif action == "post_add":
+        apply_product_units(product_units(lines))
+    if action in ("post_add", "post_remove") or (action == "post_clear" and not reverse):
+        orders_changed(orders)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance: Product, created, **kwargs):
+    prices = (instance.price, instance.discount)
+    loaded_prices = getattr(instance, "_loaded_prices", None)
+    loaded_name = getattr(instance, "_loaded_name", None)
+    if not created and loaded_prices is not None and loaded_prices != prices:
+        orders_changed(Order.objects.filter(products=instance))
+        reprice_product_sales(sender.objects.filter(pk=instance.pk))
+    elif not created and loaded_name is not None and loaded_name != instance.name:
+        touch_orders(Order.objects.filter(products=instance))
+    instance._loaded_prices = prices
+    instance._loaded_name = instance.name
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance: Product, **kwargs):
+    # Deleting a product removes its through rows without m2m_changed;
+    # its ProductDailySales rows go by CASCADE
+    orders_changed(Order.objects.filter(products=instance), exclude_product=instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance: User, raw=False, update_fields=None, **kwargs):
+    # Вход пользователя сохраняет только last_login - лишний запрос не нужен
+    if raw or instance.pk is None or (update_fields is not None and "username" not in update_fields):
+        return
+    instance._username_changed = not sender.objects.filter(pk=instance.pk, username=instance.username).exists()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance: User, **kwargs):
+    if getattr(instance, "_username_changed", False):
+        instance._username_changed = False
+        touch_orders(Order.objects.filter(user=instance))
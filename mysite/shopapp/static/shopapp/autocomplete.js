@@ -0,0 +1,67 @@
+// Поиск по началу строки для <select data-autocomplete-url> из shopapp/widgets.py.
+// Найденные варианты показываются списком под полем ввода, выбранный
+// добавляется в select; "More" подгружает следующую страницу по cursor.
+(function () {
+  "use strict";
+
+  function setup(select) {
+    var input = document.createElement("input");
+    var list = document.createElement("ul");
+    var more = document.createElement("button");
+    var timer = null;
+    var next = null;
+
+    input.type = "search";
+    input.placeholder = "Type to search";
+    more.type = "button";
+    more.textContent = "More";
+    more.hidden = true;
+    select.parentNode.insertBefore(input, select);
+    select.parentNode.insertBefore(list, select.nextSibling);
+    list.parentNode.insertBefore(more, list.nextSibling);
+
+    function choose(item) {
+      var option = select.querySelector('option[value="' + item.id + '"]');
+      if (!option) {
+        option = new Option(item.text, item.id);
+        if (!select.multiple) {
+          select.options.length = 0;
+        }
+        select.add(option);
+      }
+      option.selected = true;
+    }
+
+    function load(cursor) {
+      var params = new URLSearchParams({q: input.value});
+      if (cursor) {
+        params.set("cursor", cursor);
+      }
+      fetch(select.dataset.autocompleteUrl + "?" + params, {credentials: "same-origin"})
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          if (!cursor) {
+            list.textContent = "";
+          }
+          data.results.forEach(function (item) {
+            var li = document.createElement("li");
+            li.textContent = item.text;
+            li.addEventListener("click", function () { choose(item); });
+            list.appendChild(li);
+          });
+          next = data.next;
+          more.hidden = !next;
+        });
+    }
+
+    input.addEventListener("input", function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () { load(null); }, 250);
+    });
+    more.addEventListener("click", function () { load(next); });
+  }
+
+  document.addEventListener("DOMContentLoaded", function () {
+    document.querySelectorAll("select[data-autocomplete-url]").forEach(setup);
+  });
+})();
@@ -1,8 +1,33 @@
-from django.contrib.auth.models import User, Permission
-from django.test import TestCase
+import datetime
+import json
+import tempfile
+import time
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from uuid import uuid4
+
+from django.contrib.auth.models import Group, User, Permission
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Max, Min, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone, translation
 
-from shopapp.models import Order
+from blogapp.models import Article
+from mysite import metrics
+from mysite.testing import QueryBudgetMixin
+from newsapp.models import Housing, News
+from shopapp.admin import mark_archived
+from shopapp.bulk_actions import run_job
+from shopapp.management.commands.benchmark_endpoints import ENDPOINTS, Command as BenchmarkEndpointsCommand
+from shopapp.models import BulkActionJob, DailySales, Order, Product, ProductDailySales
+from shopapp.pagination import EstimatedCountPaginator
+from shopapp.views import OrdersDataExportView, OrdersListView, UserOrdersListView
 
 
 class OrderDetailViewTestCase(TestCase):
@@ -47,23 +72,31 @@ class OrdersExportViewTestCase(TestCase):
         'orders-fixture.json',
     ]
 
-
     @classmethod
-    def setUpClass(cls):
+    def setUpTestData(cls):
         cls.user = User.objects.create_user(username="probe_name", password="qwerty", is_staff=True)
         cls.user.user_permissions.add(Permission.objects.get(codename="view_order"))
-    @classmethod
-    def tearDownClass(cls):
-        cls.user.delete()
+        products = Product.objects.bulk_create(
+            Product(name=f"Export product {index}", created_by=cls.user) for index in range(4)
+        )
+        for index in range(5):
+            order = Order.objects.create(user=cls.user, promocode=f"SALE{index}", delivery_address=f"Street {index}")
+            order.products.add(*products[index % 3:])
 
     def setUp(self) -> None:
         self.client.force_login(self.user)
+        with translation.override("en"):
+            self.url = reverse("shopapp:orders-export")
 
     def test_get_order_view(self):
-        response = self.client.get(
-            reverse("shopapp:orders-export"),
-        )
-        self.assertEqual(response.status_code, 200)
+        # Six orders in three chunks, each with its own products query
+        with mock.patch.object(OrdersDataExportView, "chunk_size", 2), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"stream": 1})
+            self.assertEqual(response.status_code, 200)
+            content = b"".join(response.streaming_content)
+        products_queries = [query for query in queries if "shopapp_order_products" in query["sql"]]
+        self.assertEqual(len(products_queries), 3)
         orders = Order.objects.order_by("pk").all()
         expected_data = [
             {
@@ -76,8 +109,1271 @@ class OrdersExportViewTestCase(TestCase):
             }
             for order in orders
         ]
-        orders_data = response.json()
+        self.assertEqual(len(expected_data), 6)
+        orders_data = json.loads(content)
         self.assertEqual(
             orders_data["orders"],
             expected_data,
         )
+
+    def test_get_order_view_streaming(self):
+        response = self.client.get(self.url)
+        streaming_response = self.client.get(self.url, {"stream": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(streaming_response.status_code, 200)
+        self.assertTrue(streaming_response.streaming)
+        self.assertEqual(
+            b"".join(streaming_response.streaming_content),
+            response.content,
+        )
+
+
+class OrderViewSetTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+
+    def create_orders(self, orders_count: int, products_count: int) -> None:
+        products = Product.objects.bulk_create(
+            Product(name=f"Product {index}", created_by=self.user)
+            for index in range(products_count)
+        )
+        for index in range(orders_count):
+            order = Order.objects.create(user=self.user, promocode=f"SALE{index}")
+            order.products.add(*products[:2])
+
+    def test_orders_list_products(self):
+        self.create_orders(orders_count=1, products_count=5)
+        response = self.client.get(reverse("shopapp:order-list"))
+        self.assertEqual(response.status_code, 200)
+        order_data = response.json()["results"][0]
+        self.assertEqual(order_data["username"], self.user.username)
+        self.assertEqual(order_data["products"], ["Product 0", "Product 1"])
+
+    def test_orders_list_num_queries(self):
+        # The ETag aggregate, the page and the products of the page
+        self.create_orders(orders_count=3, products_count=5)
+        with self.assertNumQueries(3):
+            self.client.get(reverse("shopapp:order-list"))
+
+        self.create_orders(orders_count=20, products_count=50)
+        with self.assertNumQueries(3):
+            self.client.get(reverse("shopapp:order-list"))
+
+
+class OrdersListPaginationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+        cls.other_user = User.objects.create_user(username="another_name", password="qwerty")
+        product = Product.objects.create(name="Paginated product", created_by=cls.user)
+        for index in range(7):
+            Order.objects.create(user=cls.user if index % 2 else cls.other_user).products.add(product)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def walk(self, url: str, context_name: str) -> list:
+        pks = []
+        response = self.client.get(url)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pks.extend(order.pk for order in response.context[context_name])
+            self.assertContains(response, "Paginated product")
+            next_cursor = response.context["page_obj"].next_cursor
+            if next_cursor is None:
+                return pks
+            self.assertContains(response, f"?cursor={next_cursor}")
+            response = self.client.get(url, {"cursor": next_cursor})
+
+    def test_orders_list_pages(self):
+        with translation.override("en"):
+            url = reverse("shopapp:orders_list")
+        with mock.patch.object(OrdersListView, "paginate_by", 3), CaptureQueriesContext(connection) as queries:
+            pks = self.walk(url, "object_list")
+        self.assertEqual(pks, list(Order.objects.order_by("-pk").values_list("pk", flat=True)))
+        self.assertFalse([query for query in queries if "COUNT(" in query["sql"]])
+
+    def test_user_orders_pages(self):
+        with translation.override("en"):
+            url = reverse("shopapp:user_orders", kwargs={"pk": self.user.pk})
+        with mock.patch.object(UserOrdersListView, "paginate_by", 2):
+            pks = self.walk(url, "orders")
+        self.assertEqual(pks, list(self.user.order_set.order_by("-pk").values_list("pk", flat=True)))
+
+    def test_invalid_cursor(self):
+        with translation.override("en"):
+            response = self.client.get(reverse("shopapp:orders_list"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+        cls.other_user = User.objects.create_user(username="another_name", password="qwerty")
+        Product.objects.bulk_create(
+            Product(
+                name=f"Product {index % 3}",
+                price=index % 4,
+                description=f"Description {index}",
+                created_by=cls.user,
+            )
+            for index in range(25)
+        )
+        for index in range(15):
+            Order.objects.create(
+                user=cls.user if index % 2 else cls.other_user,
+                delivery_address=f"Address {index % 4}" if index % 3 else None,
+            )
+
+    def walk(self, url: str, params: dict, direction: str = "next") -> list:
+        pks = []
+        response = self.client.get(url, params)
+        while True:
+            data = response.json()
+            self.assertNotIn("count", data)
+            pks.extend(item["pk"] for item in data["results"])
+            if not data[direction]:
+                return pks
+            response = self.client.get(data[direction])
+
+    def test_products_pages_follow_ordering(self):
+        url = reverse("shopapp:product-list")
+        for ordering, expected_ordering in [
+            ("name", ["name", "pk"]),
+            ("-price", ["-price", "pk"]),
+            ("price,-name", ["price", "-name", "pk"]),
+        ]:
+            with self.subTest(ordering=ordering):
+                expected = list(
+                    Product.objects
+                    .order_by(*expected_ordering)
+                    .values_list("pk", flat=True)
+                )
+                self.assertEqual(self.walk(url, {"ordering": ordering}), expected)
+
+    def test_previous_pages(self):
+        url = reverse("shopapp:product-list")
+        data = self.client.get(url, {"ordering": "name"}).json()
+        while data["next"]:
+            data = self.client.get(data["next"]).json()
+
+        pages = []
+        while data["previous"]:
+            data = self.client.get(data["previous"]).json()
+            pages.insert(0, [item["pk"] for item in data["results"]])
+        expected = list(Product.objects.order_by("name", "pk").values_list("pk", flat=True))
+        self.assertEqual(sum(pages, []), expected[:20])
+
+    def test_orders_ordering_by_username(self):
+        pks = []
+        response = self.client.get(reverse("shopapp:order-list"), {"ordering": "user__username"})
+        while True:
+            data = response.json()
+            pks.extend(data["results"])
+            if not data["next"]:
+                break
+            response = self.client.get(data["next"])
+        usernames = [order["username"] for order in pks]
+        self.assertEqual(usernames, sorted(usernames))
+        self.assertEqual(len(usernames), 15)
+
+    def test_orders_ordering_by_nullable_field(self):
+        url = reverse("shopapp:order-list")
+        orders = list(Order.objects.order_by("pk").values_list("pk", "delivery_address"))
+        ascending = sorted(orders, key=lambda order: (order[1] is None, order[1] or "", order[0]))
+        descending = sorted(orders, key=lambda order: (order[1] is None, order[1] or "", -order[0]), reverse=True)
+        for ordering, expected in [("delivery_address", ascending), ("-delivery_address", descending)]:
+            with self.subTest(ordering=ordering):
+                addresses = []
+                response = self.client.get(url, {"ordering": ordering})
+                while True:
+                    data = response.json()
+                    addresses.extend(order["delivery_address"] for order in data["results"])
+                    if not data["next"]:
+                        break
+                    response = self.client.get(data["next"])
+                self.assertEqual(addresses, [order[1] for order in expected])
+
+    def test_no_count_query(self):
+        # The page itself and the ETag aggregate
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("shopapp:product-list"))
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn("OFFSET", queries[1]["sql"])
+        self.assertEqual(len(response.json()["results"]), 10)
+
+    def test_page_number_on_request(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"page": 2})
+        data = response.json()
+        self.assertEqual(data["count"], 25)
+        self.assertEqual(len(data["results"]), 10)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(PAGINATOR_ESTIMATE_THRESHOLD=1000)
+class EstimatedCountPaginatorTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username="probe_name", password="qwerty")
+        Product.objects.bulk_create(Product(name=f"Product {index}", created_by=cls.user) for index in range(5))
+
+    def setUp(self) -> None:
+        self.client.force_login(self.user)
+
+    def estimate(self, rows):
+        return mock.patch.object(EstimatedCountPaginator, "estimate", return_value=rows)
+
+    def test_exact_count_below_threshold(self):
+        # SQLite has no estimate
+        self.assertEqual(EstimatedCountPaginator(Product.objects.all(), 2).count, 5)
+        with self.estimate(999):
+            self.assertEqual(EstimatedCountPaginator(Product.objects.all(), 2).count, 5)
+
+    def test_estimate_above_threshold(self):
+        paginator = EstimatedCountPaginator(Product.objects.all(), 2)
+        with self.estimate(50000), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, 50000)
+            self.assertEqual(paginator.num_pages, 25000)
+        self.assertEqual(len(queries), 0)
+
+    def test_admin_changelist(self):
+        with translation.override("en"):
+            url = reverse("admin:shopapp_product_changelist")
+        with self.estimate(50000), CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.context["cl"].result_count, 50000)
+        self.assertFalse([query for query in queries if "COUNT(" in query["sql"]])
+
+    def test_api_page_number(self):
+        with self.estimate(50000):
+            data = self.client.get(reverse("shopapp:product-list"), {"page": 1}).json()
+        self.assertEqual(data["count"], 50000)
+        self.assertEqual(len(data["results"]), 5)
+
+
+class ProductSearchTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username="probe_name", password="qwerty")
+        Product.objects.create(name="Laptop", description="Light and fast", created_by=user)
+        Product.objects.create(name="Desktop", description="Fast, not a laptop", created_by=user)
+        Product.objects.create(name="Smartphone", created_by=user)
+
+    def test_search(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"search": "lapt"})
+        names = {product["name"] for product in response.json()["results"]}
+        self.assertEqual(names, {"Laptop", "Desktop"})
+
+    def test_search_all_words(self):
+        response = self.client.get(reverse("shopapp:product-list"), {"search": "fast light"})
+        names = [product["name"] for product in response.json()["results"]]
+        self.assertEqual(names, ["Laptop"])
+
+    def test_search_vector_not_selected(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("shopapp:product-list"))
+            list(Product.objects.all())
+            list(Order.objects.create(user=User.objects.get()).products.all())
+        selects = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+        self.assertTrue(any('"shopapp_product"."name"' in sql for sql in selects))
+        self.assertFalse([sql for sql in selects if "search_vector" in sql])
+
+
+class ProductAdminExportTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username="probe_name", password="qwerty")
+        cls.products = [
+            Product.objects.create(name="Laptop", price="1999.00", created_by=cls.user),
+            Product.objects.create(name="Desktop, big", price="2999.00", created_by=cls.user),
+        ]
+
+    def setUp(self) -> None:
+        self.client.force_login(self.user)
+
+    def test_export_as_csv(self):
+        with translation.override("en"):
+            url = reverse("admin:shopapp_product_changelist")
+        response = self.client.post(
+            url,
+            {
+                "action": "export_as_csv",
+                "_selected_action": [product.pk for product in self.products],
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,sku,name,description,price,discount,created_by,created_at,archived")
+        self.assertEqual(len(lines), 3)
+        self.assertIn(f',"Desktop, big",,2999.00,0,{self.user.pk},', lines[2])
+
+
+class AutocompleteTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username="probe_name", password="qwerty")
+        Product.objects.bulk_create(
+            Product(name=f"Laptop {index:02}", created_by=cls.user) for index in range(25)
+        )
+        Product.objects.create(name="Old laptop", description="Laptop, archived", created_by=cls.user)
+        Product.objects.create(name="Laptop archived", archived=True, created_by=cls.user)
+        cls.product = Product.objects.create(name="Desktop", created_by=cls.user)
+
+    def setUp(self) -> None:
+        self.client.force_login(self.user)
+
+    def url(self, name, **kwargs):
+        with translation.override("en"):
+            return reverse(name, kwargs=kwargs)
+
+    def test_products_prefix_pages(self):
+        url = self.url("shopapp:products_autocomplete")
+        data = self.client.get(url, {"q": "lap"}).json()
+        self.assertEqual(len(data["results"]), 20)
+        data = self.client.get(url, {"q": "lap", "cursor": data["next"]}).json()
+        self.assertEqual(
+            [item["text"] for item in data["results"]],
+            [str(product) for product in Product.objects.filter(name__in=[f"Laptop {index}" for index in range(20, 25)])],
+        )
+        self.assertIsNone(data["next"])
+
+    def test_users(self):
+        data = self.client.get(self.url("shopapp:users_autocomplete"), {"q": "PROBE"}).json()
+        self.assertEqual(data["results"], [{"id": self.user.pk, "text": "probe_name"}])
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(self.url("shopapp:products_autocomplete"), {"q": "lap"})
+        self.assertEqual(response.status_code, 302)
+
+    def test_order_form_renders_only_selected(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.product)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url("shopapp:order_update", pk=order.pk))
+        self.assertContains(response, 'data-autocomplete-url="/en/shop/products/autocomplete/"')
+        self.assertContains(response, "shopapp/autocomplete.js")
+        self.assertContains(response, "Desktop")
+        self.assertNotContains(response, "Laptop")
+
+    def test_order_create(self):
+        response = self.client.post(
+            self.url("shopapp:order_create"),
+            {"products": [self.product.pk], "user": self.user.pk, "promocode": "SALE"},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Order.objects.get(promocode="SALE").products.all()), [self.product])
+
+    def test_admin_inline_prefix_search(self):
+        response = self.client.get(self.url("admin:autocomplete"), {
+            "app_label": "shopapp",
+            "model_name": "order_products",
+            "field_name": "product",
+            "term": "laptop",
+        })
+        texts = [item["text"] for item in response.json()["results"]]
+        self.assertEqual(len(texts), 20)
+        self.assertTrue(all("Laptop" in text for text in texts))
+        self.assertNotIn(str(Product.objects.get(name="Old laptop")), texts)
+
+    def test_admin_order_inline(self):
+        order = Order.objects.create(user=self.user)
+        order.products.add(self.product)
+        response = self.client.get(self.url("admin:shopapp_order_change", object_id=order.pk))
+        self.assertContains(response, "admin-autocomplete")
+        self.assertNotContains(response, "Laptop")
+
+
+@override_settings(BULK_ACTIONS_EAGER=True, BULK_ACTIONS_CHUNK_SIZE=4)
+class BulkActionTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username="probe_name", password="qwerty")
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Product {index}", created_by=cls.user) for index in range(10)
+        )
+
+    def run_job(self, process_chunk, queryset=None) -> BulkActionJob:
+        job = BulkActionJob.objects.create(action="Test", model="shopapp.Product")
+        run_job(job.pk, queryset or Product.objects.all(), process_chunk, 4)
+        job.refresh_from_db()
+        return job
+
+    def test_admin_select_across(self):
+        self.client.force_login(self.user)
+        with translation.override("en"):
+            url = reverse("admin:shopapp_product_changelist")
+        response = self.client.post(url, {
+            "action": "mark_archived",
+            "_selected_action": [self.products[0].pk],
+            "select_across": 1,
+        }, follow=True)
+        job = BulkActionJob.objects.get()
+        self.assertContains(response, f"job #{job.pk}")
+        self.assertEqual(job.status, BulkActionJob.Status.DONE)
+        self.assertEqual((job.total, job.processed), (10, 10))
+        self.assertEqual(job.created_by, self.user)
+        self.assertFalse(Product.objects.filter(archived=False).exists())
+        self.assertEqual(metrics.get("bulk_actions.chunks"), 3)
+
+    def test_chunks_in_own_transactions(self):
+        chunks = []
+
+        def process_chunk(queryset):
+            chunks.append(list(queryset.order_by("pk").values_list("pk", flat=True)))
+            self.assertTrue(connection.in_atomic_block)
+            return len(chunks[-1])
+
+        # Selection with gaps in the pks
+        selected = Product.objects.exclude(pk__in=[self.products[1].pk, self.products[6].pk])
+        job = self.run_job(process_chunk, selected)
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4])
+        self.assertEqual(sum(chunks, []), list(selected.order_by("pk").values_list("pk", flat=True)))
+        self.assertEqual(job.processed, 8)
+        self.assertEqual(job.last_pk, chunks[-1][-1])
+
+    def test_cancel(self):
+        def process_chunk(queryset):
+            BulkActionJob.objects.update(cancel_requested=True)
+            return queryset.update(archived=True)
+
+        job = self.run_job(process_chunk)
+        self.assertEqual(job.status, BulkActionJob.Status.CANCELLED)
+        self.assertEqual(job.processed, 4)
+        self.assertEqual(Product.objects.filter(archived=True).count(), 4)
+
+    def test_cancel_before_start(self):
+        job = BulkActionJob.objects.create(action="Test", model="shopapp.Product", cancel_requested=True)
+        run_job(job.pk, Product.objects.all(), mark_archived.process_chunk, 4)
+        job.refresh_from_db()
+        self.assertEqual(job.status, BulkActionJob.Status.CANCELLED)
+        self.assertFalse(Product.objects.filter(archived=True).exists())
+
+    def test_failure_keeps_finished_chunks(self):
+        def process_chunk(queryset):
+            if BulkActionJob.objects.get().processed:
+                raise ValueError("boom")
+            return queryset.update(archived=True)
+
+        with self.assertLogs("shopapp.bulk_actions", "ERROR"):
+            job = self.run_job(process_chunk)
+        self.assertEqual(job.status, BulkActionJob.Status.FAILED)
+        self.assertIn("boom", job.error)
+        self.assertEqual(Product.objects.filter(archived=True).count(), 4)
+
+    def test_cancel_action_and_progress(self):
+        self.client.force_login(self.user)
+        job = BulkActionJob.objects.create(
+            action="Test", model="shopapp.Product", status=BulkActionJob.Status.RUNNING, total=8, processed=2,
+        )
+        with translation.override("en"):
+            url = reverse("admin:shopapp_bulkactionjob_changelist")
+        self.client.post(url, {"action": "cancel_jobs", "_selected_action": [job.pk]})
+        job.refresh_from_db()
+        self.assertTrue(job.cancel_requested)
+        self.assertContains(self.client.get(url), "25% (2 of 8) (cancelling)")
+
+
+@override_settings(BULK_ACTIONS_CHUNK_SIZE=3)
+class BulkActionThreadTestCase(TransactionTestCase):
+
+    def test_runs_off_request_thread(self):
+        user = User.objects.create_superuser(username="probe_name", password="qwerty")
+        Product.objects.bulk_create(Product(name=f"Product {index}", created_by=user) for index in range(7))
+        self.client.force_login(user)
+        with translation.override("en"):
+            url = reverse("admin:shopapp_product_changelist")
+        self.client.post(url, {
+            "action": "mark_archived",
+            "_selected_action": list(Product.objects.values_list("pk", flat=True)),
+        })
+        job = BulkActionJob.objects.get()
+        for _ in range(100):
+            job.refresh_from_db()
+            if job.is_finished:
+                break
+            time.sleep(0.05)
+        self.assertEqual(job.status, BulkActionJob.Status.DONE)
+        self.assertEqual(job.processed, 7)
+        self.assertFalse(Product.objects.filter(archived=False).exists())
+
+
+class ImportProductsCommandTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = Path(tmp_dir.name)
+
+    def import_products(self, path: Path, **options) -> str:
+        stdout = StringIO()
+        call_command(
+            "import_products", path,
+            created_by=self.user.username, batch_size=2,
+            stdout=stdout, stderr=StringIO(), **options,
+        )
+        return stdout.getvalue()
+
+    def test_csv_upsert(self):
+        path = self.tmp_dir / "products.csv"
+        path.write_text(
+            "sku,name,description,price,discount\n"
+            "A-1,Laptop,,1999.00,10\n"
+            "A-2,Desktop,,2999.00,0\n"
+            "A-3,Smartphone,,not a price,0\n"
+        )
+        self.import_products(path)
+        self.assertEqual(
+            dict(Product.objects.values_list("sku", "name")),
+            {"A-1": "Laptop", "A-2": "Desktop"},
+        )
+
+        path.write_text(
+            "sku,name,description,price,discount\n"
+            "A-1,Laptop Pro,,2499.00,10\n"
+        )
+        self.import_products(path)
+        self.assertEqual(Product.objects.count(), 2)
+        laptop = Product.objects.get(sku="A-1")
+        self.assertEqual((laptop.name, str(laptop.price)), ("Laptop Pro", "2499.00"))
+        self.assertFalse((self.tmp_dir / "products.csv.checkpoint").exists())
+
+    def test_ndjson_resume(self):
+        path = self.tmp_dir / "products.ndjson"
+        path.write_text("\n".join(
+            json.dumps({"sku": f"B-{index}", "name": f"Product {index}", "price": "1.00"})
+            for index in range(5)
+        ))
+        (self.tmp_dir / "products.ndjson.checkpoint").write_text("2")
+        output = self.import_products(path)
+        self.assertIn("Resuming after row 2", output)
+        self.assertEqual(
+            sorted(Product.objects.values_list("sku", flat=True)),
+            ["B-2", "B-3", "B-4"],
+        )
+
+    def test_recomputes_only_repriced_orders(self):
+        laptop = Product.objects.create(sku="A-1", name="Laptop", price="100.00", discount=0)
+        mouse = Product.objects.create(sku="A-2", name="Mouse", price="50.00", discount=0)
+        order = Order.objects.create(user=self.user)
+        order.products.add(laptop, mouse)
+        other_order = Order.objects.create(user=self.user)
+        other_order.products.add(mouse)
+        other_updated_at = Order.objects.get(pk=other_order.pk).updated_at
+
+        path = self.tmp_dir / "products.ndjson"
+        path.write_text(
+            '{"sku": "A-1", "name": "Laptop Pro", "price": "200.00", "discount": 0}\n'
+            '{"sku": "A-2", "name": "Mouse", "price": "50.00", "discount": 0}\n'
+        )
+        self.import_products(path)
+        order.refresh_from_db()
+        self.assertEqual((order.items_count, order.subtotal), (2, Decimal("250.00")))
+        # The mouse did not change, its orders are not touched
+        self.assertEqual(Order.objects.get(pk=other_order.pk).updated_at, other_updated_at)
+
+
+class OrderBatchCreateTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Product {index}", created_by=cls.user)
+            for index in range(5)
+        )
+
+    def post_batch(self, orders: list):
+        return self.client.post(
+            reverse("shopapp:order-batch"),
+            orders,
+            content_type="application/json",
+        )
+
+    def make_orders(self, count: int) -> list:
+        return [
+            {
+                "user": self.user.pk,
+                "delivery_address": f"ul Pupkina, d {index}",
+                "products": [product.pk for product in self.products[:index % 5 + 1]],
+            }
+            for index in range(count)
+        ]
+
+    def test_batch_create(self):
+        response = self.post_batch(self.make_orders(3))
+        self.assertEqual(response.status_code, 201)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], ["created"] * 3)
+        order = Order.objects.get(pk=results[2]["pk"])
+        self.assertEqual(order.delivery_address, "ul Pupkina, d 2")
+        self.assertEqual(order.products.count(), 3)
+
+    def test_batch_create_partially_invalid(self):
+        orders = self.make_orders(2) + [
+            {"user": self.user.pk, "products": [0]},
+            {"user": 0},
+            {"promocode": "SALE123"},
+        ]
+        response = self.post_batch(orders)
+        self.assertEqual(response.status_code, 207)
+        results = response.json()["results"]
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["created", "created", "invalid", "invalid", "invalid"],
+        )
+        self.assertIn("products", results[2]["errors"])
+        self.assertIn("user", results[3]["errors"])
+        self.assertIn("user", results[4]["errors"])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_batch_num_queries(self):
+        with CaptureQueriesContext(connection) as small_batch:
+            self.post_batch(self.make_orders(2))
+        with CaptureQueriesContext(connection) as large_batch:
+            self.post_batch(self.make_orders(50))
+        self.assertEqual(len(small_batch), len(large_batch))
+        self.assertEqual(Order.objects.count(), 52)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class UserOrdersExportCacheTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+        cls.other_user = User.objects.create_user(username="another_name", password="qwerty")
+        cls.product = Product.objects.create(name="Laptop", created_by=cls.user)
+
+    def setUp(self) -> None:
+        self.client.force_login(self.user)
+        cache.clear()
+        metrics.reset()
+
+    def get_export(self, user: User) -> list:
+        with translation.override("en"):
+            url = reverse("shopapp:user_orders_export", kwargs={"pk": user.pk})
+        return self.client.get(url).json()["orders"]
+
+    def get_export_pks(self, user: User) -> list:
+        return [order["pk"] for order in self.get_export(user)]
+
+    def test_hit_and_miss(self):
+        self.get_export_pks(self.user)
+        # Only the session and the user
+        with self.assertNumQueries(2):
+            self.get_export(self.user)
+        self.assertEqual(metrics.get("orders_export_cache.misses"), 1)
+        self.assertEqual(metrics.get("orders_export_cache.hits"), 1)
+
+    def test_invalidated_on_order_writes(self):
+        self.assertEqual(self.get_export_pks(self.user), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.user)
+        self.assertEqual(self.get_export_pks(self.user), [order.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.orders.add(order)
+        self.assertEqual(self.get_export(self.user)[0]["products"], [self.product.pk])
+
+        self.assertEqual(self.get_export_pks(self.other_user), [])
+        order = Order.objects.get(pk=order.pk)
+        order.user = self.other_user
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        self.assertEqual(self.get_export_pks(self.user), [])
+        self.assertEqual(self.get_export_pks(self.other_user), [order.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertEqual(self.get_export_pks(self.other_user), [])
+        self.assertEqual(metrics.get("orders_export_cache.invalidations"), 5)
+
+    def test_invalidated_on_batch_create(self):
+        self.assertEqual(self.get_export_pks(self.user), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("shopapp:order-batch"),
+                [{"user": self.user.pk}],
+                content_type="application/json",
+            )
+        self.assertEqual(self.get_export_pks(self.user), [response.json()["results"][0]["pk"]])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductsPageCacheTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+        cls.product = Product.objects.create(name="Laptop", created_by=cls.user)
+
+    def setUp(self) -> None:
+        cache.clear()
+        metrics.reset()
+
+    def get_products_list(self, language="en"):
+        with translation.override(language):
+            return self.client.get(reverse("shopapp:products_list")).content.decode()
+
+    def test_cached_until_products_change(self):
+        self.assertIn("Laptop", self.get_products_list())
+        with self.assertNumQueries(0):
+            self.get_products_list()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Desktop", created_by=self.user)
+        self.assertIn("Desktop", self.get_products_list())
+
+        # queryset.update() sends no signals, so the page stays cached...
+        products = Product.objects.filter(name="Desktop")
+        products.update(description="updated")
+        self.assertIn("Desktop", self.get_products_list())
+        # ...unless the code invalidates it, as the admin actions do
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_archived.process_chunk(products)
+        self.assertNotIn("Desktop", self.get_products_list())
+        self.assertEqual(metrics.get("page_cache.hits"), 2)
+
+    def test_varies_by_language_and_user(self):
+        self.get_products_list("en")
+        self.get_products_list("ru")
+        self.client.force_login(self.user)
+        self.get_products_list("en")
+        self.assertEqual(metrics.get("page_cache.misses"), 3)
+        self.get_products_list("en")
+        self.assertEqual(metrics.get("page_cache.hits"), 1)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ConditionalGetTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+        cls.product = Product.objects.create(name="Laptop", created_by=cls.user)
+        cls.order = Order.objects.create(user=cls.user)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def url(self, name, **kwargs):
+        with translation.override("en"):
+            return reverse(name, kwargs=kwargs)
+
+    def assertNotModified(self, url, num_queries):
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(num_queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        self.assertIn("Last-Modified", response)
+        return etag
+
+    def test_products_list(self):
+        url = self.url("shopapp:product-list")
+        # Session, user and the aggregate
+        etag = self.assertNotModified(url, 3)
+        self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(url)["ETag"]
+        Product.objects.create(name="Desktop", created_by=self.user).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.product.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_product_detail(self):
+        url = self.url("shopapp:product-detail", pk=self.product.pk)
+        etag = self.assertNotModified(url, 3)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=self.client.get(url)["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+        self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_products_change(self):
+        url = self.url("shopapp:order-detail", pk=self.order.pk)
+        etag = self.assertNotModified(url, 3)
+        self.order.products.add(self.product)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        url = self.url("shopapp:order-list")
+        etag = self.client.get(url)["ETag"]
+        self.product.orders.remove(self.order)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_related_names_change(self):
+        self.order.products.add(self.product)
+        urls = self.url("shopapp:order-list"), self.url("shopapp:order-detail", pk=self.order.pk)
+        etags = [self.client.get(url)["ETag"] for url in urls]
+        self.product.name = "Laptop Pro"
+        self.product.save()
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etags = [self.client.get(url)["ETag"] for url in urls]
+        self.user.username = "probe_name_renamed"
+        self.user.save()
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "probe_name_renamed")
+
+    def test_product_details_page(self):
+        url = self.url("shopapp:product_details", pk=self.product.pk)
+        etag = self.assertNotModified(url, 3)
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class OrderTotalsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty")
+        cls.laptop = Product.objects.create(sku="A-1", name="Laptop", price="100.00", discount=10, created_by=cls.user)
+        cls.mouse = Product.objects.create(sku="A-2", name="Mouse", price="50.00", created_by=cls.user)
+
+    def setUp(self) -> None:
+        self.order = Order.objects.create(user=self.user)
+
+    def assertTotals(self, order: Order, items_count, subtotal, total_after_discount):
+        order.refresh_from_db()
+        self.assertEqual(
+            (order.items_count, order.subtotal, order.total_after_discount),
+            (items_count, Decimal(subtotal), Decimal(total_after_discount)),
+        )
+
+    def test_products_changes(self):
+        self.assertTotals(self.order, 0, "0", "0")
+        self.order.products.add(self.laptop, self.mouse)
+        self.assertTotals(self.order, 2, "150", "140")
+        self.order.products.remove(self.mouse)
+        self.assertTotals(self.order, 1, "100", "90")
+        self.mouse.orders.add(self.order)
+        self.assertTotals(self.order, 2, "150", "140")
+        self.laptop.orders.clear()
+        self.assertTotals(self.order, 1, "50", "50")
+        self.order.products.clear()
+        self.assertTotals(self.order, 0, "0", "0")
+
+    def test_product_price_changes(self):
+        self.order.products.add(self.laptop, self.mouse)
+        laptop = Product.objects.get(pk=self.laptop.pk)
+        laptop.discount = 50
+        laptop.save()
+        self.assertTotals(self.order, 2, "150", "100")
+        laptop.delete()
+        self.assertTotals(self.order, 1, "50", "50")
+
+    def test_admin_inline_changes(self):
+        # The inline saves and deletes through rows, no signals are sent for them
+        admin_user = User.objects.create_superuser(username="admin", password="admin")
+        self.client.force_login(admin_user)
+        self.order.products.add(self.laptop)
+        self.assertTotals(self.order, 1, "100", "90")
+        updated_at = Order.objects.get(pk=self.order.pk).updated_at
+        with translation.override("en"):
+            url = reverse("admin:shopapp_order_change", args=[self.order.pk])
+        prefix = self.client.get(url).context["inline_admin_formsets"][0].formset.prefix
+        row = Order.products.through.objects.get(order=self.order)
+        data = {
+            "user": self.user.pk,
+            "products": [self.laptop.pk],
+            "promocode": "",
+            "delivery_address": "",
+            f"{prefix}-TOTAL_FORMS": 2,
+            f"{prefix}-INITIAL_FORMS": 1,
+            f"{prefix}-0-id": row.pk,
+            f"{prefix}-0-order": self.order.pk,
+            f"{prefix}-0-product": self.laptop.pk,
+            f"{prefix}-1-order": self.order.pk,
+            f"{prefix}-1-product": self.mouse.pk,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertTotals(self.order, 2, "150", "140")
+        self.assertGreater(Order.objects.get(pk=self.order.pk).updated_at, updated_at)
+        self.assertEqual(DailySales.objects.get().items_count, 2)
+
+        data.update({
+            f"{prefix}-TOTAL_FORMS": 2,
+            f"{prefix}-INITIAL_FORMS": 2,
+            f"{prefix}-1-id": Order.products.through.objects.get(order=self.order, product=self.mouse).pk,
+            f"{prefix}-1-DELETE": "on",
+            "products": [self.laptop.pk, self.mouse.pk],
+        })
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertTotals(self.order, 1, "100", "90")
+        self.assertEqual(DailySales.objects.get().items_count, 1)
+
+    def test_import_and_batch_create(self):
+        with translation.override("en"):
+            response = self.client.post(
+                reverse("shopapp:order-batch"),
+                [{"user": self.user.pk, "products": [self.laptop.pk]}],
+                content_type="application/json",
+            )
+        order = Order.objects.get(pk=response.json()["results"][0]["pk"])
+        self.assertTotals(order, 1, "100", "90")
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = Path(tmp_dir.name) / "products.ndjson"
+        path.write_text('{"sku": "A-1", "name": "Laptop", "price": "200.00", "discount": 0}\n')
+        call_command("import_products", path, stdout=StringIO())
+        self.assertTotals(order, 1, "200", "200")
+
+    def test_command(self):
+        self.order.products.add(self.laptop)
+        Order.objects.update(items_count=5)
+        with self.assertRaisesMessage(CommandError, "1 orders have wrong totals"):
+            call_command("order_totals", verify=True, stdout=StringIO())
+        call_command("order_totals", batch_size=1, stdout=StringIO())
+        self.assertTotals(self.order, 1, "100", "90")
+        call_command("order_totals", verify=True, stdout=StringIO())
+
+    def test_ordering_by_total(self):
+        self.order.products.add(self.mouse)
+        Order.objects.create(user=self.user).products.add(self.laptop)
+        self.client.force_login(self.user)
+        with translation.override("en"):
+            response = self.client.get(reverse("shopapp:order-list"), {"ordering": "-total_after_discount"})
+        totals = [order["total_after_discount"] for order in response.json()["results"]]
+        self.assertEqual(totals, ["90.00", "50.00"])
+
+
+class SalesRollupsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="probe_name", password="qwerty", is_staff=True)
+        cls.laptop = Product.objects.create(name="Laptop", price="100.00", discount=10, created_by=cls.user)
+        cls.mouse = Product.objects.create(name="Mouse", price="50.00", created_by=cls.user)
+
+    def create_order(self, *products) -> Order:
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(user=self.user)
+            order.products.add(*products)
+        return order
+
+    def get_daily(self) -> list:
+        return list(DailySales.objects.values_list("day", "orders_count", "items_count", "revenue"))
+
+    def get_products(self) -> dict:
+        return {
+            product_id: (units, revenue)
+            for product_id, units, revenue in ProductDailySales.objects.values_list("product", "units", "revenue")
+        }
+
+    def test_incremental_updates(self):
+        today = timezone.localdate()
+        order = self.create_order(self.laptop, self.mouse)
+        self.create_order(self.laptop)
+        self.assertEqual(self.get_daily(), [(today, 2, 3, Decimal("230"))])
+        self.assertEqual(self.get_products(), {self.laptop.pk: (2, Decimal("180")), self.mouse.pk: (1, Decimal("50"))})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.products.remove(self.mouse)
+        self.assertEqual(self.get_daily(), [(today, 2, 2, Decimal("180"))])
+        self.assertEqual(self.get_products(), {self.laptop.pk: (2, Decimal("180"))})
+
+        laptop = Product.objects.get(pk=self.laptop.pk)
+        laptop.discount = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            laptop.save()
+        self.assertEqual(self.get_daily(), [(today, 2, 2, Decimal("200"))])
+        self.assertEqual(self.get_products(), {self.laptop.pk: (2, Decimal("200"))})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.all().delete()
+        self.assertEqual(self.get_daily(), [])
+        self.assertEqual(self.get_products(), {})
+
+    def test_matches_rebuild(self):
+        first = self.create_order(self.laptop, self.mouse)
+        second = self.create_order(self.mouse)
+        Order.objects.filter(pk=second.pk).update(created_at=timezone.now() - datetime.timedelta(days=3))
+        call_command("rebuild_sales", stdout=StringIO())
+        self.create_order(self.laptop).products.clear()
+        mouse = Product.objects.get(pk=self.mouse.pk)
+        mouse.price = "55.55"
+        mouse.discount = 3
+        mouse.save()
+        mouse.orders.add(self.create_order(self.laptop))
+        first.products.remove(self.laptop)
+        self.laptop.orders.clear()
+        self.laptop.orders.add(first, second)
+        Product.objects.create(name="Cable", price="9.99", created_by=self.user).orders.add(first)
+        Product.objects.filter(pk=self.laptop.pk).delete()
+        Order.objects.filter(pk=second.pk).delete()
+
+        daily, products = self.get_daily(), self.get_products()
+        call_command("rebuild_sales", stdout=StringIO())
+        self.assertEqual(self.get_daily(), daily)
+        self.assertEqual(self.get_products(), products)
+
+    def test_queries_do_not_grow_with_the_day(self):
+        def add_to_new_order() -> int:
+            order = Order.objects.create(user=self.user)
+            with CaptureQueriesContext(connection) as queries:
+                order.products.add(self.laptop, self.mouse)
+            return len(queries)
+
+        few = add_to_new_order()
+        for _ in range(20):
+            self.create_order(self.laptop, self.mouse)
+        self.assertEqual(add_to_new_order(), few)
+
+    def test_rebuild_command(self):
+        order = self.create_order(self.laptop)
+        day = datetime.date(2023, 1, 15)
+        Order.objects.filter(pk=order.pk).update(created_at=datetime.datetime(2023, 1, 15, 12, tzinfo=datetime.timezone.utc))
+        call_command("rebuild_sales", stdout=StringIO())
+        self.assertEqual(self.get_daily(), [(day, 1, 1, Decimal("90"))])
+        self.assertEqual(list(ProductDailySales.objects.values_list("day", "product")), [(day, self.laptop.pk)])
+
+    def test_api(self):
+        self.create_order(self.laptop, self.mouse)
+        self.create_order(self.laptop)
+        today = timezone.localdate().isoformat()
+        with translation.override("en"):
+            daily_url = reverse("shopapp:dailysales-list")
+            summary_url = reverse("shopapp:dailysales-summary")
+            products_url = reverse("shopapp:productdailysales-summary")
+
+        self.assertEqual(self.client.get(daily_url).status_code, 403)
+        self.client.force_login(self.user)
+        results = self.client.get(daily_url, {"day__gte": today}).json()["results"]
+        self.assertEqual([(row["day"], row["revenue"]) for row in results], [(today, "230.00")])
+        self.assertEqual(self.client.get(daily_url, {"day__gt": today, "day__lte": "2000-01-01"}).status_code, 200)
+
+        summary = self.client.get(summary_url, {"day__lte": today}).json()
+        self.assertEqual((summary["orders_count"], summary["revenue"]), (2, "230.00"))
+        top = self.client.get(products_url, {"limit": 1}).json()
+        self.assertEqual([(row["name"], row["units"]) for row in top], [("Laptop", 2)])
+
+
+class GenerateDataCommandTestCase(TestCase):
+
+    def generate(self, prefix: str, **options):
+        options = {"users": 5, "products": 20, "orders": 60, "articles": 10, "news": 7, "housing": 3, **options}
+        call_command("generate_data", seed=1, prefix=prefix, batch_size=25, stdout=StringIO(), **options)
+
+    def test_generate(self):
+        self.generate("a")
+        self.assertEqual(User.objects.filter(username__startswith="a_user_").count(), 5)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(Order.objects.count(), 60)
+        self.assertGreater(Order.products.through.objects.count(), 60)
+        self.assertEqual(Article.objects.count(), 10)
+        self.assertEqual(News.objects.count(), 7)
+        self.assertEqual(Housing.objects.count(), 3)
+        # Totals and rollups are consistent with the generated orders
+        call_command("order_totals", verify=True, stdout=StringIO())
+        self.assertEqual(DailySales.objects.aggregate(orders=Sum("orders_count"))["orders"], 60)
+
+    def test_deterministic(self):
+        self.generate("a", orders=0, articles=0, news=0, housing=0)
+        self.generate("b", orders=0, articles=0, news=0, housing=0)
+        products = Product.objects.order_by("pk").values_list("sku", "name", "price", "created_at")
+        first, second = products[:20], products[20:]
+        self.assertEqual([row[1:] for row in first], [row[1:] for row in second])
+        self.assertEqual([row[0][2:] for row in first], [row[0][2:] for row in second])
+
+    def test_timestamps(self):
+        now = datetime.datetime(2023, 6, 1, tzinfo=datetime.timezone.utc)
+        self.generate("a", users=2, products=5, orders=30, articles=3, news=0, housing=0, now=now, days=10)
+        for model, field in ((Product, "created_at"), (Order, "created_at"), (Article, "pub_date")):
+            dates = model.objects.aggregate(first=Min(field), last=Max(field))
+            self.assertGreaterEqual(dates["first"], now - datetime.timedelta(days=10, hours=1), model)
+            self.assertLessEqual(dates["last"], now, model)
+            # The fields stay auto_now_add for everyone else
+            self.assertTrue(model._meta.get_field(field).auto_now_add)
+        self.assertGreater(Product.objects.create(name="Laptop").created_at, now + datetime.timedelta(days=1))
+
+
+class BenchmarkEndpointsCommandTestCase(TestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        User.objects.create_superuser(username="admin", password="admin")
+
+    def benchmark(self, **options) -> dict:
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / "results.json"
+            call_command(
+                "benchmark_endpoints", requests=3, warmup=1, output=output, stdout=StringIO(), **options
+            )
+            return json.loads(output.read_text())
+
+    def test_results(self):
+        results = self.benchmark()
+        for name, result in results["endpoints"].items():
+            self.assertEqual(result["requests"], 3, name)
+            self.assertEqual(result["errors"], 0, name)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"], name)
+        # Pages from the page cache make no queries after the warmup
+        self.assertEqual(results["endpoints"]["news"]["queries_per_request"], 0)
+        self.assertGreater(results["endpoints"]["shop-orders"]["queries_per_request"], 0)
+
+    def test_counts_queries_on_every_alias(self):
+        def request(client, path):
+            User.objects.using("default").exists()
+            User.objects.using("replica").exists()
+            return 200
+
+        command = BenchmarkEndpointsCommand()
+        command.options = {"base_url": None}
+        command.user = None
+        with mock.patch.object(BenchmarkEndpointsCommand, "request_in_process", side_effect=request):
+            latencies, status_codes, queries = command.run_worker(ENDPOINTS["news"], "/", 2)
+        self.assertEqual(status_codes, {200: 2})
+        self.assertEqual(queries, 4)
+
+    def test_compare(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = Path(directory) / "baseline.json"
+            baseline.write_text(json.dumps({"endpoints": {
+                "news": {"p95_ms": 1000000, "queries_per_request": 100},
+            }}))
+            call_command("benchmark_endpoints", endpoint=["news"], requests=2, compare=baseline, stdout=StringIO())
+
+            baseline.write_text(json.dumps({"endpoints": {
+                "news": {"p95_ms": 0.0001, "queries_per_request": 0},
+            }}))
+            with self.assertRaisesMessage(CommandError, "news: p95"):
+                call_command(
+                    "benchmark_endpoints", endpoint=["news"], requests=2, compare=baseline, stdout=StringIO()
+                )
+
+
+class ShopQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username="admin", password="admin")
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Product {index}", price=10 + index, created_by=cls.user) for index in range(3)
+        )
+        cls.order = Order.objects.create(user=cls.user)
+
+    def setUp(self) -> None:
+        # Budgets include loading the session and the user
+        self.client.force_login(self.user)
+
+    def url(self, name, **kwargs):
+        with translation.override("en"):
+            return reverse(name, kwargs=kwargs)
+
+    def create_products(self, count: int) -> None:
+        Product.objects.bulk_create(
+            Product(name=f"Product {index}", created_by=self.user) for index in range(count)
+        )
+
+    def create_orders(self, count: int, user=None) -> None:
+        for index in range(count):
+            order = Order.objects.create(user=user or User.objects.create_user(username=f"user_{uuid4().hex}"))
+            order.products.add(*self.products)
+
+    def create_order_products(self, count: int) -> None:
+        self.order.products.add(*Product.objects.bulk_create(
+            Product(name=f"Product {index}", created_by=self.user) for index in range(count)
+        ))
+
+    def create_users(self, count: int) -> None:
+        User.objects.bulk_create(User(username=f"user_{uuid4().hex}") for _ in range(count))
+
+    def create_groups(self, count: int) -> None:
+        permissions = list(Permission.objects.all()[:3])
+        for _ in range(count):
+            Group.objects.create(name=f"group_{uuid4().hex}").permissions.add(*permissions)
+
+    def create_daily_sales(self, count: int) -> None:
+        start = DailySales.objects.count()
+        DailySales.objects.bulk_create(
+            DailySales(day=datetime.date(2023, 1, 1) + datetime.timedelta(days=start + index))
+            for index in range(count)
+        )
+        ProductDailySales.objects.bulk_create(
+            ProductDailySales(
+                day=datetime.date(2023, 1, 1) + datetime.timedelta(days=start + index),
+                product=product,
+                units=1,
+            )
+            for index in range(count)
+            for product in self.products
+        )
+
+    def test_products(self):
+        self.assertQueryBudget(self.url("shopapp:products_list"), self.create_products, queries=3, seconds=1)
+        self.assertQueryBudget(
+            self.url("shopapp:product_details", pk=self.products[0].pk), self.create_products, queries=5, seconds=1,
+        )
+
+    def test_orders(self):
+        self.assertQueryBudget(self.url("shopapp:orders_list"), self.create_orders, queries=4, seconds=1)
+        self.assertQueryBudget(
+            self.url("shopapp:order_details", pk=self.order.pk), self.create_order_products, queries=4, seconds=1,
+        )
+        self.assertQueryBudget(self.url("shopapp:orders-export"), self.create_orders, queries=4, seconds=1)
+
+    def test_users(self):
+        self.assertQueryBudget(self.url("shopapp:users_list"), self.create_users, queries=1, seconds=1)
+        self.assertQueryBudget(self.url("shopapp:groups_list"), self.create_groups, queries=2, seconds=1)
+
+    def test_user_orders(self):
+        def create_orders(count):
+            self.create_orders(count, user=self.user)
+
+        self.assertQueryBudget(
+            self.url("shopapp:user_orders", pk=self.user.pk), create_orders, queries=5, seconds=1,
+        )
+        self.assertQueryBudget(
+            self.url("shopapp:user_orders_export", pk=self.user.pk), create_orders, queries=5, seconds=1,
+        )
+
+    def test_api(self):
+        self.assertQueryBudget(self.url("shopapp:product-list"), self.create_products, queries=4, seconds=1)
+        self.assertQueryBudget(
+            self.url("shopapp:product-detail", pk=self.products[0].pk), self.create_products, queries=4, seconds=1,
+        )
+        self.assertQueryBudget(self.url("shopapp:order-list"), self.create_orders, queries=5, seconds=1)
+        self.assertQueryBudget(
+            self.url("shopapp:order-detail", pk=self.order.pk), self.create_order_products, queries=5, seconds=1,
+        )
+
+    def test_sales_api(self):
+        for name in (
+            "shopapp:dailysales-list",
+            "shopapp:dailysales-summary",
+            "shopapp:productdailysales-list",
+            "shopapp:productdailysales-summary",
+        ):
+            with self.subTest(name):
+                self.assertQueryBudget(self.url(name), self.create_daily_sales, queries=3, seconds=1)
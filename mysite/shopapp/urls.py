@@ -4,6 +4,7 @@ from rest_framework.routers import DefaultRouter
 
 from .views import (
     ShopIndexView,
+    DailySalesViewSet,
     GroupsListView,
     OrderViewSet,
     OrdersListView,
@@ -18,9 +19,12 @@ from .views import (
     ProductUpdateView,
     ProductDeleteView,
     ProductViewSet,
+    ProductDailySalesViewSet,
     UsersListView,
     UserOrdersListView,
     UserOrdersDataExportView,
+    ProductAutocompleteView,
+    UserAutocompleteView,
 )
 
 app_name = "shopapp"
@@ -28,6 +32,8 @@ app_name = "shopapp"
 routers = DefaultRouter()
 routers.register("products", ProductViewSet)
 routers.register("orders", OrderViewSet)
+routers.register("sales/daily", DailySalesViewSet)
+routers.register("sales/products", ProductDailySalesViewSet)
 
 urlpatterns = [
     path("", ShopIndexView.as_view(), name="index"),
@@ -38,6 +44,7 @@ urlpatterns = [
     path("products/<int:pk>/", ProductDetailsView.as_view(), name="product_details"),
     path("products/<int:pk>/update/", ProductUpdateView.as_view(), name="product_update"),
     path("products/<int:pk>/archived/", ProductDeleteView.as_view(), name="product_delete"),
+    path("products/autocomplete/", ProductAutocompleteView.as_view(), name="products_autocomplete"),
 
     path("orders/", OrdersListView.as_view(), name="orders_list"),
     path("orders/export/", OrdersDataExportView.as_view(), name="orders-export"),
@@ -47,6 +54,7 @@ urlpatterns = [
     path("orders/<int:pk>/delete/", OrderDeleteView.as_view(), name="order_delete"),
 
     path("users/", UsersListView.as_view(), name="users_list"),
+    path("users/autocomplete/", UserAutocompleteView.as_view(), name="users_autocomplete"),
     path("users/<int:pk>/orders/", UserOrdersListView.as_view(), name="user_orders"),
     path("users/<int:pk>/orders/export/", UserOrdersDataExportView.as_view(), name="user_orders_export"),
 ]
@@ -4,25 +4,63 @@
 Разные View интернет-магазина: по товарам, заказам и т.д.
 """
 
+import json
+from collections import defaultdict
+from itertools import islice
 from timeit import default_timer
 
+from django.conf import settings
 from django.contrib.auth.models import Group, User
-from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse, HttpResponseNotFound, Http404
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, Sum
+from django.http import (
+    HttpResponse,
+    HttpRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+    HttpResponseNotFound,
+    Http404,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render, redirect, get_object_or_404, reverse
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views import View
 from django.views.generic import TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
-from rest_framework.viewsets import ModelViewSet
+from django.db import transaction
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 
-from .forms import GroupForm
-from .models import Product, Order
-from .serializers import ProductSerializers, OrderSerializers
+from mysite.cache_utils import get_or_compute
+from mysite.page_cache import cache_page_for
+
+from .caching import user_orders_export_key
+from .conditional import ConditionalGetMixin, product_last_modified, product_page_etag
+from .filters import ProductSearchFilter
+from .forms import GroupForm, OrderForm
+from .models import DailySales, Order, Product, ProductDailySales
+from .pagination import InvalidCursor, KeysetListMixin, KeysetPagination, paginate_keyset
+from .serializers import (
+    DailySalesSerializers,
+    DailySalesSummarySerializers,
+    OrderBatchItemSerializers,
+    OrderSerializers,
+    ProductDailySalesSerializers,
+    ProductSalesSummarySerializers,
+    ProductSerializers,
+)
+from .signals import orders_bulk_created
 
 import logging
 
@@ -31,15 +69,17 @@ logger = logging.getLogger(__name__)
 
 
 @extend_schema(description="Product views CRUD")
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, ModelViewSet):
     """
     Набор представлений для действий над Product
     Полный CRUD для сущностей товара
     """
+    read_replica = True
     queryset = Product.objects.all()
     serializer_class = ProductSerializers
+    pagination_class = KeysetPagination
     filter_backends = [
-        SearchFilter,
+        ProductSearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
@@ -69,6 +109,7 @@ class ProductViewSet(ModelViewSet):
         return super().retrieve(*args, **kwargs)
 
 
+@method_decorator(cache_page_for(), name="dispatch")
 class ShopIndexView(View):
     def get(self, request: HttpRequest) -> HttpResponse:
         products = [
@@ -100,6 +141,8 @@ class GroupsListView(View):
         return redirect(request.path)
 
 
+@method_decorator(condition(etag_func=product_page_etag, last_modified_func=product_last_modified), name="dispatch")
+@method_decorator(cache_page_for(Product), name="dispatch")
 class ProductDetailsView(DetailView):
 
     template_name = 'shopapp/products-details.html'
@@ -107,6 +150,7 @@ class ProductDetailsView(DetailView):
     context_object_name = "product"
 
 
+@method_decorator(cache_page_for(Product), name="dispatch")
 class ProductsListView(ListView):
     template_name = 'shopapp/products-list.html'
     # model = Product
@@ -122,9 +166,10 @@ class ProductCreateView(UserPassesTestMixin, CreateView):
     fields = "name", "price", "description", "discount"
     success_url = reverse_lazy("shopapp:products_list")
 
-    def get(self, request, *args, **kwargs):
-        logger.info(f'Пользователь {self.request.user.username} создал товар!')
-        return super().get(request, *args, **kwargs)
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        logger.info("Пользователь %s создал товар #%s", self.request.user.username, self.object.pk)
+        return response
 
 
 class ProductUpdateView(UserPassesTestMixin, UpdateView):
@@ -141,9 +186,10 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
             kwargs={"pk": self.object.pk}
         )
 
-    def get(self, request, *args, **kwargs):
-        logger.info(f'Пользователь {self.request.user.username} обновил товар!')
-        return super().get(request, *args, **kwargs)
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        logger.info("Пользователь %s обновил товар #%s", self.request.user.username, self.object.pk)
+        return response
 
 
 class ProductDeleteView(PermissionRequiredMixin, DeleteView):
@@ -158,9 +204,17 @@ class ProductDeleteView(PermissionRequiredMixin, DeleteView):
         return HttpResponseRedirect(success_url)
 
 
-class OrderViewSet(ModelViewSet):
-    queryset = Order.objects.all()
+class OrderViewSet(ConditionalGetMixin, ModelViewSet):
+    read_replica = True
+    queryset = (
+        Order.objects
+        .select_related("user")
+        .prefetch_related(
+            Prefetch("products", queryset=Product.objects.only("pk", "name")),
+        )
+    )
     serializer_class = OrderSerializers
+    pagination_class = KeysetPagination
     filter_backends = [
         SearchFilter,
         DjangoFilterBackend,
@@ -183,17 +237,165 @@ class OrderViewSet(ModelViewSet):
         "user__username",
         "delivery_address",
         "promocode",
+        "items_count",
+        "subtotal",
+        "total_after_discount",
     ]
+    batch_max_size = 500
+
+    @extend_schema(
+        summary="Create many orders at once",
+        description=(
+            "Validates all orders together and writes the valid ones with two bulk inserts "
+            "in one transaction. Returns a result for every order: **201** if all were created, "
+            "**207** if some were rejected, **400** if none were created."
+        ),
+        request=OrderBatchItemSerializers(many=True),
+    )
+    @action(detail=False, methods=["post"])
+    def batch(self, request: Request) -> Response:
+        items = request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError("Expected a non-empty list of orders")
+        if len(items) > self.batch_max_size:
+            raise ValidationError(f"At most {self.batch_max_size} orders can be created at once")
+
+        serializers = [OrderBatchItemSerializers(data=item) for item in items]
+        valid_data = [serializer.validated_data for serializer in serializers if serializer.is_valid()]
+        user_pks = set(
+            User.objects
+            .filter(pk__in={data["user"] for data in valid_data})
+            .values_list("pk", flat=True)
+        )
+        product_pks = set(
+            Product.objects
+            .filter(pk__in={pk for data in valid_data for pk in data["products"]})
+            .values_list("pk", flat=True)
+        )
 
+        results = []
+        orders = []
+        orders_products = []
+        for index, serializer in enumerate(serializers):
+            errors = dict(serializer.errors)
+            if not errors:
+                data = serializer.validated_data
+                if data["user"] not in user_pks:
+                    errors["user"] = [f"User {data['user']} does not exist"]
+                unknown_products = set(data["products"]) - product_pks
+                if unknown_products:
+                    errors["products"] = [f"Products {sorted(unknown_products)} do not exist"]
+            if errors:
+                results.append({"index": index, "status": "invalid", "errors": errors})
+                continue
+
+            results.append({"index": index, "status": "created"})
+            orders.append(Order(
+                user_id=data["user"],
+                delivery_address=data["delivery_address"],
+                promocode=data["promocode"],
+            ))
+            orders_products.append(dict.fromkeys(data["products"]))
+
+        if orders:
+            with transaction.atomic():
+                Order.objects.bulk_create(orders)
+                Order.products.through.objects.bulk_create(
+                    Order.products.through(order_id=order.pk, product_id=product_pk)
+                    for order, products in zip(orders, orders_products)
+                    for product_pk in products
+                )
+                orders_bulk_created.send(sender=Order, orders=orders)
+        created = iter(orders)
+        for result in results:
+            if result["status"] == "created":
+                result["pk"] = next(created).pk
+
+        if len(orders) == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif orders:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({"results": results}, status=response_status)
+
+
+class DailySalesViewSet(ReadOnlyModelViewSet):
+    """
+    Продажи по дням из таблицы DailySales (см. shopapp.rollups).
 
-class OrdersListView(LoginRequiredMixin, ListView):
-    queryset = (
+    Заказы не читаются, так что стоимость зависит только от числа дней в диапазоне.
+    """
+    read_replica = True
+    queryset = DailySales.objects.all()
+    serializer_class = DailySalesSerializers
+    permission_classes = [IsAdminUser]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = {"day": ["exact", "gte", "lte"]}
+    ordering_fields = ["day", "orders_count", "revenue"]
+
+    @extend_schema(responses=DailySalesSummarySerializers)
+    @action(detail=False)
+    def summary(self, request: Request) -> Response:
+        totals = self.filter_queryset(self.get_queryset()).aggregate(**{
+            field: Sum(field, default=0)
+            for field in ("orders_count", "items_count", "subtotal", "revenue")
+        })
+        return Response(DailySalesSummarySerializers(totals).data)
+
+
+class ProductDailySalesViewSet(ReadOnlyModelViewSet):
+    """Продажи товаров по дням из таблицы ProductDailySales."""
+    read_replica = True
+    queryset = ProductDailySales.objects.all()
+    serializer_class = ProductDailySalesSerializers
+    permission_classes = [IsAdminUser]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = {"day": ["exact", "gte", "lte"], "product": ["exact"]}
+    ordering_fields = ["day", "units", "revenue"]
+    summary_max_limit = 100
+
+    @extend_schema(responses=ProductSalesSummarySerializers(many=True))
+    @action(detail=False)
+    def summary(self, request: Request) -> Response:
+        """Товары с наибольшей выручкой за период, ``?limit=`` (по умолчанию 10)."""
+        try:
+            limit = min(int(request.query_params.get("limit", 10)), self.summary_max_limit)
+        except ValueError:
+            raise ValidationError({"limit": "Expected an integer"})
+        products = (
+            self.filter_queryset(self.get_queryset())
+            .order_by()
+            .values("product", "product__name")
+            .annotate(units=Sum("units"), revenue=Sum("revenue"))
+            .order_by("-revenue", "product")[:limit]
+        )
+        return Response(ProductSalesSummarySerializers(products, many=True).data)
+
+
+def order_list_queryset():
+    """Заказы только с теми полями, что выводят списки заказов."""
+    return (
         Order.objects
         .select_related("user")
-        .prefetch_related("products")
+        .only(
+            "delivery_address", "promocode", "updated_at",
+            "items_count", "subtotal", "total_after_discount",
+            "user__username", "user__first_name",
+        )
+        .prefetch_related(Prefetch("products", queryset=Product.objects.only("name", "price")))
     )
 
 
+class OrdersListView(LoginRequiredMixin, KeysetListMixin, ListView):
+    read_replica = True
+    queryset = order_list_queryset()
+    ordering = ["-pk"]
+    paginate_by = 50
+
+
 class OrdersDetailView(PermissionRequiredMixin, DetailView):
     permission_required = "shopapp.view_order"
     queryset = (
@@ -203,19 +405,62 @@ class OrdersDetailView(PermissionRequiredMixin, DetailView):
     )
 
 
+class AutocompleteView(LoginRequiredMixin, View):
+    """
+    Варианты для виджетов shopapp.widgets: ``?q=`` - начало search_field
+    без учёта регистра, ``?cursor=`` - следующая страница.
+
+    istartswith в PostgreSQL использует индекс по UPPER(...) из миграции 0014.
+    """
+    read_replica = True
+    queryset = None
+    search_field = None
+    page_size = 20
+
+    def get_queryset(self):
+        queryset = self.queryset.all()
+        query = self.request.GET.get("q", "").strip()
+        if query:
+            queryset = queryset.filter(**{f"{self.search_field}__istartswith": query})
+        return queryset
+
+    def get(self, request: HttpRequest) -> JsonResponse:
+        try:
+            page = paginate_keyset(
+                self.get_queryset(), self.page_size, request.GET.get("cursor"), [self.search_field, "pk"],
+            )
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        return JsonResponse({
+            "results": [{"id": obj.pk, "text": str(obj)} for obj in page.object_list],
+            "next": page.next_cursor,
+        })
+
+
+class ProductAutocompleteView(AutocompleteView):
+    queryset = Product.objects.filter(archived=False).only("name")
+    search_field = "name"
+
+
+class UserAutocompleteView(AutocompleteView):
+    queryset = User.objects.only("username")
+    search_field = "username"
+
+
 class OrderCreateView(CreateView):
     model = Order
-    fields = "products", "delivery_address", "promocode", "user"
+    form_class = OrderForm
     success_url = reverse_lazy("shopapp:orders_list")
 
-    def get(self, request, *args, **kwargs):
-        logger.info('Создан заказ!')
-        return super().get(request, *args, **kwargs)
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        logger.info("Создан заказ #%s", self.object.pk)
+        return response
 
 
 class OrderUpdateView(UpdateView):
     model = Order
-    fields = "products", "delivery_address", "promocode", "user"
+    form_class = OrderForm
     template_name_suffix = "_update_form"
 
     def get_success_url(self):
@@ -224,9 +469,10 @@ class OrderUpdateView(UpdateView):
             kwargs={"pk": self.object.pk}
         )
 
-    def get(self, request, *args, **kwargs):
-        logger.info('Обновлен заказ!')
-        return super().get(request, *args, **kwargs)
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        logger.info("Обновлен заказ #%s", self.object.pk)
+        return response
 
 
 class OrderDeleteView(DeleteView):
@@ -235,34 +481,78 @@ class OrderDeleteView(DeleteView):
 
 
 class OrdersDataExportView(UserPassesTestMixin, View):
+    """
+    Выгрузка всех заказов в JSON.
+
+    Заказы читаются пачками по ``chunk_size`` через серверный курсор,
+    товары для каждой пачки достаются одним запросом.
+    С параметром ``?stream=1`` ответ отдаётся потоком (StreamingHttpResponse).
+    """
+    read_replica = True
+    chunk_size = 2000
+
     def test_func(self):
         return self.request.user.is_staff
 
-    def get(self, request: HttpRequest) -> JsonResponse:
-        orders = Order.objects.order_by("pk").all()
-        orders_data = [
-            {
-                "pk": order.pk,
-                "delivery_address": order.delivery_address,
-                "promocode": order.promocode,
-                "products": [product.pk for product in order.products.all()],
-                "user": order.user.pk,
+    def iter_orders_chunks(self):
+        orders = (
+            Order.objects
+            .order_by("pk")
+            .values_list("pk", "delivery_address", "promocode", "user_id")
+            .iterator(chunk_size=self.chunk_size)
+        )
+        while chunk := list(islice(orders, self.chunk_size)):
+            yield chunk
+
+    def iter_orders_data(self):
+        for chunk in self.iter_orders_chunks():
+            products = defaultdict(list)
+            order_products = (
+                Order.products.through.objects
+                .filter(order_id__gte=chunk[0][0], order_id__lte=chunk[-1][0])
+                .order_by("order_id", "product__name", "product__price", "product_id")
+                .values_list("order_id", "product_id")
+            )
+            for order_pk, product_pk in order_products:
+                products[order_pk].append(product_pk)
+
+            for pk, delivery_address, promocode, user_pk in chunk:
+                yield {
+                    "pk": pk,
+                    "delivery_address": delivery_address,
+                    "promocode": promocode,
+                    "products": products[pk],
+                    "user": user_pk,
+                }
 
-            }
-            for order in orders
-        ]
-        return JsonResponse({"orders": orders_data})
+    def iter_json(self):
+        # Same bytes as JsonResponse({"orders": [...]}) would produce
+        yield '{"orders": ['
+        for index, order_data in enumerate(self.iter_orders_data()):
+            if index:
+                yield ", "
+            yield json.dumps(order_data, cls=DjangoJSONEncoder)
+        yield "]}"
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        if request.GET.get("stream"):
+            return StreamingHttpResponse(self.iter_json(), content_type="application/json")
+        return HttpResponse("".join(self.iter_json()), content_type="application/json")
 
 
 class UsersListView(ListView):
+    read_replica = True
     template_name = 'shopapp/users-list.html'
     model = User
     context_object_name = "users"
 
 
-class UserOrdersListView(UserPassesTestMixin, ListView):
+class UserOrdersListView(UserPassesTestMixin, KeysetListMixin, ListView):
 
+    read_replica = True
     template_name = 'shopapp/user_orders.html'
+    context_object_name = "orders"
+    paginate_by = 50
 
     def test_func(self):
         return self.request.user.is_authenticated
@@ -272,13 +562,12 @@ class UserOrdersListView(UserPassesTestMixin, ListView):
         self.owner = None
 
     def get_queryset(self):
-        self.owner = get_object_or_404(User, pk=self.kwargs.get('pk'))
-        return self.owner
+        self.owner = get_object_or_404(User.objects.only("username", "first_name"), pk=self.kwargs.get('pk'))
+        return order_list_queryset().filter(user=self.owner).order_by("-pk")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["user"] = self.owner
-        context["orders"] = Order.objects.filter(user=self.owner).prefetch_related("products")
         return context
 
 
@@ -286,23 +575,26 @@ class UserOrdersDataExportView(UserPassesTestMixin, View):
     def test_func(self):
         return self.request.user.is_authenticated
 
-    def get(self, request: HttpRequest, pk) -> JsonResponse:
-        cache_key = f"user_{pk}_orders_data_export"
-        orders_data = cache.get(cache_key)
-        if orders_data is None:
-            user = get_object_or_404(User, pk=pk)
-            orders = Order.objects.order_by("pk").filter(user=user).prefetch_related("products")
-            orders_data = [
-                {
-                    "pk": order.pk,
-                    "delivery_address": order.delivery_address,
-                    "promocode": order.promocode,
-                    "products": [product.pk for product in order.products.all()],
-                    "user": user.pk,
+    def get_orders_data(self, pk) -> list:
+        user = get_object_or_404(User, pk=pk)
+        orders = Order.objects.order_by("pk").filter(user=user).prefetch_related("products")
+        return [
+            {
+                "pk": order.pk,
+                "delivery_address": order.delivery_address,
+                "promocode": order.promocode,
+                "products": [product.pk for product in order.products.all()],
+                "user": user.pk,
 
-                }
-                for order in orders
-            ]
-            cache.set(cache_key, orders_data, 180)
-        return JsonResponse({"orders": orders_data})
+            }
+            for order in orders
+        ]
 
+    def get(self, request: HttpRequest, pk) -> JsonResponse:
+        orders_data = get_or_compute(
+            user_orders_export_key(pk),
+            lambda: self.get_orders_data(pk),
+            settings.ORDERS_EXPORT_CACHE_TIMEOUT,
+            metrics_name="orders_export_cache",
+        )
+        return JsonResponse({"orders": orders_data})
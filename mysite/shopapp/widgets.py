@@ -0,0 +1,46 @@
+"""
+Виджеты выбора с подгрузкой вариантов по мере ввода.
+
+В HTML попадают только выбранные значения, остальные варианты
+shopapp/autocomplete.js запрашивает у JSON-представления из
+shopapp.views (AutocompleteView), так что форма заказа не читает
+все товары и всех пользователей.
+"""
+
+from django import forms
+from django.urls import reverse
+
+
+class AutocompleteMixin:
+    def __init__(self, url_name: str, attrs=None, choices=()):
+        super().__init__(attrs, choices)
+        self.url_name = url_name
+
+    class Media:
+        js = ["shopapp/autocomplete.js"]
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs["data-autocomplete-url"] = reverse(self.url_name)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        # Как AutocompleteMixin в django.contrib.admin: только выбранные
+        selected = {str(v) for v in value if v not in ("", None)}
+        options = []
+        if selected:
+            queryset = self.choices.queryset.filter(pk__in=selected)
+            for obj in queryset:
+                options.append(self.create_option(
+                    name, self.choices.field.prepare_value(obj), self.choices.field.label_from_instance(obj),
+                    True, len(options), attrs=attrs,
+                ))
+        return [(None, options, 0)]
+
+
+class AutocompleteSelect(AutocompleteMixin, forms.Select):
+    pass
+
+
+class AutocompleteSelectMultiple(AutocompleteMixin, forms.SelectMultiple):
+    pass